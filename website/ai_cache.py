@@ -0,0 +1,226 @@
+"""
+Content-addressed cache for /api/proxy-ai responses
+
+Many users send byte-identical prompts (the same application questions with
+the same resume). With AI_CACHE_ENABLED=1, successful Gemini responses are
+kept under sha256(model, normalized prompt), where normalization applies
+Unicode NFC and collapses whitespace runs, in two tiers:
+
+- memory: an LRU of AI_CACHE_MEMORY_ENTRIES entries, AI_CACHE_MEMORY_TTL
+  seconds each
+- disk: one JSON file per entry under AI_CACHE_DIR, AI_CACHE_DISK_TTL
+  seconds each, least recently used files evicted once they add up to more
+  than AI_CACHE_DISK_MAX_BYTES
+
+Disk hits are promoted to memory. A request with bypass_cache=true skips
+the lookup but still stores the fresh response. Workers sharing AI_CACHE_DIR
+share entries; each one only accounts for the files it has seen, so the
+size bound is per worker.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+AI_CACHE_ENABLED = os.environ.get("AI_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+AI_CACHE_MEMORY_ENTRIES = int(os.environ.get("AI_CACHE_MEMORY_ENTRIES", "1000"))
+AI_CACHE_MEMORY_TTL = float(os.environ.get("AI_CACHE_MEMORY_TTL", "3600"))
+AI_CACHE_DIR = os.environ.get("AI_CACHE_DIR", "")
+AI_CACHE_DISK_TTL = float(os.environ.get("AI_CACHE_DISK_TTL", "86400"))
+AI_CACHE_DISK_MAX_BYTES = int(os.environ.get("AI_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+def cache_key(model: str, prompt: str) -> str:
+    normalized = " ".join(unicodedata.normalize("NFC", prompt).split())
+    return hashlib.sha256(f"{model}\0{normalized}".encode()).hexdigest()
+
+
+class ResponseCache:
+    """Memory LRU in front of an optional size-bounded directory of entries"""
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        memory_entries: Optional[int] = None,
+        memory_ttl: Optional[float] = None,
+        directory: Optional[str] = None,
+        disk_ttl: Optional[float] = None,
+        disk_max_bytes: Optional[int] = None,
+    ):
+        self.enabled = AI_CACHE_ENABLED if enabled is None else enabled
+        self.memory_entries = AI_CACHE_MEMORY_ENTRIES if memory_entries is None else memory_entries
+        self.memory_ttl = AI_CACHE_MEMORY_TTL if memory_ttl is None else memory_ttl
+        self.directory = AI_CACHE_DIR if directory is None else directory
+        self.disk_ttl = AI_CACHE_DISK_TTL if disk_ttl is None else disk_ttl
+        self.disk_max_bytes = AI_CACHE_DISK_MAX_BYTES if disk_max_bytes is None else disk_max_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        # key -> (expiry as a time.time() value, response)
+        self._memory: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        # key -> file size, least recently used first; None until first disk use
+        self._files: "Optional[OrderedDict[str, int]]" = None
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+    # Memory tier
+    def _memory_get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return entry[1]
+
+    def _memory_put(self, key: str, response: Dict, expires_at: float):
+        if self.memory_entries <= 0:
+            return
+        with self._lock:
+            self._memory[key] = (expires_at, response)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    # Disk tier (blocking; called on a worker thread)
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _scan(self):
+        """Account for entries already on disk, oldest access first"""
+        if self._files is not None:
+            return
+        found = []
+        if os.path.isdir(self.directory):
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if name.endswith(".json"):
+                        stat = os.stat(os.path.join(root, name))
+                        found.append((stat.st_mtime, name[:-5], stat.st_size))
+        found.sort()
+        self._files = OrderedDict((key, size) for _, key, size in found)
+        self._disk_bytes = sum(self._files.values())
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, Dict]]:
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except OSError:
+            return None
+        except ValueError:
+            entry = None
+        if not (
+            isinstance(entry, dict)
+            and isinstance(entry.get("expires_at"), (int, float))
+            and isinstance(entry.get("response"), dict)
+        ):
+            # Torn or foreign file: treat as a miss and make room for a fresh entry
+            self._disk_remove(key)
+            return None
+        if entry["expires_at"] <= time.time():
+            self._disk_remove(key)
+            return None
+        with self._lock:
+            self._scan()
+            if key in self._files:
+                self._files.move_to_end(key)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry["expires_at"], entry["response"]
+
+    def _disk_remove(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+        with self._lock:
+            self._scan()
+            self._disk_bytes -= self._files.pop(key, 0)
+
+    def _disk_put(self, key: str, response: Dict, expires_at: float):
+        data = json.dumps({"expires_at": expires_at, "response": response}).encode()
+        if len(data) > self.disk_max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._scan()
+            self._disk_bytes += len(data) - self._files.pop(key, 0)
+            self._files[key] = len(data)
+            evicted = []
+            while self._disk_bytes > self.disk_max_bytes:
+                old_key, size = self._files.popitem(last=False)
+                self._disk_bytes -= size
+                evicted.append(old_key)
+            self.evictions += len(evicted)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    # API
+    async def get(self, model: str, prompt: str) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        key = cache_key(model, prompt)
+        response = self._memory_get(key)
+        if response is not None:
+            self.memory_hits += 1
+            return response
+        if self.directory:
+            entry = await asyncio.to_thread(self._disk_get, key)
+            if entry is not None:
+                self.disk_hits += 1
+                expires_at, response = entry
+                self._memory_put(key, response, min(expires_at, time.time() + self.memory_ttl))
+                return response
+        self.misses += 1
+        return None
+
+    async def put(self, model: str, prompt: str, response: Dict):
+        if not self.enabled:
+            return
+        key = cache_key(model, prompt)
+        now = time.time()
+        self._memory_put(key, response, now + self.memory_ttl)
+        if self.directory:
+            try:
+                await asyncio.to_thread(self._disk_put, key, response, now + self.disk_ttl)
+            except OSError as e:
+                print(f"Error writing AI cache entry: {e}")
+        self.stores += 1
+
+    def stats(self) -> Dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "memory_entries": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_rate": (
+                round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+            ),
+        }
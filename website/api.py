@@ -4,25 +4,46 @@ Handles license validation, usage tracking, and AI proxy
 """
 
 from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
+from collections import OrderedDict
+import asyncio
+import base64
 import hashlib
 import hmac
 import secrets
+import threading
 import time
 import json
 import os
 from datetime import datetime, timedelta
+import anyio
 import httpx
 
 router = APIRouter(prefix="/api", tags=["extension"])
 
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
+GEMINI_API_BASE = os.environ.get(
+    "GEMINI_API_BASE", "https://generativelanguage.googleapis.com"
+)
+GEMINI_MODEL = "gemini-2.5-flash"
 LICENSE_SECRET = os.environ.get("LICENSE_SECRET", secrets.token_hex(32))
+# V2 keys are only verifiable with a secret that survives restarts and is
+# shared by every worker, so they are issued only when one is configured
+LICENSE_SECRET_CONFIGURED = "LICENSE_SECRET" in os.environ
+REJECTED_KEY_CACHE_SIZE = int(os.environ.get("REJECTED_KEY_CACHE_SIZE", "10000"))
+REJECTED_KEY_CACHE_TTL = float(os.environ.get("REJECTED_KEY_CACHE_TTL", "60"))
 FREE_TRIAL_LIMIT = 999999  # Effectively unlimited for everyone
 JOB_API_BASE_URL = os.environ.get("JOB_API_BASE_URL", "")
 JOB_API_KEY = os.environ.get("JOB_API_KEY", "")
 MAX_FREE_AUTO_APPLY = 5
+LICENSE_PERIOD = timedelta(days=31)
+ADMIN_PAGE_LIMIT = 1000
+ADMIN_STREAM_BATCH = 500
+ADMIN_BATCH_LIMIT = int(os.environ.get("ADMIN_BATCH_LIMIT", "50000"))
+AI_BATCH_MAX_ITEMS = int(os.environ.get("AI_BATCH_MAX_ITEMS", "50"))
+AI_BATCH_CONCURRENCY = int(os.environ.get("AI_BATCH_CONCURRENCY", "8"))
 
 # Whitelisted emails with unlimited free access (owner/testing)
 WHITELIST_EMAILS = {
@@ -30,40 +51,66 @@ WHITELIST_EMAILS = {
 }
 
 
-def is_whitelisted_user(email: str) -> bool:
-    """Check if user email is whitelisted for free unlimited access"""
-    return email.lower() in {e.lower() for e in WHITELIST_EMAILS}
+WHITELIST_EMAILS_LOWER = frozenset(e.lower() for e in WHITELIST_EMAILS)
 
 
-def get_user_email_from_license(license_key: str) -> Optional[str]:
-    """Extract user email from license key"""
-    license_data = db.get_license(license_key)
-    if license_data:
-        return license_data.get("user_id")
-    return None
+def is_whitelisted_user(email: str) -> bool:
+    """Check if user email is whitelisted for free unlimited access"""
+    return email.lower() in WHITELIST_EMAILS_LOWER
 
 
 def check_whitelist_from_device(device_fingerprint: str) -> bool:
-    """Check if device is associated with whitelisted user"""
-    usage_data = db.get_usage(device_fingerprint)
-    if usage_data.get("license_key"):
-        email = get_user_email_from_license(usage_data["license_key"])
-        if email and is_whitelisted_user(email):
-            return True
-    # Also check if device has a stored email (for whitelisted trials)
-    if usage_data.get("email"):
-        return is_whitelisted_user(usage_data["email"])
-    return False
+    """
+    Check if device is associated with whitelisted user, through its
+    license or a stored email (for whitelisted trials)
+    """
+    return entitlements.device(device_fingerprint).whitelisted
 
 
 # Import database
 from db import db
+from counters import UsageCounters
+from entitlements import Entitlements
+from entitlement_tokens import EntitlementTokens
+from expiry import ExpiryScheduler
+from upstream import UpstreamClients
+from ai_cache import ResponseCache, cache_key
+from singleflight import SingleFlight
+
+# Batches /track-usage bumps when USAGE_COUNTER_FLUSH_MS > 0 (see counters.py).
+# The lambda resolves `db` at merge time so it follows the active instance.
+usage_counters = UsageCounters(lambda deltas: db.merge_usage(deltas))
+
+# Per-license and per-device entitlements, invalidated by database changes
+# (see entitlements.py); the lambda follows the active `db` the same way
+entitlements = Entitlements(lambda: db, is_whitelisted_user, LICENSE_PERIOD)
+
+# Signed offline entitlements (see entitlement_tokens.py); any change to an
+# entitlement's inputs revokes the tokens issued for it
+entitlement_tokens = EntitlementTokens(lambda: LICENSE_SECRET)
+entitlements.subscribe(entitlement_tokens.revoke)
+
+# Deactivates licenses when they expire (see expiry.py); started by the
+# lifespan in main.py when LICENSE_EXPIRY_SWEEP is on
+expiry_scheduler = ExpiryScheduler(lambda: db, LICENSE_PERIOD)
+
+# Pooled keep-alive clients for Gemini and the job API (see upstream.py);
+# closed by the lifespan in main.py
+upstream = UpstreamClients()
+
+# Opt-in cache of Gemini responses by prompt (see ai_cache.py)
+ai_cache = ResponseCache()
+
+# Identical concurrent Gemini and job API calls share one upstream request
+# (see singleflight.py)
+upstream_flights = SingleFlight()
 
 
 # Models
 class ValidateLicenseRequest(BaseModel):
     license_key: str
     device_fingerprint: str
+    issue_token: bool = False
 
 
 class TrackUsageRequest(BaseModel):
@@ -75,11 +122,30 @@ class AIProxyRequest(BaseModel):
     prompt: str
     device_fingerprint: str
     license_key: Optional[str] = None
+    bypass_cache: bool = False
+
+
+class AIBatchRequest(BaseModel):
+    device_fingerprint: str
+    license_key: Optional[str] = None
+    # Either complete prompts, or form fields/questions sent with a shared
+    # context (e.g. resume and job description) that is prepended to each
+    prompts: List[str] = []
+    fields: List[str] = []
+    context: Optional[str] = None
+    bypass_cache: bool = False
 
 
 class CheckUsageRequest(BaseModel):
     device_fingerprint: str
     license_key: Optional[str] = None
+    issue_token: bool = False
+    entitlement_token: Optional[str] = None
+
+
+class RefreshTokenRequest(BaseModel):
+    device_fingerprint: str
+    entitlement_token: str
 
 
 class JobSearchRequest(BaseModel):
@@ -113,6 +179,65 @@ class JobAutoApplyRequest(BaseModel):
     jobs: List[JobListing]
     profile: JobApplyProfile
     license_key: Optional[str] = None
+    entitlement_token: Optional[str] = None
+
+
+class RejectedKeys:
+    """Bounded LRU of recently rejected license keys and why, with a TTL"""
+
+    def __init__(self, capacity: int, ttl: float):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, license_key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(license_key)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry[0]:
+                del self._entries[license_key]
+                return None
+            self._entries.move_to_end(license_key)
+            self.hits += 1
+            return entry[1]
+
+    def add(self, license_key: str, reason: str):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._entries[license_key] = (time.monotonic() + self.ttl, reason)
+            self._entries.move_to_end(license_key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def discard(self, license_key: str):
+        with self._lock:
+            self._entries.pop(license_key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+rejected_keys = RejectedKeys(REJECTED_KEY_CACHE_SIZE, REJECTED_KEY_CACHE_TTL)
+
+
+_keyed_hmac: Optional[Tuple[str, "hmac.HMAC"]] = None
+
+
+def _sign(message: str, length: int) -> str:
+    # Copying a keyed HMAC skips re-deriving the key pads on every call
+    global _keyed_hmac
+    if _keyed_hmac is None or _keyed_hmac[0] != LICENSE_SECRET:
+        _keyed_hmac = (
+            LICENSE_SECRET,
+            hmac.new(LICENSE_SECRET.encode(), digestmod=hashlib.sha256),
+        )
+    mac = _keyed_hmac[1].copy()
+    mac.update(message.encode())
+    return mac.hexdigest()[:length]
 
 
 def generate_license_key(user_id: str) -> str:
@@ -120,14 +245,40 @@ def generate_license_key(user_id: str) -> str:
     timestamp = int(time.time())
     random_part = secrets.token_hex(8)
 
-    # Create signature: HMAC(secret, user_id + timestamp + random)
-    message = f"{user_id}:{timestamp}:{random_part}"
-    signature = hmac.new(
-        LICENSE_SECRET.encode(), message.encode(), hashlib.sha256
-    ).hexdigest()[:16]
+    if LICENSE_SECRET_CONFIGURED:
+        # Format: HA-SUB-V2-{timestamp}-{random}-{signature}
+        # The signature covers only what the key carries, so it can be
+        # checked without a database lookup
+        signature = _sign(f"v2:{timestamp}:{random_part}", 32)
+        license_key = f"HA-SUB-V2-{timestamp}-{random_part}-{signature}"
+    else:
+        # Format: HA-SUB-{timestamp}-{random}-{signature}
+        # Signature: HMAC(secret, user_id + timestamp + random)
+        signature = _sign(f"{user_id}:{timestamp}:{random_part}", 16)
+        license_key = f"HA-SUB-{timestamp}-{random_part}-{signature}"
+    rejected_keys.discard(license_key)
+    return license_key
+
 
-    # Format: HA-SUB-{timestamp}-{random}-{signature}
-    return f"HA-SUB-{timestamp}-{random_part}-{signature}"
+def check_license_key_format(license_key: str) -> Optional[str]:
+    """
+    Pure-CPU checks that run before any database lookup; returns why the
+    key is rejected, or None. V1 keys sign the user_id, which only the
+    database knows, so for them only the structure can be checked here.
+    """
+    if not license_key.startswith("HA-SUB-"):
+        return "Invalid format"
+    parts = license_key.split("-")
+    if parts[2] == "V2":
+        if len(parts) != 6 or not parts[3].isdigit():
+            return "Invalid structure"
+        expected = _sign(f"v2:{parts[3]}:{parts[4]}", 32)
+        if not hmac.compare_digest(parts[5], expected):
+            return "Invalid signature"
+        return None
+    if len(parts) != 5:  # HA-SUB-timestamp-random-signature
+        return "Invalid structure"
+    return None
 
 
 def validate_license_signature(license_key: str) -> dict:
@@ -136,60 +287,34 @@ def validate_license_signature(license_key: str) -> dict:
     Returns dict with validation result
     """
     try:
-        if not license_key.startswith("HA-SUB-"):
-            return {"valid": False, "reason": "Invalid format"}
-
-        parts = license_key.split("-")
-        if len(parts) != 5:  # HA-SUB-timestamp-random-signature
-            return {"valid": False, "reason": "Invalid structure"}
-
-        timestamp = parts[2]
-        random_part = parts[3]
-        provided_signature = parts[4]
-
-        # Reconstruct all possible user_ids to check (in production, query from DB)
-        # For now, verify signature format is correct
-        # In production: look up license_key in database to get user_id
-
-        # Check if license exists in database
-        license_data = db.get_license(license_key)
-        if not license_data:
+        # Forged and garbage keys are rejected without touching the store;
+        # keys the store recently did not know are answered from the cache
+        reason = check_license_key_format(license_key) or rejected_keys.get(license_key)
+        if reason is not None:
+            return {"valid": False, "reason": reason}
+
+        # Check the license exists, is active and within its 31 day window
+        entitlement = entitlements.license(license_key)
+        if entitlement is None:
+            rejected_keys.add(license_key, "License not found")
             return {"valid": False, "reason": "License not found"}
-
-        # Check if license is active
-        if not license_data.get("active", False):
-            return {"valid": False, "reason": "License inactive"}
-
-        # Check expiry (31 days from start_date)
-        start_date = datetime.fromisoformat(license_data["start_date"])
-        if datetime.now() > start_date + timedelta(days=31):
-            return {"valid": False, "reason": "License expired"}
+        reason = entitlement.rejection()
+        if reason is not None:
+            return {"valid": False, "reason": reason}
 
         return {
             "valid": True,
-            "user_id": license_data["user_id"],
-            "start_date": license_data["start_date"],
+            "user_id": entitlement.user_id,
+            "start_date": entitlement.start_date,
         }
 
     except Exception as e:
         return {"valid": False, "reason": f"Validation error: {str(e)}"}
 
 
-def get_device_usage(device_fingerprint: str) -> dict:
-    """Get usage data for a device"""
-    return db.get_usage(device_fingerprint)
-
-
-def has_unlimited_auto_apply(license_key: Optional[str]) -> bool:
-    if not license_key:
-        return False
-    license_data = db.get_license(license_key)
-    if not license_data:
-        return False
-    if not license_data.get("active", False):
-        return False
-    plan = license_data.get("plan") or "standard"
-    return plan in {"unlimited", "pro"}
+def get_usage_count(device_fingerprint: str) -> int:
+    """Stored usage count for a device"""
+    return db.get_usage(device_fingerprint)["count"]
 
 
 @router.post("/validate-license")
@@ -198,22 +323,38 @@ async def validate_license(request: ValidateLicenseRequest):
     Validate a license key
     Called when user activates a subscription
     """
-    validation = validate_license_signature(request.license_key)
+    validation = await db.run(validate_license_signature, request.license_key)
 
     if not validation["valid"]:
         raise HTTPException(status_code=400, detail=validation["reason"])
 
     # Associate license with device
-    db.update_usage(request.device_fingerprint, {"license_key": request.license_key})
+    await db.aupdate_usage(
+        request.device_fingerprint, {"license_key": request.license_key}
+    )
 
-    return {
+    response = {
         "valid": True,
         "user_id": validation["user_id"],
         "start_date": validation["start_date"],
         "expires_at": (
-            datetime.fromisoformat(validation["start_date"]) + timedelta(days=31)
+            datetime.fromisoformat(validation["start_date"]) + LICENSE_PERIOD
         ).isoformat(),
     }
+    if request.issue_token:
+        response.update(await issue_entitlement_token(request.device_fingerprint))
+    return response
+
+
+async def issue_entitlement_token(device_fingerprint: str) -> dict:
+    """Fields carrying a fresh token for the device's current entitlement"""
+    issued_at = time.time()
+    entitlement = await entitlements.adevice(device_fingerprint)
+    issued = entitlement_tokens.issue(device_fingerprint, entitlement, issued_at)
+    return {
+        "entitlement_token": issued["token"],
+        "token_expires_at": issued["expires_at"],
+    }
 
 
 @router.post("/check-usage")
@@ -222,16 +363,48 @@ async def check_usage(request: CheckUsageRequest):
     Check usage status for a device
     Returns unlimited free access for everyone
     """
-    usage_data = get_device_usage(request.device_fingerprint)
+    claims, token_error = None, None
+    if request.entitlement_token:
+        # A good token answers without any lookup
+        claims, token_error = entitlement_tokens.verify(
+            request.entitlement_token, request.device_fingerprint
+        )
+    if claims is not None:
+        whitelisted = claims["wl"]
+    else:
+        whitelisted = (await entitlements.adevice(request.device_fingerprint)).whitelisted
 
     # Everyone gets unlimited free access
-    return {
+    response = {
         "status": "free",
         "valid": True,
         "is_paid": False,
         "is_unlimited": True,
+        "is_whitelisted": whitelisted,
         "message": "Unlimited free access for everyone!",
     }
+    if token_error:
+        response["token_error"] = token_error
+    if request.issue_token and claims is None:
+        response.update(await issue_entitlement_token(request.device_fingerprint))
+    return response
+
+
+@router.post("/refresh-token")
+async def refresh_token(request: RefreshTokenRequest):
+    """
+    Trade an entitlement token that is still good, or expired less than one
+    token lifetime ago, for a new one; revoked tokens get a 401 and the
+    extension falls back to /check-usage
+    """
+    claims, reason = entitlement_tokens.verify(
+        request.entitlement_token,
+        request.device_fingerprint,
+        grace=entitlement_tokens.ttl,
+    )
+    if claims is None:
+        raise HTTPException(status_code=401, detail=reason)
+    return await issue_entitlement_token(request.device_fingerprint)
 
 
 @router.post("/track-usage")
@@ -241,18 +414,23 @@ async def track_usage(request: TrackUsageRequest):
     Unlimited free access for everyone
     """
     # Just log usage for analytics, no limits enforced
-    db.increment_usage(request.device_fingerprint)
-    db.update_usage(
-        request.device_fingerprint, {"last_used": datetime.now().isoformat()}
-    )
-
-    usage_data = get_device_usage(request.device_fingerprint)
+    if usage_counters.interval_ms > 0:
+        usage_counters.add(request.device_fingerprint)
+        usage_count = await db.run(
+            usage_counters.count, request.device_fingerprint, get_usage_count
+        )
+    else:
+        await db.aincrement_usage(request.device_fingerprint)
+        await db.aupdate_usage(
+            request.device_fingerprint, {"last_used": datetime.now().isoformat()}
+        )
+        usage_count = await db.run(get_usage_count, request.device_fingerprint)
 
     return {
         "allowed": True,
         "is_paid": False,
         "is_unlimited": True,
-        "usage_count": usage_data["count"],
+        "usage_count": usage_count,
         "message": "Autofill authorized (unlimited free access)",
     }
 
@@ -260,35 +438,46 @@ async def track_usage(request: TrackUsageRequest):
 async def fetch_jobs(request: JobSearchRequest) -> List[JobListing]:
     if not JOB_API_BASE_URL:
         return []
+    # Concurrent identical searches share one upstream call
+    key = hashlib.sha256(json.dumps([
+        " ".join(request.query.split()),
+        " ".join((request.location or "").split()),
+        request.remote,
+        request.limit,
+    ]).encode()).hexdigest()
+    return list(await upstream_flights.do(f"jobs:{key}", lambda: search_job_api(request)))
+
+
+async def search_job_api(request: JobSearchRequest) -> List[JobListing]:
     headers: Dict[str, str] = {"Authorization": f"Bearer {JOB_API_KEY}"}
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        response = await client.get(
-            JOB_API_BASE_URL,
-            params={
-                "q": request.query,
-                "location": request.location,
-                "remote": str(request.remote).lower(),
-                "limit": request.limit,
-            },
-            headers=headers,
-        )
-        response.raise_for_status()
-        payload = response.json()
-        items = payload.get("results") or payload.get("jobs") or []
-        results: List[JobListing] = []
-        for item in items:
-            results.append(
-                JobListing(
-                    id=str(item.get("id") or item.get("job_id") or item.get("url")),
-                    title=item.get("title") or "",
-                    company=item.get("company") or item.get("company_name") or "",
-                    location=item.get("location") or item.get("city") or "",
-                    url=item.get("url") or item.get("redirect_url") or "",
-                    source=item.get("source") or "external",
-                    remote=bool(item.get("remote", False)),
-                )
+    response = await upstream.client("jobs").get(
+        JOB_API_BASE_URL,
+        params={
+            "q": request.query,
+            "location": request.location,
+            "remote": str(request.remote).lower(),
+            "limit": request.limit,
+        },
+        headers=headers,
+        timeout=10.0,
+    )
+    response.raise_for_status()
+    payload = response.json()
+    items = payload.get("results") or payload.get("jobs") or []
+    results: List[JobListing] = []
+    for item in items:
+        results.append(
+            JobListing(
+                id=str(item.get("id") or item.get("job_id") or item.get("url")),
+                title=item.get("title") or "",
+                company=item.get("company") or item.get("company_name") or "",
+                location=item.get("location") or item.get("city") or "",
+                url=item.get("url") or item.get("redirect_url") or "",
+                source=item.get("source") or "external",
+                remote=bool(item.get("remote", False)),
             )
-        return results
+        )
+    return results
 
 
 @router.post("/proxy-ai")
@@ -304,31 +493,160 @@ async def proxy_ai(request: AIProxyRequest):
     if not GEMINI_API_KEY:
         raise HTTPException(status_code=500, detail="AI service not configured")
 
-    # Make request to Gemini API
+    return await answer_prompt(request.prompt, request.bypass_cache)
+
+
+async def answer_prompt(prompt: str, bypass_cache: bool = False) -> dict:
+    """Gemini's answer from the cache, an identical call in flight, or a new call"""
+    if not bypass_cache:
+        cached = await ai_cache.get(GEMINI_MODEL, prompt)
+        if cached is not None:
+            return cached
+
+    # Concurrent identical prompts share one Gemini call
+    key = cache_key(GEMINI_MODEL, prompt)
+    return await upstream_flights.do(f"gemini:{key}", lambda: generate_content(prompt))
+
+
+async def generate_content(prompt: str) -> dict:
+    """One Gemini generateContent call; errors are raised as HTTPException"""
     try:
-        async with httpx.AsyncClient() as client:
-            api_url = "https://generativelanguage.googleapis.com/v1/models/gemini-2.5-flash:generateContent"
-
-            response = await client.post(
-                api_url,
-                json={"contents": [{"parts": [{"text": request.prompt}]}]},
-                headers={"x-goog-api-key": GEMINI_API_KEY},
-                timeout=30.0,
+        api_url = f"{GEMINI_API_BASE}/v1/models/{GEMINI_MODEL}:generateContent"
+
+        response = await upstream.client("gemini").post(
+            api_url,
+            json={"contents": [{"parts": [{"text": prompt}]}]},
+            headers={"x-goog-api-key": GEMINI_API_KEY},
+            timeout=30.0,
+        )
+
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"AI service error: {response.text}",
             )
 
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"AI service error: {response.text}",
-                )
+        result = response.json()
+        await ai_cache.put(GEMINI_MODEL, prompt, result)
+        return result
+
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="AI service timeout")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
+
+
+@router.post("/proxy-ai/batch")
+async def proxy_ai_batch(request: AIBatchRequest, format: str = "json"):
+    """
+    Answer many prompts in one request, at most AI_BATCH_CONCURRENCY
+    upstream calls at a time. format=json returns results by index once all
+    are done; format=ndjson streams each result as soon as it completes.
+    Failures are reported per item and do not affect the others.
+    """
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be json or ndjson")
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=500, detail="AI service not configured")
+    prompts = list(request.prompts) + [
+        f"{request.context}\n\n{field}" if request.context else field
+        for field in request.fields
+    ]
+    if not prompts:
+        raise HTTPException(status_code=400, detail="prompts or fields are required")
+    if len(prompts) > AI_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413, detail=f"Batches are limited to {AI_BATCH_MAX_ITEMS} prompts"
+        )
+
+    semaphore = asyncio.Semaphore(AI_BATCH_CONCURRENCY)
+
+    async def answer(index: int, prompt: str) -> dict:
+        async with semaphore:
+            try:
+                return {"index": index, "response": await answer_prompt(prompt, request.bypass_cache)}
+            except HTTPException as e:
+                return {"index": index, "error": e.detail, "status": e.status_code}
+
+    tasks = [asyncio.ensure_future(answer(index, prompt)) for index, prompt in enumerate(prompts)]
+    if format == "json":
+        return {"results": await asyncio.gather(*tasks)}
+
+    async def lines():
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield json.dumps(await done) + "\n"
+        finally:
+            # The client went away: stop waiting for the remaining answers
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+STREAM_FORMATS = {
+    "sse": ("text/event-stream", "data: {}\n\n", "event: error\ndata: {}\n\n"),
+    "ndjson": ("application/x-ndjson", "{}\n", "{}\n"),
+}
 
-            return response.json()
 
+@router.post("/proxy-ai/stream")
+async def proxy_ai_stream(request: AIProxyRequest, format: str = "sse"):
+    """
+    Streaming variant of /proxy-ai: relays Gemini streamGenerateContent
+    chunks as server-sent events (format=sse) or NDJSON as they arrive.
+    Chunks are read from upstream only as fast as the client takes them,
+    and a client disconnect closes the upstream stream.
+    """
+    if format not in STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be sse or ndjson")
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=500, detail="AI service not configured")
+    media_type, chunk_line, error_line = STREAM_FORMATS[format]
+
+    client = upstream.client("gemini")
+    upstream_request = client.build_request(
+        "POST",
+        f"{GEMINI_API_BASE}/v1/models/{GEMINI_MODEL}:streamGenerateContent",
+        params={"alt": "sse"},
+        json={"contents": [{"parts": [{"text": request.prompt}]}]},
+        headers={"x-goog-api-key": GEMINI_API_KEY},
+        timeout=30.0,
+    )
+    try:
+        response = await client.send(upstream_request, stream=True)
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="AI service timeout")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
 
+    if response.status_code != 200:
+        await response.aread()
+        await response.aclose()
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=f"AI service error: {response.text}",
+        )
+
+    async def relay():
+        try:
+            async for line in response.aiter_lines():
+                # Upstream SSE: only data lines carry chunks
+                if line.startswith("data:"):
+                    yield chunk_line.format(line[5:].strip())
+        except httpx.HTTPError as e:
+            yield error_line.format(json.dumps({"error": f"AI service error: {str(e)}"}))
+        finally:
+            # Also runs when the client disconnects and the relay is cancelled
+            with anyio.CancelScope(shield=True):
+                await response.aclose()
+
+    return StreamingResponse(
+        relay(),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 # Whitelist activation endpoint
 class WhitelistActivationRequest(BaseModel):
@@ -349,7 +667,7 @@ async def activate_whitelist(request: WhitelistActivationRequest):
         )
 
     # Store email with device for future checks
-    db.update_usage(
+    await db.aupdate_usage(
         request.device_fingerprint,
         {"email": request.email, "last_used": datetime.now().isoformat()},
     )
@@ -377,12 +695,12 @@ async def create_license(user_id: str, secret_key: str):
     license_key = generate_license_key(user_id)
 
     # Store in database
-    db.create_license(license_key, user_id)
+    await db.acreate_license(license_key, user_id)
 
     return {
         "license_key": license_key,
         "user_id": user_id,
-        "expires_at": (datetime.now() + timedelta(days=31)).isoformat(),
+        "expires_at": (datetime.now() + LICENSE_PERIOD).isoformat(),
     }
 
 
@@ -394,14 +712,264 @@ async def revoke_license(license_key: str, secret_key: str):
     if secret_key != os.environ.get("ADMIN_SECRET", ""):
         raise HTTPException(status_code=403, detail="Unauthorized")
 
-    license_data = db.get_license(license_key)
+    license_data = await db.aget_license(license_key)
     if license_data:
-        db.revoke_license(license_key)
+        await db.arevoke_license(license_key)
         return {"message": "License revoked successfully"}
     else:
         raise HTTPException(status_code=404, detail="License not found")
 
 
+async def read_batch(request: Request) -> list:
+    """
+    Items of a batch upload: a JSON array, or one JSON value per line when
+    sent as application/x-ndjson
+    """
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+            items = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            items = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Malformed batch body")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Batch body must be a JSON array")
+    if len(items) > ADMIN_BATCH_LIMIT:
+        raise HTTPException(
+            status_code=413, detail=f"Batches are limited to {ADMIN_BATCH_LIMIT} items"
+        )
+    return items
+
+
+def batch_results(results) -> StreamingResponse:
+    """Stream per-item results as NDJSON, in upload order"""
+    return StreamingResponse(
+        (json.dumps(result) + "\n" for result in results),
+        media_type="application/x-ndjson",
+    )
+
+
+@router.post("/admin/create-licenses")
+async def create_licenses(request: Request, secret_key: str):
+    """
+    Create many licenses in one commit (admin only)
+    Items are user_id strings or {"user_id": ..., "plan": ...} objects
+    """
+    if secret_key != os.environ.get("ADMIN_SECRET", ""):
+        raise HTTPException(status_code=403, detail="Unauthorized")
+
+    results = []
+    licenses = {}
+    expires_at = (datetime.now() + LICENSE_PERIOD).isoformat()
+    for index, item in enumerate(await read_batch(request)):
+        fields = {"user_id": item} if isinstance(item, str) else item
+        if not isinstance(fields, dict) or not isinstance(fields.get("user_id"), str):
+            results.append({"index": index, "error": "user_id is required"})
+            continue
+        if not isinstance(fields.get("plan", ""), str):
+            results.append({"index": index, "error": "plan must be a string"})
+            continue
+        license_key = generate_license_key(fields["user_id"])
+        licenses[license_key] = {
+            key: fields[key] for key in ("user_id", "plan") if key in fields
+        }
+        results.append({
+            "index": index,
+            "license_key": license_key,
+            "user_id": fields["user_id"],
+            "expires_at": expires_at,
+        })
+
+    # All or nothing: every valid item is written by the same commit
+    if licenses:
+        await db.acreate_licenses(licenses)
+    return batch_results(results)
+
+
+@router.post("/admin/revoke-licenses")
+async def revoke_licenses(request: Request, secret_key: str):
+    """
+    Revoke many licenses in one commit (admin only)
+    Items are license key strings or {"license_key": ...} objects
+    """
+    if secret_key != os.environ.get("ADMIN_SECRET", ""):
+        raise HTTPException(status_code=403, detail="Unauthorized")
+
+    keys = []
+    for item in await read_batch(request):
+        license_key = item.get("license_key") if isinstance(item, dict) else item
+        keys.append(license_key if isinstance(license_key, str) else None)
+
+    revoked = set(await db.arevoke_licenses([key for key in keys if key is not None]))
+    return batch_results(
+        {"index": index, "license_key": key, "revoked": True}
+        if key in revoked
+        else {
+            "index": index,
+            "license_key": key,
+            "error": "License not found" if key is not None else "license_key is required",
+        }
+        for index, key in enumerate(keys)
+    )
+
+
+@router.get("/admin/stats")
+async def admin_stats(secret_key: str):
+    """
+    Storage statistics (admin only)
+    Record counts plus hot/cold tier hit, miss and eviction counters
+    """
+    if secret_key != os.environ.get("ADMIN_SECRET", ""):
+        raise HTTPException(status_code=403, detail="Unauthorized")
+
+    return {
+        "database": await db.run(db.stats),
+        "entitlements": entitlements.stats(),
+        "expiry": expiry_scheduler.stats(),
+        "upstream": upstream.stats(),
+        "ai_cache": ai_cache.stats(),
+        "upstream_flights": upstream_flights.stats(),
+    }
+
+
+@router.post("/admin/backup")
+async def admin_backup(secret_key: str, incremental: bool = False):
+    """
+    Online backup into DB_BACKUP_DIR (admin only)
+    Incremental backups hold only the records changed since the last one
+    """
+    if secret_key != os.environ.get("ADMIN_SECRET", ""):
+        raise HTTPException(status_code=403, detail="Unauthorized")
+
+    return {"backup": await db.run(db.backup, incremental=incremental)}
+
+
+def encode_cursor(value, key: str) -> str:
+    """Opaque keyset cursor: the (value, key) of the last item returned"""
+    return base64.urlsafe_b64encode(json.dumps([value, key]).encode()).decode()
+
+
+def decode_cursor(cursor: Optional[str]):
+    if not cursor:
+        return None
+    try:
+        value, key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return value, key
+
+
+async def admin_page(scan, after, limit: int, item, format: str):
+    """
+    One JSON page of a keyset scan, or the whole range as NDJSON fetched
+    ADMIN_STREAM_BATCH rows at a time so it is never held in memory at once
+    """
+    if format == "ndjson":
+        async def lines():
+            cursor = after
+            while True:
+                page = await db.run(scan, cursor, ADMIN_STREAM_BATCH)
+                for _, key, record in page:
+                    yield json.dumps(item(key, record)) + "\n"
+                if len(page) < ADMIN_STREAM_BATCH:
+                    return
+                cursor = page[-1][:2]
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be json or ndjson")
+
+    limit = max(1, min(limit, ADMIN_PAGE_LIMIT))
+    page = await db.run(scan, after, limit)
+    return {
+        "items": [item(key, record) for _, key, record in page],
+        "next_cursor": encode_cursor(*page[-1][:2]) if len(page) == limit else None,
+    }
+
+
+@router.get("/admin/usage")
+async def admin_usage(
+    secret_key: str,
+    order: str = "last_used",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    reverse: bool = False,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    format: str = "json",
+):
+    """
+    Usage records ordered by last_used or count (admin only)
+    Filters to start <= value < end; pass next_cursor back for the next page
+    """
+    if secret_key != os.environ.get("ADMIN_SECRET", ""):
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    if order not in ("last_used", "count"):
+        raise HTTPException(status_code=400, detail="order must be last_used or count")
+    if order == "count":
+        try:
+            start = None if start is None else int(start)
+            end = None if end is None else int(end)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="count bounds must be integers")
+
+    def scan(after, batch):
+        return db.scan_usage(order, start, end, after, batch, reverse)
+
+    return await admin_page(
+        scan,
+        decode_cursor(cursor),
+        limit,
+        lambda key, usage: {"device_fingerprint": key, **usage},
+        format,
+    )
+
+
+@router.get("/admin/licenses")
+async def admin_licenses(
+    secret_key: str,
+    expires_after: Optional[str] = None,
+    expires_before: Optional[str] = None,
+    reverse: bool = False,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    format: str = "json",
+):
+    """
+    Licenses ordered by expiry (admin only)
+    Filters to expires_after <= expires_at < expires_before (ISO timestamps)
+    """
+    if secret_key != os.environ.get("ADMIN_SECRET", ""):
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    try:
+        # Expiry is start_date + LICENSE_PERIOD, so scan the start_date index
+        start = (
+            None if expires_after is None
+            else (datetime.fromisoformat(expires_after) - LICENSE_PERIOD).isoformat()
+        )
+        end = (
+            None if expires_before is None
+            else (datetime.fromisoformat(expires_before) - LICENSE_PERIOD).isoformat()
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid expiry timestamp")
+
+    def scan(after, batch):
+        return db.scan_licenses(start, end, after, batch, reverse)
+
+    def item(key, license_data):
+        try:
+            expires_at = (
+                datetime.fromisoformat(license_data["start_date"]) + LICENSE_PERIOD
+            ).isoformat()
+        except (TypeError, ValueError):
+            expires_at = None
+        return {"license_key": key, **license_data, "expires_at": expires_at}
+
+    return await admin_page(scan, decode_cursor(cursor), limit, item, format)
+
+
 # Subscription creation endpoint (called from purchase.html)
 class CreateSubscriptionRequest(BaseModel):
     email: str
@@ -419,7 +987,7 @@ async def create_subscription(request: CreateSubscriptionRequest):
     license_key = generate_license_key(request.email)
 
     # Store in database
-    db.create_license(
+    await db.acreate_license(
         license_key,
         request.email,
         paypal_subscription_id=request.subscription_id,
@@ -431,7 +999,7 @@ async def create_subscription(request: CreateSubscriptionRequest):
         "license_key": license_key,
         "email": request.email,
         "subscription_id": request.subscription_id,
-        "expires_at": (datetime.now() + timedelta(days=31)).isoformat(),
+        "expires_at": (datetime.now() + LICENSE_PERIOD).isoformat(),
     }
 
 
@@ -453,9 +1021,16 @@ async def paypal_webhook(request: Request):
         subscription = body.get("resource", {})
         subscriber_email = subscription.get("subscriber", {}).get("email_address")
 
+        # purchase.html may already have created the license for this subscription
+        existing = await update_subscription_licenses(
+            subscription.get("id"), {"active": True, "status": "active"}
+        )
+        if existing:
+            return {"message": "Subscription activated", "license_key": existing[0]}
+
         # Generate and store license key
         license_key = generate_license_key(subscriber_email)
-        db.create_license(
+        await db.acreate_license(
             license_key, subscriber_email, paypal_subscription_id=subscription.get("id")
         )
 
@@ -463,9 +1038,52 @@ async def paypal_webhook(request: Request):
 
         return {"message": "Subscription activated", "license_key": license_key}
 
+    if event_type in SUBSCRIPTION_STATUS_EVENTS:
+        subscription_id = body.get("resource", {}).get("id")
+        status = SUBSCRIPTION_STATUS_EVENTS[event_type]
+        license_keys = await update_subscription_licenses(
+            subscription_id, {"active": status == "active", "status": status}
+        )
+        return {"message": f"Subscription {status}", "license_keys": license_keys}
+
+    if event_type == "PAYMENT.SALE.COMPLETED":
+        # Recurring payment: restart the 31 day window of the subscription
+        subscription_id = body.get("resource", {}).get("billing_agreement_id")
+        license_keys = await update_subscription_licenses(
+            subscription_id,
+            {
+                "active": True,
+                "status": "active",
+                "start_date": datetime.now().isoformat(),
+            },
+        )
+        return {"message": "Subscription renewed", "license_keys": license_keys}
+
     return {"message": "Event processed"}
 
 
+# PayPal subscription lifecycle events and the license status they map to
+SUBSCRIPTION_STATUS_EVENTS = {
+    "BILLING.SUBSCRIPTION.CANCELLED": "cancelled",
+    "BILLING.SUBSCRIPTION.SUSPENDED": "suspended",
+    "BILLING.SUBSCRIPTION.RE-ACTIVATED": "active",
+}
+
+
+async def update_subscription_licenses(
+    subscription_id: Optional[str], updates: Dict
+) -> List[str]:
+    """Apply updates to every license of a PayPal subscription (indexed lookup)"""
+    if not subscription_id:
+        return []
+    licenses = await db.run(
+        db.find_licenses, paypal_subscription_id=subscription_id
+    )
+    for license_key in licenses:
+        await db.aupdate_license(license_key, updates)
+    return list(licenses)
+
+
 @router.post("/jobs/search")
 async def search_jobs(request: JobSearchRequest):
     jobs = await fetch_jobs(request)
@@ -474,7 +1092,19 @@ async def search_jobs(request: JobSearchRequest):
 
 @router.post("/jobs/auto-apply")
 async def auto_apply_jobs(request: JobAutoApplyRequest):
-    unlimited = has_unlimited_auto_apply(request.license_key)
+    claims = None
+    if request.entitlement_token:
+        claims, _ = entitlement_tokens.verify(
+            request.entitlement_token, request.device_fingerprint
+        )
+    if claims is not None and claims["lic"] == request.license_key:
+        unlimited = claims["unl"]
+    else:
+        entitlement = (
+            await entitlements.alicense(request.license_key)
+            if request.license_key else None
+        )
+        unlimited = entitlement is not None and entitlement.unlimited_auto_apply
     if not unlimited and len(request.jobs) > MAX_FREE_AUTO_APPLY:
         applied_jobs = request.jobs[:MAX_FREE_AUTO_APPLY]
         queued_count = len(request.jobs) - MAX_FREE_AUTO_APPLY
@@ -484,8 +1114,8 @@ async def auto_apply_jobs(request: JobAutoApplyRequest):
         queued_count = 0
         status = "ok"
     job_ids = [job.id for job in applied_jobs]
-    db.increment_usage(request.device_fingerprint)
-    db.update_usage(
+    await db.aincrement_usage(request.device_fingerprint)
+    await db.aupdate_usage(
         request.device_fingerprint,
         {
             "last_used": datetime.now().isoformat(),
@@ -0,0 +1,240 @@
+"""
+Online backups of the license/usage database
+
+A backup directory holds a chain of files listed in manifest.json:
+
+    000001-full.json       point-in-time copy (.snap if binary, .db for SQLite)
+    000002-incr.journal    records changed since the previous backup, in the
+    000003-incr.journal    CRC-framed journal format of journal.py
+
+Backups are taken by the running server (BaseDatabase.backup, exposed as
+POST /api/admin/backup) so they see a consistent state while writes keep
+flowing: the JSON store never mutates a stored record in place, so a full
+backup is a shallow copy of its tables taken under the lock and written out
+afterwards, and an incremental one copies only the records touched since
+the last backup. SQLite stores use SQLite's online backup API (always full).
+
+    python backup.py create [--incremental]   # asks the server for a backup
+    python backup.py list [DIR]
+    python backup.py restore DIR DST [--sequence N]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import snapshot
+from journal import decode_journal_records
+
+DB_BACKUP_DIR = os.environ.get("DB_BACKUP_DIR", "/data/backups")
+MANIFEST = "manifest.json"
+
+
+def new_backup_id() -> str:
+    """Identifies one chain: a full backup and the increments on top of it"""
+    return uuid.uuid4().hex
+
+
+def read_manifest(directory: str) -> Dict:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {"backup_id": None, "entries": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _add_entry(directory: str, backup_id: str, kind: str, write, suffix: str, records: int) -> Dict:
+    """Write the next file of the chain atomically and record it in the manifest"""
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    sequence = manifest["entries"][-1]["sequence"] + 1 if manifest["entries"] else 1
+    name = f"{sequence:06d}-{kind}{suffix}"
+    path = os.path.join(directory, name)
+    write(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+    entry = {
+        "sequence": sequence,
+        "kind": kind,
+        "file": name,
+        "backup_id": backup_id,
+        "records": records,
+        "sha256": _sha256(path),
+        "created_at": datetime.now().isoformat(),
+    }
+    manifest["backup_id"] = backup_id
+    manifest["entries"].append(entry)
+    with open(os.path.join(directory, MANIFEST + ".tmp"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(directory, MANIFEST + ".tmp"), os.path.join(directory, MANIFEST))
+    return entry
+
+
+def write_full(
+    directory: str,
+    backup_id: str,
+    data: Dict,
+    snapshot_format: str = "json",
+    compression: str = "zlib",
+) -> Dict:
+    """Full backup of a {"licenses": ..., "usage": ...} database"""
+
+    def write(path):
+        if snapshot_format == "binary":
+            with open(path, "wb") as f:
+                f.write(snapshot.dumps(data, compression))
+        else:
+            with open(path, "w") as f:
+                snapshot.dump_json(data, f)
+
+    records = sum(len(table) for table in data.values())
+    suffix = ".snap" if snapshot_format == "binary" else ".json"
+    return _add_entry(directory, backup_id, "full", write, suffix, records)
+
+
+def write_segment(directory: str, backup_id: str, lines: List[bytes]) -> Dict:
+    """Incremental backup: encoded journal records changed since the last one"""
+
+    def write(path):
+        with open(path, "wb") as f:
+            f.writelines(lines)
+
+    return _add_entry(directory, backup_id, "incr", write, ".journal", len(lines))
+
+
+def write_sqlite(directory: str, backup_id: str, conn: sqlite3.Connection) -> Dict:
+    """Full backup of a SQLite store through the online backup API"""
+
+    def write(path):
+        target = sqlite3.connect(path)
+        try:
+            conn.backup(target)
+        finally:
+            target.close()
+
+    records = sum(
+        conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ("licenses", "usage")
+    )
+    return _add_entry(directory, backup_id, "full", write, ".db", records)
+
+
+def _chain(directory: str, sequence: Optional[int]) -> List[Dict]:
+    """The latest full backup at or before `sequence` plus its increments"""
+    entries = [
+        entry for entry in read_manifest(directory)["entries"]
+        if sequence is None or entry["sequence"] <= sequence
+    ]
+    fulls = [i for i, entry in enumerate(entries) if entry["kind"] == "full"]
+    if not fulls:
+        raise ValueError(f"No full backup in {directory}")
+    base = entries[fulls[-1]]
+    return [base] + [
+        entry for entry in entries[fulls[-1] + 1:]
+        if entry["backup_id"] == base["backup_id"]
+    ]
+
+
+def restore(directory: str, dst: str, sequence: Optional[int] = None) -> Dict:
+    """Rebuild a database file from a backup chain (checksums are verified)"""
+    chain = _chain(directory, sequence)
+    for entry in chain:
+        if _sha256(os.path.join(directory, entry["file"])) != entry["sha256"]:
+            raise ValueError(f"Checksum mismatch for {entry['file']}")
+
+    base = os.path.join(directory, chain[0]["file"])
+    if base.endswith(".db"):
+        shutil.copyfile(base, dst + ".tmp")
+        os.replace(dst + ".tmp", dst)
+        return {"sequence": chain[0]["sequence"], "files": 1}
+
+    with open(base, "rb") as f:
+        blob = f.read()
+    data = snapshot.loads(blob) if snapshot.is_snapshot(blob) else json.loads(blob)
+    for entry in chain[1:]:
+        with open(os.path.join(directory, entry["file"]), "rb") as f:
+            for line in f:
+                records = decode_journal_records(line)
+                if records is None:
+                    raise ValueError(f"Corrupt record in {entry['file']}")
+                for table, key, value in records:
+                    if value is None:
+                        data.setdefault(table, {}).pop(key, None)
+                    else:
+                        data.setdefault(table, {})[key] = value
+
+    if dst.endswith(".snap"):
+        with open(dst + ".tmp", "wb") as f:
+            f.write(snapshot.dumps(data))
+    else:
+        with open(dst + ".tmp", "w") as f:
+            snapshot.dump_json(data, f)
+    os.replace(dst + ".tmp", dst)
+    return {"sequence": chain[-1]["sequence"], "files": len(chain)}
+
+
+def request_backup(url: str, secret_key: str, incremental: bool) -> Dict:
+    """Ask a running server for a backup (it owns the in-memory state)"""
+    query = urllib.parse.urlencode(
+        {"secret_key": secret_key, "incremental": str(incremental).lower()}
+    )
+    request = urllib.request.Request(f"{url}/api/admin/backup?{query}", method="POST")
+    with urllib.request.urlopen(request, timeout=600) as response:
+        return json.loads(response.read())["backup"]
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Database backups")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create_cmd = commands.add_parser("create", help="ask the server for a backup")
+    create_cmd.add_argument("--incremental", action="store_true")
+    create_cmd.add_argument(
+        "--url", default=f"http://localhost:{os.environ.get('PORT', '8080')}"
+    )
+    list_cmd = commands.add_parser("list", help="show the backups in a directory")
+    list_cmd.add_argument("directory", nargs="?", default=DB_BACKUP_DIR)
+    restore_cmd = commands.add_parser("restore", help="rebuild a database file")
+    restore_cmd.add_argument("directory")
+    restore_cmd.add_argument("dst")
+    restore_cmd.add_argument("--sequence", type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == "create":
+        entry = request_backup(
+            args.url, os.environ.get("ADMIN_SECRET", ""), args.incremental
+        )
+        print(f"Wrote {entry['file']} ({entry['records']} records)")
+    elif args.command == "list":
+        for entry in read_manifest(args.directory)["entries"]:
+            print(
+                f"{entry['sequence']:6d}  {entry['kind']:<4}  {entry['created_at']}  "
+                f"{entry['records']:>10} records  {entry['file']}"
+            )
+    else:
+        result = restore(args.directory, args.dst, args.sequence)
+        print(
+            f"Restored {args.dst} from {result['files']} file(s) "
+            f"up to backup {result['sequence']}"
+        )
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
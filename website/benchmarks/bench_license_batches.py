@@ -0,0 +1,82 @@
+"""
+Benchmark: provisioning licenses one /api/admin/create-license call at a
+time vs a single /api/admin/create-licenses batch
+
+    python benchmarks/bench_license_batches.py            # 2000 licenses
+    python benchmarks/bench_license_batches.py 10000 journal
+    python benchmarks/bench_license_batches.py 10000 sqlite
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TMP = tempfile.mkdtemp()
+os.environ["DB_FILE"] = os.path.join(TMP, "bench.json")
+os.environ["ADMIN_SECRET"] = "bench-secret"
+
+import httpx  # noqa: E402
+
+import api  # noqa: E402
+import db as db_module  # noqa: E402
+from main import app  # noqa: E402
+
+PARAMS = {"secret_key": "bench-secret"}
+
+
+def make_store(mode: str):
+    for name in os.listdir(TMP):
+        os.remove(os.path.join(TMP, name))
+    if mode == "sqlite":
+        db_module.DB_FILE = os.path.join(TMP, "bench.db")
+        return db_module.create_database("sqlite")
+    db_module.DB_FILE = os.path.join(TMP, "bench.json")
+    return db_module.Database(journal=mode == "journal", flush_interval_ms=0)
+
+
+async def single(client, count: int):
+    for i in range(count):
+        response = await client.post(
+            "/api/admin/create-license", params={**PARAMS, "user_id": f"user{i}"}
+        )
+        assert response.status_code == 200
+
+
+async def batch(client, count: int):
+    response = await client.post(
+        "/api/admin/create-licenses",
+        params=PARAMS,
+        content="\n".join(json.dumps(f"user{i}") for i in range(count)),
+        headers={"content-type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    assert len(response.text.splitlines()) == count
+
+
+def measure(label: str, run, count: int, mode: str) -> None:
+    api.db = make_store(mode)
+
+    async def timed():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            started = time.perf_counter()
+            await run(client, count)
+            return count / (time.perf_counter() - started)
+
+    rate = asyncio.run(timed())
+    assert api.db.stats()["licenses"] == count
+    api.db.close()
+    print(f"  {label:<36} {rate:11.0f} licenses/s")
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    mode = sys.argv[2] if len(sys.argv) > 2 else "snapshot"
+    print(f"{count} licenses, {mode} store")
+    measure("one request per license (before)", single, count, mode)
+    measure("one batch, one commit", batch, count, mode)
@@ -0,0 +1,78 @@
+"""
+Benchmark: database load time and file size, JSON vs binary snapshot
+
+    python benchmarks/bench_snapshot.py            # 100k and 1M devices
+    python benchmarks/bench_snapshot.py 50000      # custom sizes
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshot  # noqa: E402
+
+
+def make_data(devices: int) -> dict:
+    """Synthetic database shaped like production: mostly plain trial devices"""
+    base = datetime(2026, 1, 1)
+    licenses = {
+        f"HA-SUB-{1700000000 + i}-{i:016x}-{i:016x}": {
+            "active": True,
+            "user_id": f"user{i}@example.com",
+            "start_date": (base + timedelta(minutes=i)).isoformat(),
+            "created_at": (base + timedelta(minutes=i)).isoformat(),
+        }
+        for i in range(devices // 100)
+    }
+    license_keys = list(licenses)
+    usage = {}
+    for i in range(devices):
+        stamp = (base + timedelta(seconds=i)).isoformat()
+        record = {
+            "count": i % 500,
+            "license_key": license_keys[i % len(license_keys)] if i % 10 == 0 else None,
+            "last_used": stamp,
+            "created_at": stamp,
+        }
+        if i % 20 == 0:
+            record["last_auto_apply_count"] = 3
+            record["last_auto_apply_job_ids"] = ["job-1", "job-2", "job-3"]
+        usage[f"fp-{i:08x}-{'a' * 48}"] = record
+    return {"licenses": licenses, "usage": usage}
+
+
+def measure(label: str, path: str, load) -> None:
+    started = time.perf_counter()
+    with open(path, "rb") as f:
+        data = load(f.read())
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(path)
+    print(f"  {label:<18} {size / 1e6:9.1f} MB  {elapsed * 1000:9.0f} ms  "
+          f"({len(data['usage'])} devices)")
+
+
+def run(devices: int) -> None:
+    print(f"{devices} devices")
+    data = make_data(devices)
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "db.json")
+        with open(json_path, "w") as f:
+            json.dump(data, f, indent=2)
+        measure("json (indent=2)", json_path, json.loads)
+
+        for compression in ("none", "zlib") + (("zstd",) if snapshot.zstandard else ()):
+            path = os.path.join(tmp, f"db.{compression}.snap")
+            with open(path, "wb") as f:
+                f.write(snapshot.dumps(data, compression))
+            measure(f"binary/{compression}", path, snapshot.loads)
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100_000, 1_000_000]
+    for size in sizes:
+        run(size)
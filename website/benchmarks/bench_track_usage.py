@@ -0,0 +1,71 @@
+"""
+Benchmark: /api/track-usage requests/sec, direct database writes vs
+sharded counters merged on an interval (USAGE_COUNTER_FLUSH_MS)
+
+    python benchmarks/bench_track_usage.py            # 2000 requests
+    python benchmarks/bench_track_usage.py 10000 journal
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TMP = tempfile.mkdtemp()
+os.environ["DB_FILE"] = os.path.join(TMP, "bench.json")
+
+import httpx  # noqa: E402
+
+import api  # noqa: E402
+import db as db_module  # noqa: E402
+from counters import UsageCounters  # noqa: E402
+from main import app  # noqa: E402
+
+DEVICES = 200
+CONCURRENCY = 32
+
+
+async def run(requests: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        queue = asyncio.Queue()
+        for i in range(requests):
+            queue.put_nowait(f"device-{i % DEVICES}")
+
+        async def worker():
+            while not queue.empty():
+                fingerprint = queue.get_nowait()
+                response = await client.post(
+                    "/api/track-usage", json={"device_fingerprint": fingerprint}
+                )
+                assert response.status_code == 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+        return requests / (time.perf_counter() - started)
+
+
+def measure(label: str, requests: int, journal: bool, interval_ms: int) -> None:
+    for name in os.listdir(TMP):
+        os.remove(os.path.join(TMP, name))
+    database = db_module.Database(journal=journal)
+    api.db = database
+    api.usage_counters = UsageCounters(database.merge_usage, interval_ms=interval_ms)
+    rate = asyncio.run(run(requests))
+    api.usage_counters.close()
+    total = sum(database.get_usage(f"device-{i}")["count"] for i in range(DEVICES))
+    assert total == requests, (total, requests)
+    database.close()
+    print(f"  {label:<32} {rate:9.0f} req/s")
+
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    journal = len(sys.argv) > 2 and sys.argv[2] == "journal"
+    print(f"{requests} requests over {DEVICES} devices, "
+          f"{'journal' if journal else 'snapshot'} persistence")
+    measure("direct writes (before)", requests, journal, 0)
+    measure("sharded counters, 100ms merge", requests, journal, 100)
@@ -0,0 +1,110 @@
+"""
+Benchmark: upstream call latency with a new httpx.AsyncClient per request
+(the old proxy_ai/fetch_jobs pattern) vs the pooled UpstreamClients client,
+against a local fake upstream over TLS (plain HTTP if openssl is missing)
+
+    python benchmarks/bench_upstream.py            # 500 calls
+    python benchmarks/bench_upstream.py 2000 plain
+"""
+
+import asyncio
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TMP = tempfile.mkdtemp()
+
+import httpx  # noqa: E402
+
+from upstream import UpstreamClients  # noqa: E402
+
+BODY = b'{"candidates":[{"content":{"parts":[{"text":"ok"}]}}]}'
+
+
+def make_tls_context():
+    """Self-signed certificate for 127.0.0.1; trusted by httpx via SSL_CERT_FILE"""
+    cert, key = os.path.join(TMP, "cert.pem"), os.path.join(TMP, "key.pem")
+    try:
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+             "-keyout", key, "-out", cert, "-subj", "/CN=127.0.0.1",
+             "-addext", "subjectAltName=IP:127.0.0.1"],
+            check=True, capture_output=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    os.environ["SSL_CERT_FILE"] = cert
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+async def serve(context):
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        await reader.readexactly(int(line.split(b":")[1]))
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\ncontent-type: application/json\r\n"
+                    b"content-length: %d\r\n\r\n%s" % (len(BODY), BODY)
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0, ssl=context)
+    scheme = "https" if context else "http"
+    return server, f"{scheme}://127.0.0.1:{server.sockets[0].getsockname()[1]}/v1/generate"
+
+
+async def per_request(url: str, _clients) -> None:
+    async with httpx.AsyncClient() as client:
+        response = await client.post(url, json={"prompt": "hi"}, timeout=30.0)
+        response.raise_for_status()
+
+
+async def pooled(url: str, clients: UpstreamClients) -> None:
+    response = await clients.client("gemini").post(url, json={"prompt": "hi"}, timeout=30.0)
+    response.raise_for_status()
+
+
+async def measure(label: str, call, url: str, calls: int) -> None:
+    clients = UpstreamClients()
+    latencies = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        await call(url, clients)
+        latencies.append((time.perf_counter() - started) * 1000)
+    stats = clients.stats()["clients"].get("gemini")
+    await clients.aclose()
+    latencies.sort()
+    print(
+        f"  {label:<34} p50 {statistics.median(latencies):7.2f} ms"
+        f"   p99 {latencies[int(len(latencies) * 0.99) - 1]:7.2f} ms"
+        + (f"   reuse {stats['reuse_rate']:.2%}" if stats else "")
+    )
+
+
+async def main(calls: int, tls: bool) -> None:
+    context = make_tls_context() if tls else None
+    server, url = await serve(context)
+    print(f"{calls} sequential calls to a local {'TLS' if context else 'plain HTTP'} upstream")
+    await measure("new client per request (before)", per_request, url, calls)
+    await measure("pooled keep-alive client", pooled, url, calls)
+    server.close()
+    await server.wait_closed()
+
+
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    tls = not (len(sys.argv) > 2 and sys.argv[2] == "plain")
+    asyncio.run(main(calls, tls))
@@ -0,0 +1,59 @@
+"""
+Benchmark: resident bytes per device, plain dict usage table vs
+CompactUsageTable
+
+    python benchmarks/bench_usage_memory.py          # 100k devices
+    python benchmarks/bench_usage_memory.py 1000000
+"""
+
+import gc
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from usage_store import CompactUsageTable  # noqa: E402
+
+
+def records(devices: int):
+    """Production-shaped records, built fresh so nothing is shared"""
+    base = datetime(2026, 1, 1)
+    for i in range(devices):
+        stamp = (base + timedelta(seconds=i)).isoformat()
+        record = {
+            "count": i % 500,
+            # A handful of paying users share license keys across devices
+            "license_key": f"HA-SUB-1700000000-{i % 1000:016x}-abcdef0123456789"
+            if i % 10 == 0
+            else None,
+            "last_used": stamp,
+            "created_at": stamp,
+        }
+        if i % 20 == 0:
+            record["last_auto_apply_count"] = 3
+            record["last_auto_apply_job_ids"] = ["job-1", "job-2", "job-3"]
+        # Extension fingerprints are long hex/base64 strings
+        yield f"{i:08x}{'f' * 56}", record
+
+
+def measure(label: str, build, devices: int) -> None:
+    gc.collect()
+    tracemalloc.start()
+    table = build()
+    for fingerprint, record in records(devices):
+        table[fingerprint] = record
+    gc.collect()
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {label:<20} {size / devices:8.0f} bytes/device  "
+          f"({size / 1e6:.1f} MB total)")
+    del table
+
+
+if __name__ == "__main__":
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print(f"{devices} devices")
+    measure("dict (before)", dict, devices)
+    measure("CompactUsageTable", CompactUsageTable, devices)
@@ -0,0 +1,174 @@
+"""
+Sharded in-memory usage counters, merged into the database on an interval
+
+/api/track-usage only needs "count += 1, last_used = now" per device. With
+USAGE_COUNTER_FLUSH_MS > 0 those bumps land in one of USAGE_COUNTER_SHARDS
+small dicts (one lock each) instead of the database, and a background
+thread folds the accumulated deltas in with one BaseDatabase.merge_usage
+call per interval.
+
+Each pending entry is a grow-only count plus a last-seen maximum, so merges
+are commutative: several workers can each keep their own counters and fold
+them into the shared SQLite store in any order. They are not idempotent
+(merge_usage adds the counts, so a batch applied twice is counted twice);
+each batch is swapped out of the shards and merged once under the merge
+lock, a failed merge is folded back into the shards rather than replayed,
+and the generation seqlock keeps count() from adding a batch that is being
+applied on top of the stored count.
+"""
+
+import os
+import threading
+import zlib
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+USAGE_COUNTER_FLUSH_MS = int(os.environ.get("USAGE_COUNTER_FLUSH_MS", "0"))
+USAGE_COUNTER_SHARDS = int(os.environ.get("USAGE_COUNTER_SHARDS", "16"))
+
+# {device_fingerprint: (count delta, latest last_used)}
+Deltas = Dict[str, Tuple[int, str]]
+
+
+class _Shard:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending: Dict[str, List] = {}
+
+
+class UsageCounters:
+    """Per-shard pending deltas plus the batch currently being merged"""
+
+    def __init__(
+        self,
+        merge: Callable[[Deltas], None],
+        shards: Optional[int] = None,
+        interval_ms: Optional[int] = None,
+    ):
+        self.merge = merge
+        self.interval_ms = (
+            USAGE_COUNTER_FLUSH_MS if interval_ms is None else interval_ms
+        )
+        self._shards = [
+            _Shard() for _ in range(max(1, shards or USAGE_COUNTER_SHARDS))
+        ]
+        # Deltas handed to merge() but not yet acknowledged, and a seqlock
+        # style generation: odd while a merge is being applied
+        self._merging: Deltas = {}
+        self._generation = 0
+        self._state_lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._merger: Optional[threading.Thread] = None
+        self.merges = 0
+
+    def _shard(self, device_fingerprint: str) -> _Shard:
+        # crc32 rather than hash(): stable across processes and restarts
+        index = zlib.crc32(device_fingerprint.encode()) % len(self._shards)
+        return self._shards[index]
+
+    def add(self, device_fingerprint: str, now: Optional[str] = None):
+        """Count one use of a device"""
+        now = now or datetime.now().isoformat()
+        shard = self._shard(device_fingerprint)
+        with shard.lock:
+            entry = shard.pending.get(device_fingerprint)
+            if entry is None:
+                shard.pending[device_fingerprint] = [1, now]
+            else:
+                entry[0] += 1
+                if now > entry[1]:
+                    entry[1] = now
+        if self._merger is None and self.interval_ms > 0:
+            self._start()
+
+    def _unmerged(self, device_fingerprint: str) -> int:
+        shard = self._shard(device_fingerprint)
+        with shard.lock:
+            entry = shard.pending.get(device_fingerprint)
+            return entry[0] if entry else 0
+
+    def pending(self, device_fingerprint: str) -> int:
+        """Uses counted here but not yet merged into the database"""
+        merging = self._merging.get(device_fingerprint)
+        return self._unmerged(device_fingerprint) + (merging[0] if merging else 0)
+
+    def count(
+        self, device_fingerprint: str, read_count: Callable[[str], int]
+    ) -> int:
+        """
+        Stored count plus pending deltas. Retries when a merge lands between
+        reading the store and the counters, so a device never sees a delta
+        counted twice; if merges keep racing it leaves out the batch being
+        merged and may briefly under-count instead.
+        """
+        for _ in range(3):
+            generation = self._generation
+            stored = read_count(device_fingerprint)
+            if generation % 2 == 0:
+                with self._state_lock:
+                    pending = self.pending(device_fingerprint)
+                    if self._generation == generation:
+                        return stored + pending
+        return read_count(device_fingerprint) + self._unmerged(device_fingerprint)
+
+    def flush(self) -> int:
+        """Merge every pending delta into the database; returns devices merged"""
+        with self._merge_lock:
+            with self._state_lock:
+                deltas: Deltas = {}
+                for shard in self._shards:
+                    with shard.lock:
+                        batch, shard.pending = shard.pending, {}
+                    for device_fingerprint, (count, last_used) in batch.items():
+                        deltas[device_fingerprint] = (count, last_used)
+                if not deltas:
+                    return 0
+                self._merging = deltas
+                self._generation += 1
+            try:
+                self.merge(deltas)
+            except Exception as e:
+                print(f"Error merging usage counters: {e}")
+                with self._state_lock:
+                    self._merging = {}
+                    self._generation += 1
+                    # Fold the batch back in so the next merge retries it
+                    for device_fingerprint, (count, last_used) in deltas.items():
+                        shard = self._shard(device_fingerprint)
+                        with shard.lock:
+                            entry = shard.pending.setdefault(
+                                device_fingerprint, [0, last_used]
+                            )
+                            entry[0] += count
+                            entry[1] = max(entry[1], last_used)
+                return 0
+            with self._state_lock:
+                self._merging = {}
+                self._generation += 1
+            self.merges += 1
+            return len(deltas)
+
+    def _start(self):
+        with self._merge_lock:
+            if self._merger is None:
+                self._merger = threading.Thread(
+                    target=self._merge_loop, name="usage-counters", daemon=True
+                )
+                self._merger.start()
+
+    def _merge_loop(self):
+        while not self._stop_event.wait(self.interval_ms / 1000):
+            self.flush()
+
+    def close(self):
+        """Stop the merge thread and merge whatever is still pending"""
+        merger = self._merger
+        if merger is not None:
+            self._stop_event.set()
+            merger.join()
+            self._merger = None
+            self._stop_event.clear()
+        self.flush()
@@ -1,39 +1,449 @@
 """
-Simple JSON-based database for license and usage tracking
-For production: Replace with PostgreSQL, Firebase, or Cloud SQL
+Database for license and usage tracking
+
+Backends (DB_BACKEND, or inferred from the DB_FILE extension):
+- json (default): simple JSON file store, see Database below
+- sqlite: SQLite in WAL mode (db_sqlite.py), picked for .db/.sqlite files;
+  indexed single-row updates and safe to share between uvicorn workers
+
+Running several worker processes (WEB_CONCURRENCY > 1) requires the sqlite
+backend: each JSON store is private to its process and would overwrite the
+others' writes, so create_database() refuses that combination.
+
+JSON persistence modes:
+- snapshot (default): every mutation rewrites the whole JSON file
+- journal (DB_JOURNAL=1): mutations are appended to DB_FILE + ".journal" as
+  small records and folded into the JSON snapshot every DB_CHECKPOINT_RECORDS
+  records, so a single write costs O(record) instead of O(database). The
+  records of one commit (a batch, or a group commit flush) share a single
+  CRC-framed line, so replay applies all of them or none
+
+Either mode can use group commit (DB_FLUSH_INTERVAL_MS > 0): mutations only
+mark records dirty and a background flusher writes them out every interval
+or once DB_FLUSH_MAX_PENDING mutations are waiting. DB_FSYNC picks the
+durability policy for those writes: always, interval (at most once per
+DB_FSYNC_INTERVAL_MS) or never.
+
+DB_SNAPSHOT_FORMAT=binary writes snapshots in the compact columnar format of
+snapshot.py instead of JSON; load() accepts either format.
+
+DB_COMPACT_USAGE=1 keeps the usage table in usage_store.CompactUsageTable
+(slotted records, hashed fingerprint keys) to cut per-device memory.
+DB_HOT_USAGE_RECORDS=N bounds it instead: usage_store.TieredUsageTable keeps
+the N most recently used devices in memory and spills the rest to a
+private DB_FILE + ".cold.<random>" file.
+
+backup() takes online full or incremental backups without pausing writers
+(see backup.py).
 """
 
+import asyncio
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Optional
+from functools import partial
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 import threading
 
+import schema
+import snapshot
+from indexes import LicenseIndexes, UsageIndexes
+from journal import (
+    JOURNAL_SUFFIX,
+    decode_journal_records,
+    encode_journal_group,
+    encode_journal_record,
+)
+from usage_store import CompactUsageTable, TieredUsageTable
+
 DB_FILE = os.environ.get("DB_FILE", "/data/hiredalways.json")
+DB_BACKEND = os.environ.get("DB_BACKEND", "").lower()
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+DB_IO_THREADS = int(os.environ.get("DB_IO_THREADS", "4"))
+DB_JOURNAL = os.environ.get("DB_JOURNAL", "").lower() in ("1", "true", "yes")
+DB_CHECKPOINT_RECORDS = int(os.environ.get("DB_CHECKPOINT_RECORDS", "1000"))
+DB_FLUSH_INTERVAL_MS = int(os.environ.get("DB_FLUSH_INTERVAL_MS", "0"))
+DB_FLUSH_MAX_PENDING = int(os.environ.get("DB_FLUSH_MAX_PENDING", "1000"))
+DB_FSYNC = os.environ.get("DB_FSYNC", "never").lower()
+DB_FSYNC_INTERVAL_MS = int(os.environ.get("DB_FSYNC_INTERVAL_MS", "1000"))
+DB_SNAPSHOT_FORMAT = os.environ.get("DB_SNAPSHOT_FORMAT", "json").lower()
+DB_SNAPSHOT_COMPRESSION = os.environ.get("DB_SNAPSHOT_COMPRESSION", "zlib").lower()
+DB_COMPACT_USAGE = os.environ.get("DB_COMPACT_USAGE", "").lower() in ("1", "true", "yes")
+DB_HOT_USAGE_RECORDS = int(os.environ.get("DB_HOT_USAGE_RECORDS", "0"))
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+USAGE_ORDERS = ("last_used", "count")
+# The fields increment_usage and merge_usage change
+COUNTER_FIELDS = ("count", "last_used")
+
+
+def new_usage_record() -> Dict:
+    """Usage record for a device that has not been seen before"""
+    return schema.stamp("usage", {
+        "count": 0,
+        "license_key": None,
+        "last_used": None,
+        "created_at": datetime.now().isoformat(),
+    })
+
+
+def new_license_record(user_id: str, **kwargs) -> Dict:
+    """Record for a license created now"""
+    now = datetime.now().isoformat()
+    return schema.stamp("licenses", {
+        "active": True,
+        "user_id": user_id,
+        "start_date": now,
+        "created_at": now,
+        **kwargs
+    })
+
+
+class BaseDatabase:
+    """
+    Storage interface used by api.py; every backend implements these.
+    The a*-prefixed coroutines run the same calls on a dedicated I/O thread
+    pool so locks and disk writes never stall the event loop.
+    """
+
+    _io_executor: Optional[ThreadPoolExecutor] = None
+    _listeners: Tuple[Callable, ...] = ()
+
+    # Change notifications
+    def add_listener(self, listener: Callable[[str, str, Optional[Tuple]], None]):
+        """
+        Call listener(table, key, fields) after each committed change made
+        through this instance; fields names what changed, None if unknown
+        """
+        self._listeners += (listener,)
+
+    def _notify(self, table: str, key: str, fields: Optional[Tuple] = None):
+        for listener in self._listeners:
+            try:
+                listener(table, key, fields)
+            except Exception as e:
+                print(f"Error in change listener: {e}")
+
+    # License methods
+    def get_license(self, license_key: str) -> Optional[Dict]:
+        """Get license data"""
+        raise NotImplementedError
+
+    def create_license(self, license_key: str, user_id: str, **kwargs):
+        """Create a new license"""
+        raise NotImplementedError
+
+    def update_license(self, license_key: str, updates: Dict):
+        """Update license data (no-op for unknown keys)"""
+        raise NotImplementedError
+
+    def revoke_license(self, license_key: str):
+        """Revoke a license"""
+        self.update_license(license_key, {"active": False})
+
+    def create_licenses(self, licenses: Dict[str, Dict]):
+        """
+        Create every {license_key: {"user_id": ..., **fields}} license in
+        one atomic commit
+        """
+        raise NotImplementedError
+
+    def update_licenses(self, updates: Dict[str, Dict]) -> List[str]:
+        """
+        Apply {license_key: updates} in one atomic commit; unknown keys are
+        skipped. Returns the keys that were updated.
+        """
+        raise NotImplementedError
 
-class Database:
-    def __init__(self):
+    def revoke_licenses(self, license_keys) -> List[str]:
+        """Revoke several licenses in one commit; returns those that exist"""
+        return self.update_licenses(
+            {license_key: {"active": False} for license_key in license_keys}
+        )
+
+    def find_licenses(
+        self,
+        user_id: Optional[str] = None,
+        paypal_subscription_id: Optional[str] = None,
+        paypal_order_id: Optional[str] = None,
+    ) -> Dict[str, Dict]:
+        """
+        Licenses matching every given field, as {license_key: license}.
+        user_id matches case-insensitively.
+        """
+        raise NotImplementedError
+
+    def scan_licenses(
+        self,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        after: Optional[Tuple] = None,
+        limit: int = 100,
+        reverse: bool = False,
+    ) -> List[Tuple]:
+        """
+        One page of (start_date, license_key, license) with
+        start <= start_date < end, continuing after the `after`
+        (start_date, license_key) cursor
+        """
+        raise NotImplementedError
+
+    # Usage methods
+    def scan_usage(
+        self,
+        order: str,
+        start=None,
+        end=None,
+        after: Optional[Tuple] = None,
+        limit: int = 100,
+        reverse: bool = False,
+    ) -> List[Tuple]:
+        """
+        One page of (value, device_fingerprint, usage) ordered by the
+        USAGE_ORDERS field `order`, with start <= value < end
+        """
+        raise NotImplementedError
+
+    def get_usage(self, device_fingerprint: str) -> Dict:
+        """
+        Get usage data for a device. Read-only: unknown devices get a
+        default record that is not stored; only mutations create records.
+        """
+        raise NotImplementedError
+
+    def increment_usage(self, device_fingerprint: str):
+        """Increment usage counter"""
+        raise NotImplementedError
+
+    def update_usage(self, device_fingerprint: str, updates: Dict):
+        """Update usage data"""
+        raise NotImplementedError
+
+    def merge_usage(self, deltas: Dict):
+        """
+        Fold counter deltas {device_fingerprint: (count, last_used)} into
+        the usage table: counts are added, last_used only moves forward
+        """
+        raise NotImplementedError
+
+    # Async API
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Run a blocking database call on the I/O executor"""
+        if self._io_executor is None:
+            self._io_executor = ThreadPoolExecutor(
+                max_workers=DB_IO_THREADS, thread_name_prefix="db-io"
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._io_executor, partial(fn, *args, **kwargs)
+        )
+
+    async def aget_license(self, license_key: str) -> Optional[Dict]:
+        return await self.run(self.get_license, license_key)
+
+    async def acreate_license(self, license_key: str, user_id: str, **kwargs):
+        return await self.run(self.create_license, license_key, user_id, **kwargs)
+
+    async def aupdate_license(self, license_key: str, updates: Dict):
+        return await self.run(self.update_license, license_key, updates)
+
+    async def arevoke_license(self, license_key: str):
+        return await self.run(self.revoke_license, license_key)
+
+    async def acreate_licenses(self, licenses: Dict[str, Dict]):
+        return await self.run(self.create_licenses, licenses)
+
+    async def arevoke_licenses(self, license_keys) -> List[str]:
+        return await self.run(self.revoke_licenses, license_keys)
+
+    async def aget_usage(self, device_fingerprint: str) -> Dict:
+        return await self.run(self.get_usage, device_fingerprint)
+
+    async def aincrement_usage(self, device_fingerprint: str):
+        return await self.run(self.increment_usage, device_fingerprint)
+
+    async def aupdate_usage(self, device_fingerprint: str, updates: Dict):
+        return await self.run(self.update_usage, device_fingerprint, updates)
+
+    def stats(self) -> Dict:
+        """Record counts and storage counters for the admin stats endpoint"""
+        raise NotImplementedError
+
+    def sweep_schema(self, batch_size: int = 500) -> Iterator[int]:
+        """
+        Upgrade outdated records (schema.py) one batch at a time, yielding
+        the number upgraded per batch so callers can pace the work
+        """
+        raise NotImplementedError
+
+    def backup(self, directory: Optional[str] = None, incremental: bool = False) -> Dict:
+        """
+        Write a consistent online backup into `directory` (backup.py) and
+        return its manifest entry; incremental falls back to full when there
+        is no chain to extend
+        """
+        raise NotImplementedError
+
+    # Lifecycle
+    def flush(self):
+        """Write out any buffered changes"""
+
+    def close(self):
+        """Flush and release storage resources"""
+        self.flush()
+        self._shutdown_executor()
+
+    def _shutdown_executor(self):
+        if self._io_executor is not None:
+            self._io_executor.shutdown(wait=True)
+            self._io_executor = None
+
+
+class Database(BaseDatabase):
+    """JSON file store (snapshot or journal persistence)"""
+
+    def __init__(
+        self,
+        journal: Optional[bool] = None,
+        flush_interval_ms: Optional[int] = None,
+        fsync: Optional[str] = None,
+        snapshot_format: Optional[str] = None,
+        compact_usage: Optional[bool] = None,
+        hot_usage_records: Optional[int] = None,
+    ):
         self.lock = threading.RLock()
+        self.journal = DB_JOURNAL if journal is None else journal
+        self.flush_interval_ms = (
+            DB_FLUSH_INTERVAL_MS if flush_interval_ms is None else flush_interval_ms
+        )
+        self.fsync = (DB_FSYNC if fsync is None else fsync).lower()
+        if self.fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {self.fsync}")
+        self.snapshot_format = (
+            DB_SNAPSHOT_FORMAT if snapshot_format is None else snapshot_format
+        ).lower()
+        if self.snapshot_format not in ("json", "binary"):
+            raise ValueError(f"Unknown snapshot format: {self.snapshot_format}")
+        compact_usage = DB_COMPACT_USAGE if compact_usage is None else compact_usage
+        if hot_usage_records is None:
+            hot_usage_records = DB_HOT_USAGE_RECORDS
+        if compact_usage and hot_usage_records:
+            raise ValueError("Compact and tiered usage tables are exclusive")
+        if hot_usage_records:
+            usage = TieredUsageTable(DB_FILE + ".cold", hot_usage_records)
+        else:
+            usage = CompactUsageTable() if compact_usage else {}
         self.data = {
             "licenses": {},  # {license_key: {active, user_id, start_date, etc}}
-            "usage": {}      # {device_fingerprint: {count, license_key, last_used}}
+            "usage": usage   # {device_fingerprint: {count, license_key, last_used}}
         }
+        self._journal_file = None
+        self._journal_path = None
+        self._journal_records = 0
+        self._last_fsync = time.monotonic()
+        self._unsynced = False
+        # Group commit state: dirty (table, key) pairs in mutation order
+        self._dirty: Dict = {}
+        self._pending = 0
+        self._flush_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self.flush_count = 0
+        self.license_indexes = LicenseIndexes()
+        # Built on the first admin range query, then maintained on writes
+        self.usage_indexes: Optional[UsageIndexes] = None
+        # Online backups: keys changed since the last one (None until the
+        # first full backup of this process starts a chain)
+        self._backup_lock = threading.Lock()
+        self._backup_id: Optional[str] = None
+        self._backup_changes: Optional[Dict] = None
         self.load()
 
     def load(self):
         """Load database from file"""
         try:
             if os.path.exists(DB_FILE):
-                with open(DB_FILE, 'r') as f:
+                with open(DB_FILE, 'rb') as f:
                     content = f.read()
-                    if content.strip():
-                        loaded_data = json.loads(content)
-                        self.data.update(loaded_data)
+                    if snapshot.is_snapshot(content):
+                        self._install(snapshot.loads(content))
+                        print(f"Database loaded from {DB_FILE}")
+                    elif content.strip():
+                        with snapshot.gc_paused():
+                            loaded_data = json.loads(content)
+                        self._install(loaded_data)
                         print(f"Database loaded from {DB_FILE}")
         except Exception as e:
             print(f"Warning: Could not load database: {e}")
             # Continue with empty database
 
+        if self.journal:
+            self.replay_journal()
+        self.license_indexes.rebuild(self.data["licenses"])
+        self.usage_indexes = None
+
+    def replay_journal(self) -> int:
+        """
+        Apply journal records on top of the loaded snapshot.
+        A torn or corrupt tail (crash mid-append) is truncated away.
+        """
+        path = DB_FILE + JOURNAL_SUFFIX
+        applied = 0
+        try:
+            if not os.path.exists(path):
+                return 0
+            good_offset = 0
+            with open(path, 'rb') as f:
+                for line in f:
+                    records = decode_journal_records(line)
+                    if records is None:
+                        break
+                    for record in records:
+                        self._apply(*record)
+                    good_offset += len(line)
+                    applied += len(records)
+                torn = f.seek(0, os.SEEK_END) != good_offset
+            if torn:
+                print(f"Warning: Truncating torn journal tail at byte {good_offset}")
+                with open(path, 'r+b') as f:
+                    f.truncate(good_offset)
+            self._journal_records = applied
+            if applied:
+                print(f"Replayed {applied} journal records from {path}")
+        except Exception as e:
+            print(f"Warning: Could not replay journal: {e}")
+        return applied
+
+    def _install(self, loaded_data: Dict):
+        """Adopt loaded tables, keeping a custom usage container if one is set"""
+        usage = loaded_data.pop("usage", None)
+        self.data.update(loaded_data)
+        if usage is not None:
+            if isinstance(self.data["usage"], dict):
+                self.data["usage"] = usage
+            else:
+                with snapshot.gc_paused():
+                    self.data["usage"].update(usage)
+
+    def _apply(self, table: str, key: str, value: Optional[Dict]):
+        if value is None:
+            self.data[table].pop(key, None)
+        else:
+            self.data[table][key] = value
+        if table == "usage":
+            self._index_usage(key, value)
+
+    def _index_usage(self, device_fingerprint: str, usage: Optional[Dict]):
+        if self.usage_indexes is not None:
+            # Index under the key the table iterates as (hashed when compact)
+            stored_key = getattr(self.data["usage"], "stored_key", None)
+            if stored_key:
+                device_fingerprint = stored_key(device_fingerprint)
+            self.usage_indexes.update(device_fingerprint, usage)
+
     def save(self):
         """Save database to file"""
         try:
@@ -43,67 +453,460 @@ class Database:
                 os.makedirs(dir_path, exist_ok=True)
 
             with self.lock:
-                with open(DB_FILE, 'w') as f:
-                    json.dump(self.data, f, indent=2)
+                # Write a sibling temp file and rename it over DB_FILE so a
+                # crash never leaves a half-written snapshot behind
+                tmp_path = DB_FILE + ".tmp"
+                binary = self.snapshot_format == "binary"
+                with open(tmp_path, 'wb' if binary else 'w') as f:
+                    if binary:
+                        f.write(snapshot.dumps(self.data, DB_SNAPSHOT_COMPRESSION))
+                    else:
+                        snapshot.dump_json(self.data, f)
+                    # The journal is only dropped once the snapshot is durable
+                    self._sync(f, force=self.journal)
+                os.replace(tmp_path, DB_FILE)
+                if self.journal:
+                    # A crash before this truncate just replays records that
+                    # are already in the snapshot; records carry full values
+                    self._truncate_journal()
         except Exception as e:
             print(f"Error saving database: {e}")
 
+    def checkpoint(self):
+        """Fold the journal into a fresh snapshot"""
+        self.save()
+
+    def close(self):
+        """Stop the flusher, write pending changes and release the journal"""
+        if self._flusher is not None:
+            self._stop_event.set()
+            self._flush_event.set()
+            self._flusher.join()
+            self._flusher = None
+            self._stop_event.clear()
+        with self.lock:
+            self.flush()
+            if self.journal:
+                self.checkpoint()
+            if self._journal_file is not None:
+                self._journal_file.close()
+                self._journal_file = None
+            if isinstance(self.data["usage"], TieredUsageTable):
+                self.data["usage"].close()
+        self._shutdown_executor()
+
+    def flush(self):
+        """Write out every record dirtied since the last group commit"""
+        with self.lock:
+            if not self._dirty:
+                return
+            keys = list(self._dirty)
+            self._dirty.clear()
+            self._pending = 0
+            self._flush_event.clear()
+            self._persist(keys)
+            self.flush_count += 1
+
+    def _flush_loop(self):
+        interval = self.flush_interval_ms / 1000
+        while not self._stop_event.is_set():
+            self._flush_event.wait(interval)
+            try:
+                self.flush()
+                if self._unsynced:
+                    with self.lock:
+                        if self._journal_file is not None:
+                            self._sync(self._journal_file)
+            except Exception as e:
+                print(f"Error flushing database: {e}")
+
+    def _sync(self, f, force: bool = False):
+        """fsync an open file according to the durability policy"""
+        if self.fsync == "never" and not force:
+            return
+        now = time.monotonic()
+        if (
+            force
+            or self.fsync == "always"
+            or now - self._last_fsync >= DB_FSYNC_INTERVAL_MS / 1000
+        ):
+            f.flush()
+            os.fsync(f.fileno())
+            self._last_fsync = now
+            self._unsynced = False
+        else:
+            self._unsynced = True
+
+    def _truncate_journal(self):
+        path = DB_FILE + JOURNAL_SUFFIX
+        if self._journal_file is not None and self._journal_path == path:
+            self._journal_file.seek(0)
+            self._journal_file.truncate()
+        elif os.path.exists(path):
+            with open(path, 'r+b') as f:
+                f.truncate()
+        self._journal_records = 0
+
+    def _append_journal(self, keys):
+        path = DB_FILE + JOURNAL_SUFFIX
+        if self._journal_file is None or self._journal_path != path:
+            if self._journal_file is not None:
+                self._journal_file.close()
+            dir_path = os.path.dirname(path)
+            if dir_path:
+                os.makedirs(dir_path, exist_ok=True)
+            self._journal_file = open(path, 'ab')
+            self._journal_path = path
+        records = [(table, key, self.data[table].get(key)) for table, key in keys]
+        # Several keys are one commit (a batch or a group flush): one line
+        self._journal_file.write(
+            encode_journal_record(*records[0]) if len(records) == 1
+            else encode_journal_group(records)
+        )
+        self._journal_file.flush()
+        self._sync(self._journal_file)
+        self._journal_records += len(keys)
+
+    def _persist(self, keys):
+        """Write the given (table, key) records to disk"""
+        if not self.journal:
+            self.save()
+            return
+        try:
+            self._append_journal(keys)
+        except Exception as e:
+            print(f"Error appending to journal: {e}")
+            self.save()
+            return
+        if self._journal_records >= DB_CHECKPOINT_RECORDS:
+            self.checkpoint()
+
+    def _commit(self, table: str, key: str):
+        """Persist a single mutated record, or queue it for group commit"""
+        self._commit_many([(table, key)])
+
+    def _commit_many(self, keys):
+        """Persist several mutated (table, key) records with one write"""
+        with self.lock:
+            if self._backup_changes is not None:
+                self._backup_changes.update(dict.fromkeys(keys))
+            if self.flush_interval_ms <= 0:
+                self._persist(keys)
+                return
+            for key in keys:
+                self._dirty[key] = None
+            self._pending += len(keys)
+            if self._pending >= DB_FLUSH_MAX_PENDING:
+                self._flush_event.set()
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._flush_loop, name="db-flusher", daemon=True
+                )
+                self._flusher.start()
+
+    def backup(self, directory: Optional[str] = None, incremental: bool = False) -> Dict:
+        """
+        Stored records are never mutated in place (writers swap in new
+        dicts), so a shallow copy of the tables taken under the lock is a
+        point-in-time view that can be written out while writes continue.
+        """
+        import backup as backup_module
+
+        directory = directory or backup_module.DB_BACKUP_DIR
+        with self._backup_lock:
+            with self.lock:
+                chain = backup_module.read_manifest(directory)["backup_id"]
+                if incremental and chain is not None and chain == self._backup_id:
+                    lines = []
+                    for table, key in self._backup_changes:
+                        records = self.data[table]
+                        # Compact tables list hashed keys, as in the full backup
+                        stored_key = getattr(records, "stored_key", None)
+                        lines.append(encode_journal_record(
+                            table,
+                            stored_key(key) if stored_key else key,
+                            records.get(key),
+                        ))
+                    write = partial(
+                        backup_module.write_segment, directory, self._backup_id, lines
+                    )
+                else:
+                    self._backup_id = backup_module.new_backup_id()
+                    data = {
+                        table: dict(records) if type(records) is dict else records
+                        for table, records in self.data.items()
+                    }
+                    write = partial(
+                        backup_module.write_full, directory, self._backup_id, data,
+                        self.snapshot_format, DB_SNAPSHOT_COMPRESSION,
+                    )
+                self._backup_changes = {}
+                if any(type(records) is not dict for records in self.data.values()):
+                    # Compact/tiered tables build records on the fly and
+                    # cannot be copied cheaply: write while holding the lock
+                    return self._write_backup(write)
+            return self._write_backup(write)
+
+    def _write_backup(self, write) -> Dict:
+        try:
+            return write()
+        except Exception:
+            # Changes since the last backup were handed to the failed write;
+            # start a new chain next time instead of leaving a gap
+            self._backup_id = None
+            raise
+
+    def stats(self) -> Dict:
+        usage = self.data["usage"]
+        stats = {
+            "backend": "json",
+            "licenses": len(self.data["licenses"]),
+            "usage": len(usage),
+            "journal_records": self._journal_records,
+            "pending_writes": len(self._dirty),
+            "flushes": self.flush_count,
+        }
+        if hasattr(usage, "stats"):
+            stats["usage_table"] = usage.stats()
+        return stats
+
     # License methods
+    def _current(self, table: str, key: str, record: Optional[Dict]) -> Optional[Dict]:
+        """
+        Lazily upgrade a record read from `table`. The upgraded record
+        replaces the stored one in memory and reaches disk with the next
+        snapshot; reads never trigger a write of their own.
+        """
+        if record is None or not schema.needs_upgrade(table, record):
+            return record
+        with self.lock:
+            record = self.data[table].get(key)
+            upgraded = schema.upgrade(table, record)
+            if upgraded is not record:
+                self.data[table][key] = upgraded
+                if table == "licenses":
+                    self.license_indexes.update(key, upgraded)
+            return upgraded
+
+    def sweep_schema(self, batch_size: int = 500) -> Iterator[int]:
+        for table in schema.TABLES:
+            if not schema.UPGRADES[table]:
+                continue
+            with self.lock:
+                keys = list(self.data[table])
+            for start in range(0, len(keys), batch_size):
+                with self.lock:
+                    changed = []
+                    for key in keys[start:start + batch_size]:
+                        record = self.data[table].get(key)
+                        if record is not None and schema.needs_upgrade(table, record):
+                            self._current(table, key, record)
+                            changed.append((table, key))
+                    if changed:
+                        self._commit_many(changed)
+                yield len(changed)
+
     def get_license(self, license_key: str) -> Optional[Dict]:
         """Get license data"""
-        return self.data["licenses"].get(license_key)
+        return self._current(
+            "licenses", license_key, self.data["licenses"].get(license_key)
+        )
+
+    def find_licenses(
+        self,
+        user_id: Optional[str] = None,
+        paypal_subscription_id: Optional[str] = None,
+        paypal_order_id: Optional[str] = None,
+    ) -> Dict[str, Dict]:
+        """Indexed lookup of licenses by user / PayPal ids"""
+        indexes = self.license_indexes
+        criteria = [
+            (indexes.user_id, user_id.lower() if user_id else None),
+            (indexes.paypal_subscription_id, paypal_subscription_id),
+            (indexes.paypal_order_id, paypal_order_id),
+        ]
+        with self.lock:
+            keys = None
+            for index, value in criteria:
+                if value is not None:
+                    matches = index.get(value)
+                    keys = matches if keys is None else keys & matches
+            licenses = self.data["licenses"]
+            return {
+                key: self._current("licenses", key, licenses[key])
+                for key in sorted(keys or ())
+                if key in licenses
+            }
+
+    def scan_licenses(
+        self,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        after: Optional[Tuple] = None,
+        limit: int = 100,
+        reverse: bool = False,
+    ) -> List[Tuple]:
+        """Keyset page over the start_date index"""
+        with self.lock:
+            licenses = self.data["licenses"]
+            page = self.license_indexes.start_date.page(start, end, after, limit, reverse)
+            return [
+                (value, key, self._current("licenses", key, licenses[key]))
+                for value, key in page
+            ]
 
     def create_license(self, license_key: str, user_id: str, **kwargs):
         """Create a new license"""
         with self.lock:
-            self.data["licenses"][license_key] = {
-                "active": True,
-                "user_id": user_id,
-                "start_date": datetime.now().isoformat(),
-                "created_at": datetime.now().isoformat(),
-                **kwargs
-            }
-            self.save()
+            self.data["licenses"][license_key] = new_license_record(user_id, **kwargs)
+            self.license_indexes.update(
+                license_key, self.data["licenses"][license_key]
+            )
+            self._commit("licenses", license_key)
+            self._notify("licenses", license_key)
+
+    def create_licenses(self, licenses: Dict[str, Dict]):
+        """Create several licenses with a single write"""
+        with self.lock:
+            stored = self.data["licenses"]
+            for license_key, fields in licenses.items():
+                stored[license_key] = new_license_record(**fields)
+                self.license_indexes.update(license_key, stored[license_key])
+            self._commit_many([("licenses", key) for key in licenses])
+            for license_key in licenses:
+                self._notify("licenses", license_key)
 
     def update_license(self, license_key: str, updates: Dict):
         """Update license data"""
         with self.lock:
             if license_key in self.data["licenses"]:
-                self.data["licenses"][license_key].update(updates)
-                self.save()
+                # Copy-on-write: stored records are never mutated in place
+                self.data["licenses"][license_key] = {
+                    **self.get_license(license_key), **updates
+                }
+                self.license_indexes.update(
+                    license_key, self.data["licenses"][license_key]
+                )
+                self._commit("licenses", license_key)
+                self._notify("licenses", license_key, tuple(updates))
 
-    def revoke_license(self, license_key: str):
-        """Revoke a license"""
-        self.update_license(license_key, {"active": False})
+    def update_licenses(self, updates: Dict[str, Dict]) -> List[str]:
+        """Update several licenses with a single write"""
+        with self.lock:
+            stored = self.data["licenses"]
+            updated = [key for key in updates if key in stored]
+            for license_key in updated:
+                stored[license_key] = {
+                    **self.get_license(license_key), **updates[license_key]
+                }
+                self.license_indexes.update(license_key, stored[license_key])
+            if updated:
+                self._commit_many([("licenses", key) for key in updated])
+            for license_key in updated:
+                self._notify("licenses", license_key, tuple(updates[license_key]))
+            return updated
 
     # Usage methods
+    def scan_usage(
+        self,
+        order: str,
+        start=None,
+        end=None,
+        after: Optional[Tuple] = None,
+        limit: int = 100,
+        reverse: bool = False,
+    ) -> List[Tuple]:
+        """Keyset page over the last_used or count index"""
+        if order not in USAGE_ORDERS:
+            raise ValueError(f"Cannot order usage by {order}")
+        with self.lock:
+            usage = self.data["usage"]
+            if self.usage_indexes is None:
+                self.usage_indexes = UsageIndexes()
+                self.usage_indexes.rebuild(usage)
+            index = getattr(self.usage_indexes, order)
+            return [
+                (value, key, self._current("usage", key, usage[key]))
+                for value, key in index.page(start, end, after, limit, reverse)
+            ]
+
     def get_usage(self, device_fingerprint: str) -> Dict:
-        """Get usage data for a device"""
-        if device_fingerprint not in self.data["usage"]:
-            with self.lock:
-                self.data["usage"][device_fingerprint] = {
-                    "count": 0,
-                    "license_key": None,
-                    "last_used": None,
-                    "created_at": datetime.now().isoformat()
-                }
-                self.save()
-        return self.data["usage"][device_fingerprint]
+        """Get usage data for a device (never stores anything)"""
+        usage = self.data["usage"].get(device_fingerprint)
+        if usage is None:
+            return new_usage_record()
+        return self._current("usage", device_fingerprint, usage)
 
     def increment_usage(self, device_fingerprint: str):
         """Increment usage counter"""
         with self.lock:
-            usage = self.get_usage(device_fingerprint)
+            usage = dict(self.get_usage(device_fingerprint))
             usage["count"] += 1
             usage["last_used"] = datetime.now().isoformat()
-            self.save()
+            self.data["usage"][device_fingerprint] = usage
+            self._index_usage(device_fingerprint, usage)
+            self._commit("usage", device_fingerprint)
+            self._notify("usage", device_fingerprint, COUNTER_FIELDS)
 
     def update_usage(self, device_fingerprint: str, updates: Dict):
         """Update usage data"""
         with self.lock:
-            usage = self.get_usage(device_fingerprint)
-            usage.update(updates)
-            self.save()
+            usage = {**self.get_usage(device_fingerprint), **updates}
+            self.data["usage"][device_fingerprint] = usage
+            self._index_usage(device_fingerprint, usage)
+            self._commit("usage", device_fingerprint)
+            self._notify("usage", device_fingerprint, tuple(updates))
+
+    def merge_usage(self, deltas: Dict):
+        """Fold counter deltas into the usage table with a single write"""
+        with self.lock:
+            for device_fingerprint, (count, last_used) in deltas.items():
+                usage = dict(self.get_usage(device_fingerprint))
+                usage["count"] += count
+                if last_used > (usage.get("last_used") or ""):
+                    usage["last_used"] = last_used
+                self.data["usage"][device_fingerprint] = usage
+                self._index_usage(device_fingerprint, usage)
+            self._commit_many([("usage", key) for key in deltas])
+            for device_fingerprint in deltas:
+                self._notify("usage", device_fingerprint, COUNTER_FIELDS)
+
+
+def create_database(
+    backend: Optional[str] = None, workers: Optional[int] = None
+) -> BaseDatabase:
+    """Build the database backend selected by DB_BACKEND / DB_FILE"""
+    backend = (backend or DB_BACKEND).lower()
+    workers = WEB_CONCURRENCY if workers is None else workers
+    if not backend:
+        is_sqlite = DB_FILE.endswith((".db", ".sqlite", ".sqlite3"))
+        backend = "sqlite" if is_sqlite else "json"
+    if backend == "json":
+        if workers > 1:
+            raise ValueError(
+                f"WEB_CONCURRENCY={workers} needs a shared store: the json "
+                "backend is single-process, use DB_BACKEND=sqlite"
+            )
+        return Database()
+    if backend == "sqlite":
+        from db_sqlite import SQLiteDatabase
+
+        return SQLiteDatabase()
+    raise ValueError(f"Unknown database backend: {backend}")
+
+
+_db_lock = threading.Lock()
+
 
-# Global database instance
-db = Database()
+def __getattr__(name: str):
+    """
+    The global database instance (`from db import db`), created on first
+    use: tools that only import this module, such as dbtool.py, must not
+    load the live store, replay its journal or rebuild its cold file
+    """
+    if name != "db":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _db_lock:
+        if "db" not in globals():
+            globals()["db"] = create_database()
+    return globals()["db"]
@@ -0,0 +1,424 @@
+"""
+SQLite storage backend for license and usage tracking
+Runs in WAL mode so readers never block the writer, and several uvicorn
+worker processes can share one database file.
+"""
+
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import db as db_module
+import schema
+from db import (
+    COUNTER_FIELDS,
+    USAGE_ORDERS,
+    BaseDatabase,
+    new_license_record,
+    new_usage_record,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS licenses (
+    license_key TEXT PRIMARY KEY,
+    user_id TEXT,
+    active INTEGER NOT NULL DEFAULT 1,
+    start_date TEXT,
+    created_at TEXT,
+    plan TEXT,
+    paypal_subscription_id TEXT,
+    paypal_order_id TEXT,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_licenses_user_id
+    ON licenses(user_id COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_licenses_subscription
+    ON licenses(paypal_subscription_id);
+CREATE INDEX IF NOT EXISTS idx_licenses_order ON licenses(paypal_order_id);
+CREATE INDEX IF NOT EXISTS idx_licenses_start_date ON licenses(start_date);
+
+CREATE TABLE IF NOT EXISTS usage (
+    device_fingerprint TEXT PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0,
+    license_key TEXT,
+    last_used TEXT,
+    created_at TEXT,
+    email TEXT,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_usage_license_key ON usage(license_key);
+CREATE INDEX IF NOT EXISTS idx_usage_last_used ON usage(last_used);
+CREATE INDEX IF NOT EXISTS idx_usage_count ON usage(count, device_fingerprint);
+"""
+
+# Columns stored natively; any other record field goes into the `extra` JSON.
+# Optional columns are left out of the returned dict when NULL so records
+# look exactly like the JSON backend's.
+LICENSE_COLUMNS = ("user_id", "active", "start_date", "created_at")
+LICENSE_OPTIONAL = ("plan", "paypal_subscription_id", "paypal_order_id")
+USAGE_COLUMNS = ("count", "license_key", "last_used", "created_at")
+USAGE_OPTIONAL = ("email",)
+TABLES = {
+    "licenses": (LICENSE_COLUMNS, LICENSE_OPTIONAL),
+    "usage": (USAGE_COLUMNS, USAGE_OPTIONAL),
+}
+
+
+def _split(record: Dict, columns, optional):
+    """Split a record dict into column values and the `extra` JSON blob"""
+    known = columns + optional
+    values = [record.get(column) for column in known]
+    extra = {k: v for k, v in record.items() if k not in known}
+    return values, json.dumps(extra)
+
+
+def _join(row: sqlite3.Row, columns, optional) -> Dict:
+    """Rebuild the record dict from a row"""
+    record = {column: row[column] for column in columns}
+    for column in optional:
+        if row[column] is not None:
+            record[column] = row[column]
+    record.update(json.loads(row["extra"]))
+    return record
+
+
+class SQLiteDatabase(BaseDatabase):
+    """SQLite (WAL) store with the same record semantics as the JSON store"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or db_module.DB_FILE
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread; SQLite connections are not thread-safe"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction; IMMEDIATE takes the write lock up front so
+        read-modify-write sequences cannot interleave across processes"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self):
+        """Stop the I/O executor and close this thread's connection"""
+        self._shutdown_executor()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # Bulk access (dbtool.py)
+    def iter_records(self, table: str, batch_size: int = 1000):
+        """Stream raw (key, record) pairs of a table in primary-key order"""
+        last_key = None
+        while True:
+            batch = list(self._records_after(table, last_key, batch_size))
+            if not batch:
+                return
+            yield from batch
+            last_key = batch[-1][0]
+
+    def put_records(self, table: str, items):
+        """Insert or replace many (key, record) pairs in one transaction"""
+        put = self._put_license if table == "licenses" else self._put_usage
+        with self._transaction() as conn:
+            for key, record in items:
+                put(conn, key, record)
+
+    def sweep_schema(self, batch_size: int = 500):
+        for table in schema.TABLES:
+            if not schema.UPGRADES[table]:
+                continue
+            last_key = None
+            while True:
+                with self._transaction() as conn:
+                    batch = list(self._records_after(table, last_key, batch_size))
+                    changed = [
+                        (key, schema.upgrade(table, record))
+                        for key, record in batch
+                        if schema.needs_upgrade(table, record)
+                    ]
+                    put = self._put_license if table == "licenses" else self._put_usage
+                    for key, record in changed:
+                        put(conn, key, record)
+                if not batch:
+                    break
+                last_key = batch[-1][0]
+                yield len(changed)
+
+    def _records_after(self, table: str, last_key: Optional[str], limit: int):
+        """Raw (not upgraded) records with keys after `last_key`, in key order"""
+        columns, optional = TABLES[table]
+        key_column = "license_key" if table == "licenses" else "device_fingerprint"
+        where, params = "", (limit,)
+        if last_key is not None:
+            where, params = f"WHERE {key_column} > ?", (last_key, limit)
+        rows = self._connect().execute(
+            f"SELECT * FROM {table} {where} ORDER BY {key_column} LIMIT ?", params
+        ).fetchall()
+        for row in rows:
+            record = _join(row, columns, optional)
+            if table == "licenses":
+                record["active"] = bool(record["active"])
+            yield row[key_column], record
+
+    def backup(self, directory: Optional[str] = None, incremental: bool = False) -> Dict:
+        """Online copy through SQLite's backup API; always a full backup"""
+        import backup as backup_module
+
+        return backup_module.write_sqlite(
+            directory or backup_module.DB_BACKUP_DIR,
+            backup_module.new_backup_id(),
+            self._connect(),
+        )
+
+    def stats(self) -> Dict:
+        conn = self._connect()
+        return {
+            "backend": "sqlite",
+            "licenses": conn.execute("SELECT COUNT(*) FROM licenses").fetchone()[0],
+            "usage": conn.execute("SELECT COUNT(*) FROM usage").fetchone()[0],
+        }
+
+    # License methods
+    def get_license(self, license_key: str) -> Optional[Dict]:
+        """Get license data"""
+        row = self._connect().execute(
+            "SELECT * FROM licenses WHERE license_key = ?", (license_key,)
+        ).fetchone()
+        if row is None:
+            return None
+        record = _join(row, LICENSE_COLUMNS, LICENSE_OPTIONAL)
+        record["active"] = bool(record["active"])
+        # Upgraded lazily on read; written back the next time it is updated
+        return schema.upgrade("licenses", record)
+
+    def _license_rows(self, where: str, params) -> Dict[str, Dict]:
+        rows = self._connect().execute(
+            f"SELECT * FROM licenses WHERE {where}", params
+        ).fetchall()
+        licenses = {}
+        for row in rows:
+            record = _join(row, LICENSE_COLUMNS, LICENSE_OPTIONAL)
+            record["active"] = bool(record["active"])
+            licenses[row["license_key"]] = schema.upgrade("licenses", record)
+        return licenses
+
+    def find_licenses(
+        self,
+        user_id: Optional[str] = None,
+        paypal_subscription_id: Optional[str] = None,
+        paypal_order_id: Optional[str] = None,
+    ) -> Dict[str, Dict]:
+        """Indexed lookup of licenses by user / PayPal ids"""
+        clauses, params = [], []
+        for clause, value in (
+            ("user_id = ? COLLATE NOCASE", user_id),
+            ("paypal_subscription_id = ?", paypal_subscription_id),
+            ("paypal_order_id = ?", paypal_order_id),
+        ):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        if not clauses:
+            return {}
+        return self._license_rows(
+            " AND ".join(clauses) + " ORDER BY license_key", params
+        )
+
+    def _scan(
+        self, table: str, key_column: str, column: str,
+        start, end, after: Optional[Tuple], limit: int, reverse: bool,
+    ) -> List[sqlite3.Row]:
+        """Keyset page of rows ordered by (column, key_column)"""
+        clauses, params = [f"{column} IS NOT NULL"], []
+        if start is not None:
+            clauses.append(f"{column} >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append(f"{column} < ?")
+            params.append(end)
+        if after is not None:
+            clauses.append(f"({column}, {key_column}) {'<' if reverse else '>'} (?, ?)")
+            params.extend(after)
+        direction = "DESC" if reverse else "ASC"
+        return self._connect().execute(
+            f"SELECT * FROM {table} WHERE {' AND '.join(clauses)}"
+            f" ORDER BY {column} {direction}, {key_column} {direction} LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+
+    def scan_licenses(
+        self,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        after: Optional[Tuple] = None,
+        limit: int = 100,
+        reverse: bool = False,
+    ) -> List[Tuple]:
+        """Keyset page over idx_licenses_start_date"""
+        page = []
+        for row in self._scan(
+            "licenses", "license_key", "start_date", start, end, after, limit, reverse
+        ):
+            record = _join(row, LICENSE_COLUMNS, LICENSE_OPTIONAL)
+            record["active"] = bool(record["active"])
+            page.append((
+                row["start_date"], row["license_key"], schema.upgrade("licenses", record)
+            ))
+        return page
+
+    def _put_license(self, conn, license_key: str, record: Dict):
+        values, extra = _split(record, LICENSE_COLUMNS, LICENSE_OPTIONAL)
+        values[1] = int(bool(values[1]))  # active
+        conn.execute(
+            "INSERT OR REPLACE INTO licenses (license_key, user_id, active,"
+            " start_date, created_at, plan, paypal_subscription_id,"
+            " paypal_order_id, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (license_key, *values, extra),
+        )
+
+    def create_license(self, license_key: str, user_id: str, **kwargs):
+        """Create a new license"""
+        record = new_license_record(user_id, **kwargs)
+        with self._transaction() as conn:
+            self._put_license(conn, license_key, record)
+        self._notify("licenses", license_key)
+
+    def create_licenses(self, licenses: Dict[str, Dict]):
+        """Create several licenses in one transaction"""
+        records = {key: new_license_record(**fields) for key, fields in licenses.items()}
+        with self._transaction() as conn:
+            for license_key, record in records.items():
+                self._put_license(conn, license_key, record)
+        for license_key in records:
+            self._notify("licenses", license_key)
+
+    def update_license(self, license_key: str, updates: Dict):
+        """Update license data"""
+        with self._transaction() as conn:
+            record = self.get_license(license_key)
+            if record is None:
+                return
+            record.update(updates)
+            self._put_license(conn, license_key, record)
+        self._notify("licenses", license_key, tuple(updates))
+
+    def update_licenses(self, updates: Dict[str, Dict]) -> List[str]:
+        """Update several licenses in one transaction"""
+        updated = []
+        with self._transaction() as conn:
+            for license_key, changes in updates.items():
+                record = self.get_license(license_key)
+                if record is None:
+                    continue
+                record.update(changes)
+                self._put_license(conn, license_key, record)
+                updated.append(license_key)
+        for license_key in updated:
+            self._notify("licenses", license_key, tuple(updates[license_key]))
+        return updated
+
+    # Usage methods
+    def scan_usage(
+        self,
+        order: str,
+        start=None,
+        end=None,
+        after: Optional[Tuple] = None,
+        limit: int = 100,
+        reverse: bool = False,
+    ) -> List[Tuple]:
+        """Keyset page over idx_usage_last_used or idx_usage_count"""
+        if order not in USAGE_ORDERS:
+            raise ValueError(f"Cannot order usage by {order}")
+        return [
+            (
+                row[order],
+                row["device_fingerprint"],
+                schema.upgrade("usage", _join(row, USAGE_COLUMNS, USAGE_OPTIONAL)),
+            )
+            for row in self._scan(
+                "usage", "device_fingerprint", order, start, end, after, limit, reverse
+            )
+        ]
+
+    def _read_usage(self, device_fingerprint: str) -> Optional[Dict]:
+        row = self._connect().execute(
+            "SELECT * FROM usage WHERE device_fingerprint = ?",
+            (device_fingerprint,),
+        ).fetchone()
+        if row is None:
+            return None
+        return schema.upgrade("usage", _join(row, USAGE_COLUMNS, USAGE_OPTIONAL))
+
+    def _put_usage(self, conn, device_fingerprint: str, record: Dict):
+        values, extra = _split(record, USAGE_COLUMNS, USAGE_OPTIONAL)
+        conn.execute(
+            "INSERT OR REPLACE INTO usage (device_fingerprint, count,"
+            " license_key, last_used, created_at, email, extra)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (device_fingerprint, *values, extra),
+        )
+
+    def get_usage(self, device_fingerprint: str) -> Dict:
+        """Get usage data for a device (never stores anything)"""
+        record = self._read_usage(device_fingerprint)
+        return new_usage_record() if record is None else record
+
+    def increment_usage(self, device_fingerprint: str):
+        """Increment usage counter"""
+        now = datetime.now().isoformat()
+        # A single upsert statement, so concurrent workers never lose counts
+        self._connect().execute(
+            "INSERT INTO usage (device_fingerprint, count, last_used, created_at)"
+            " VALUES (?, 1, ?, ?) ON CONFLICT(device_fingerprint) DO UPDATE"
+            " SET count = count + 1, last_used = excluded.last_used",
+            (device_fingerprint, now, now),
+        )
+        self._notify("usage", device_fingerprint, COUNTER_FIELDS)
+
+    def merge_usage(self, deltas: Dict):
+        """Fold counter deltas into the usage table in one transaction"""
+        now = datetime.now().isoformat()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO usage (device_fingerprint, count, last_used,"
+                " created_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(device_fingerprint) DO UPDATE"
+                " SET count = count + excluded.count,"
+                " last_used = max(coalesce(last_used, ''), excluded.last_used)",
+                [
+                    (device_fingerprint, count, last_used, now)
+                    for device_fingerprint, (count, last_used) in deltas.items()
+                ],
+            )
+        for device_fingerprint in deltas:
+            self._notify("usage", device_fingerprint, COUNTER_FIELDS)
+
+    def update_usage(self, device_fingerprint: str, updates: Dict):
+        """Update usage data"""
+        with self._transaction() as conn:
+            record = self._read_usage(device_fingerprint) or new_usage_record()
+            record.update(updates)
+            self._put_usage(conn, device_fingerprint, record)
+        self._notify("usage", device_fingerprint, tuple(updates))
@@ -0,0 +1,412 @@
+"""
+Streaming export, import and backend migration for the license/usage database
+
+    python dbtool.py export  /data/hiredalways.json /backup/db.ndjson
+    python dbtool.py import  /backup/db.csv /data/hiredalways.db
+    python dbtool.py migrate /data/hiredalways.json /data/hiredalways.db --resume
+
+Formats are picked by extension: .json (JSON store, or a binary snapshot
+detected by its magic bytes), .snap (binary snapshot), .db/.sqlite/.sqlite3
+(SQLite store), .ndjson/.jsonl and .csv (interchange files).
+
+Records are streamed one at a time, so memory stays bounded by the largest
+record; the exceptions are binary snapshot sources, which are compressed as
+a whole and decoded in full. A JSON store's journal is folded in on the fly,
+so a live server can keep running while its data is copied.
+
+Every --checkpoint-every records the destination is committed and progress
+is saved to DST.progress; --resume continues from there after a crash. It
+skips the records already copied by count, so it refuses to resume once the
+source (or its journal or WAL) changed since the interrupted run.
+JSON store destinations are written to a temporary file and renamed at the
+end, so they restart from scratch instead.
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import snapshot
+from db_sqlite import (
+    LICENSE_COLUMNS,
+    LICENSE_OPTIONAL,
+    USAGE_COLUMNS,
+    USAGE_OPTIONAL,
+    SQLiteDatabase,
+)
+from journal import JOURNAL_SUFFIX, decode_journal_records
+
+TABLES = ("licenses", "usage")
+PROGRESS_SUFFIX = ".progress"
+# Snapshot + journal reads retried when a checkpoint lands in between
+JOURNAL_READ_ATTEMPTS = 5
+CSV_FIELDS = ("table", "key") + tuple(
+    dict.fromkeys(LICENSE_COLUMNS + LICENSE_OPTIONAL + USAGE_COLUMNS + USAGE_OPTIONAL)
+) + ("extra",)
+_CORE_FIELDS = {"licenses": LICENSE_COLUMNS, "usage": USAGE_COLUMNS}
+
+Record = Tuple[str, str, Dict]
+
+
+def detect_format(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".db", ".sqlite", ".sqlite3"):
+        return "sqlite"
+    if extension in (".ndjson", ".jsonl"):
+        return "ndjson"
+    if extension == ".csv":
+        return "csv"
+    if extension == ".snap":
+        return "snapshot"
+    if extension == ".json":
+        return "json"
+    raise ValueError(f"Cannot tell the format of {path} from its extension")
+
+
+# Readers
+def read_journal(path: str) -> Dict[Tuple[str, str], Optional[Dict]]:
+    """Latest value per (table, key) in a journal, up to its first bad record"""
+    overrides: Dict[Tuple[str, str], Optional[Dict]] = {}
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            for line in f:
+                records = decode_journal_records(line)
+                if records is None:
+                    break
+                for table, key, value in records:
+                    overrides[(table, key)] = value
+    return overrides
+
+
+def read_json_store(path: str) -> Iterator[Record]:
+    """
+    Stream a JSON store, overlaying its (bounded) journal if there is one.
+    The snapshot is opened before the journal is read, and both are read
+    again if a checkpoint renamed a new snapshot into place in between, so
+    journal records are only ever laid over the snapshot they follow.
+    """
+    for _ in range(JOURNAL_READ_ATTEMPTS):
+        f = open(path, "rb")
+        if snapshot.is_snapshot(f.read(len(snapshot.MAGIC))):
+            f.close()
+            yield from read_snapshot(path)
+            return
+        overrides = read_journal(path + JOURNAL_SUFFIX)
+        if os.path.samestat(os.fstat(f.fileno()), os.stat(path)):
+            break
+        f.close()
+    else:
+        raise ValueError(f"{path} was checkpointed on every attempt to read it")
+
+    def flush_table(table):
+        for (override_table, key), value in list(overrides.items()):
+            if override_table == table:
+                del overrides[(override_table, key)]
+                if value is not None:
+                    yield table, key, value
+
+    current = None
+    f.seek(0)
+    with io.TextIOWrapper(f, encoding="utf-8") as text:
+        for table, key, record in snapshot.iter_json(text):
+            if table != current:
+                if current is not None:
+                    yield from flush_table(current)
+                current = table
+            if (table, key) in overrides:
+                record = overrides.pop((table, key))
+                if record is None:
+                    continue
+            yield table, key, record
+    for table in [current] + [t for t in TABLES if t != current]:
+        if table is not None:
+            yield from flush_table(table)
+
+
+def read_snapshot(path: str) -> Iterator[Record]:
+    with open(path, "rb") as f:
+        data = snapshot.loads(f.read())
+    for table in TABLES:
+        for key, record in data.get(table, {}).items():
+            yield table, key, record
+
+
+def read_sqlite(path: str) -> Iterator[Record]:
+    store = SQLiteDatabase(path)
+    try:
+        for table in TABLES:
+            for key, record in store.iter_records(table):
+                yield table, key, record
+    finally:
+        store.close()
+
+
+def read_ndjson(path: str) -> Iterator[Record]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                yield row["table"], row["key"], row["record"]
+
+
+def _csv_value(field: str, value: str):
+    if field == "count":
+        return int(value)
+    if field == "active":
+        return value.lower() == "true"
+    return value
+
+
+def read_csv(path: str) -> Iterator[Record]:
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            table = row["table"]
+            record = {}
+            for field in CSV_FIELDS[2:-1]:
+                value = row.get(field) or ""
+                if value:
+                    record[field] = _csv_value(field, value)
+                elif field in _CORE_FIELDS[table]:
+                    record[field] = None
+            if row.get("extra"):
+                record.update(json.loads(row["extra"]))
+            yield table, row["key"], record
+
+
+READERS = {
+    "json": read_json_store,
+    "snapshot": read_snapshot,
+    "sqlite": read_sqlite,
+    "ndjson": read_ndjson,
+    "csv": read_csv,
+}
+
+
+# Writers: write(), checkpoint() -> resume state, close()
+class NDJSONWriter:
+    def __init__(self, path: str, resume: Optional[Dict] = None):
+        self.f = open(path, "r+" if resume else "w", encoding="utf-8", newline="")
+        if resume:
+            self.f.seek(resume["offset"])
+            self.f.truncate()
+
+    def write(self, table: str, key: str, record: Dict):
+        self.f.write(json.dumps({"table": table, "key": key, "record": record}))
+        self.f.write("\n")
+
+    def checkpoint(self) -> Dict:
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return {"offset": self.f.tell()}
+
+    def close(self):
+        self.f.close()
+
+
+class CSVWriter(NDJSONWriter):
+    def __init__(self, path: str, resume: Optional[Dict] = None):
+        super().__init__(path, resume)
+        self.writer = csv.writer(self.f)
+        if not resume:
+            self.writer.writerow(CSV_FIELDS)
+
+    def write(self, table: str, key: str, record: Dict):
+        row = {"table": table, "key": key}
+        extra = {}
+        for field, value in record.items():
+            if field not in CSV_FIELDS[2:-1]:
+                extra[field] = value
+            elif value is None:
+                if field not in _CORE_FIELDS[table]:
+                    extra[field] = value
+            elif field == "active" and type(value) is bool:
+                row[field] = "true" if value else "false"
+            elif field == "count" and type(value) is int:
+                row[field] = str(value)
+            elif isinstance(value, str) and value and field not in ("active", "count"):
+                row[field] = value
+            else:
+                extra[field] = value
+        row["extra"] = json.dumps(extra) if extra else ""
+        self.writer.writerow([row.get(field, "") for field in CSV_FIELDS])
+
+
+class SQLiteWriter:
+    def __init__(self, path: str, resume: Optional[Dict] = None, batch_size: int = 1000):
+        self.store = SQLiteDatabase(path)
+        self.batch_size = batch_size
+        self.batch = []
+        self.table = None
+
+    def write(self, table: str, key: str, record: Dict):
+        if table != self.table or len(self.batch) >= self.batch_size:
+            self._commit()
+            self.table = table
+        self.batch.append((key, record))
+
+    def _commit(self):
+        if self.batch:
+            self.store.put_records(self.table, self.batch)
+            self.batch = []
+
+    def checkpoint(self) -> Dict:
+        self._commit()
+        return {}
+
+    def close(self):
+        self._commit()
+        self.store.close()
+
+
+class JSONStoreWriter:
+    """Writes the same one-record-per-line layout as snapshot.dump_json"""
+
+    def __init__(self, path: str, resume: Optional[Dict] = None):
+        self.path = path
+        self.f = open(path + ".tmp", "w", encoding="utf-8")
+        self.f.write("{")
+        self.tables = []
+        self.separator = None
+
+    def _open_table(self, table: str):
+        if self.tables:
+            self.f.write("\n  },\n  ")
+        else:
+            self.f.write("\n  ")
+        self.f.write(json.dumps(table) + ": {")
+        self.tables.append(table)
+        self.separator = "\n    "
+
+    def write(self, table: str, key: str, record: Dict):
+        if not self.tables or self.tables[-1] != table:
+            self._open_table(table)
+        self.f.write(f"{self.separator}{json.dumps(key)}: {json.dumps(record)}")
+        self.separator = ",\n    "
+
+    def checkpoint(self) -> Dict:
+        self.f.flush()
+        return {}
+
+    def close(self):
+        for table in TABLES:
+            if table not in self.tables:
+                self._open_table(table)
+        self.f.write("\n  }\n}\n")
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+WRITERS = {
+    "json": JSONStoreWriter,
+    "sqlite": SQLiteWriter,
+    "ndjson": NDJSONWriter,
+    "csv": CSVWriter,
+}
+RESUMABLE = ("sqlite", "ndjson", "csv")
+
+
+def source_version(path: str) -> List:
+    """Size and mtime of src and the side files holding its newest records"""
+    version = []
+    for suffix in ("", JOURNAL_SUFFIX, "-wal"):
+        try:
+            stat = os.stat(path + suffix)
+        except FileNotFoundError:
+            continue
+        version.append([suffix, stat.st_size, stat.st_mtime_ns])
+    return version
+
+
+def _save_progress(path: str, progress: Dict):
+    with open(path + ".tmp", "w") as f:
+        json.dump(progress, f)
+    os.replace(path + ".tmp", path)
+
+
+def copy(
+    src: str,
+    dst: str,
+    resume: bool = False,
+    checkpoint_every: int = 10_000,
+    report=print,
+) -> int:
+    """Stream every record from src into dst; returns the number copied"""
+    src_format, dst_format = detect_format(src), detect_format(dst)
+    if dst_format not in WRITERS:
+        raise ValueError(f"Cannot write {dst_format} files; use snapshot.py convert")
+    progress_path = dst + PROGRESS_SUFFIX
+
+    state, done = None, 0
+    version = source_version(src)
+    if resume and dst_format in RESUMABLE and os.path.exists(progress_path):
+        with open(progress_path) as f:
+            progress = json.load(f)
+        if progress["src"] != os.path.abspath(src):
+            raise ValueError(f"{progress_path} belongs to a copy of {progress['src']}")
+        if progress.get("version") != version:
+            raise ValueError(
+                f"{src} changed since the interrupted copy; start again without --resume"
+            )
+        state, done = progress["state"], progress["records"]
+        report(f"Resuming after {done} records")
+    elif resume:
+        report("Nothing to resume; starting from the beginning")
+
+    records = islice(READERS[src_format](src), done, None)
+    writer = WRITERS[dst_format](dst, state)
+    started = time.monotonic()
+    try:
+        for table, key, record in records:
+            writer.write(table, key, record)
+            done += 1
+            if done % checkpoint_every == 0:
+                _save_progress(progress_path, {
+                    "src": os.path.abspath(src),
+                    "version": version,
+                    "records": done,
+                    "state": writer.checkpoint(),
+                })
+                rate = done / max(time.monotonic() - started, 1e-9)
+                report(f"  {done} records ({rate:.0f}/s, last: {table})")
+    finally:
+        writer.close()
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    report(f"Copied {done} records from {src} to {dst}")
+    return done
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Database import/export tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (
+        ("export", "stream a database to .ndjson or .csv"),
+        ("import", "load a .ndjson or .csv file into a database"),
+        ("migrate", "copy a database into another backend"),
+    ):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("src")
+        command.add_argument("dst")
+        command.add_argument("--resume", action="store_true")
+        command.add_argument("--checkpoint-every", type=int, default=10_000)
+    args = parser.parse_args(argv)
+
+    interchange = ("ndjson", "csv")
+    if args.command == "export" and detect_format(args.dst) not in interchange:
+        parser.error("export writes .ndjson/.jsonl or .csv files")
+    if args.command == "import" and detect_format(args.src) not in interchange:
+        parser.error("import reads .ndjson/.jsonl or .csv files")
+    copy(args.src, args.dst, args.resume, args.checkpoint_every)
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Short-lived signed entitlement tokens
+
+/api/check-usage and /api/validate-license hand out a token on request
+(issue_token=true): base64url JSON claims plus an HMAC-SHA256 signature
+under LICENSE_SECRET. The claims are readable, so the extension can cache
+its plan and whitelist status until `exp` instead of asking before every
+autofill; the server verifies a presented token without any lookup.
+
+    {"dev": device, "lic": license key, "plan": plan, "wl": whitelisted,
+     "unl": unlimited auto-apply, "iat": issued, "exp": expires, "ep": epoch}
+
+Revocation:
+- every change to an input of an entitlement (a license, or a device's
+  license_key/email) rejects tokens issued for it before the change; the
+  changes come from the Entitlements subscription, so only the worker that
+  made them knows; other workers keep accepting such tokens until they
+  expire, which bounds revocation to one token TTL
+- tokens carry ENTITLEMENT_TOKEN_EPOCH; bumping it and restarting rejects
+  every token issued before (e.g. after a secret leak)
+
+Refresh: /api/refresh-token trades a token that verifies, or expired less
+than one TTL ago, for a new one built from the current entitlement.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+ENTITLEMENT_TOKEN_TTL = int(os.environ.get("ENTITLEMENT_TOKEN_TTL", "900"))
+ENTITLEMENT_TOKEN_EPOCH = int(os.environ.get("ENTITLEMENT_TOKEN_EPOCH", "1"))
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class EntitlementTokens:
+    """Issues and verifies tokens; remembers recent revocations in memory"""
+
+    def __init__(
+        self,
+        secret: Callable[[], str],
+        ttl: Optional[int] = None,
+        epoch: Optional[int] = None,
+    ):
+        self.secret = secret
+        self.ttl = ENTITLEMENT_TOKEN_TTL if ttl is None else ttl
+        self.epoch = ENTITLEMENT_TOKEN_EPOCH if epoch is None else epoch
+        # (table, key) -> when it last changed, oldest first; entries older
+        # than two TTLs only concern tokens that can no longer be refreshed
+        self._revoked: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _signature(self, payload: str) -> str:
+        return _b64encode(
+            hmac.new(self.secret().encode(), payload.encode(), hashlib.sha256).digest()
+        )
+
+    def issue(self, device_fingerprint: str, entitlement, now: Optional[float] = None) -> Dict:
+        """
+        Token for a DeviceEntitlement (entitlements.py); pass the time taken
+        before the entitlement was looked up so a change in between revokes it
+        """
+        now = time.time() if now is None else now
+        license = entitlement.license
+        claims = {
+            "dev": device_fingerprint,
+            "lic": entitlement.license_key,
+            "plan": license.plan if license is not None else None,
+            "wl": entitlement.whitelisted,
+            "unl": entitlement.unlimited_auto_apply,
+            # Full precision: compared against change times in verify()
+            "iat": now,
+            "exp": int(now) + self.ttl,
+            "ep": self.epoch,
+        }
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        return {"token": f"{payload}.{self._signature(payload)}", "expires_at": claims["exp"]}
+
+    def verify(
+        self,
+        token: str,
+        device_fingerprint: str,
+        grace: int = 0,
+    ) -> Tuple[Optional[Dict], Optional[str]]:
+        """
+        (claims, None) for a token that is still good for this device,
+        otherwise (None, reason); `grace` accepts tokens expired that long
+        """
+        try:
+            payload, signature = token.split(".")
+            if not hmac.compare_digest(signature, self._signature(payload)):
+                return None, "Invalid token signature"
+            claims = json.loads(_b64decode(payload))
+        except (ValueError, TypeError, AttributeError):
+            return None, "Malformed token"
+        if claims.get("ep") != self.epoch:
+            return None, "Token revoked"
+        if claims.get("dev") != device_fingerprint:
+            return None, "Token issued for another device"
+        if time.time() > claims["exp"] + grace:
+            return None, "Token expired"
+        with self._lock:
+            for revoked in (("usage", device_fingerprint), ("licenses", claims.get("lic"))):
+                changed_at = self._revoked.get(revoked)
+                if changed_at is not None and claims["iat"] <= changed_at:
+                    return None, "Token revoked"
+        return claims, None
+
+    def revoke(self, table: str, key: str):
+        """Reject tokens issued for this license or device until now"""
+        now = time.time()
+        with self._lock:
+            self._revoked.pop((table, key), None)
+            self._revoked[(table, key)] = now
+            # Refresh accepts tokens up to one TTL past expiry
+            while self._revoked:
+                oldest, changed_at = next(iter(self._revoked.items()))
+                if changed_at >= now - 2 * self.ttl:
+                    break
+                del self._revoked[oldest]
+
+    def __len__(self) -> int:
+        return len(self._revoked)
@@ -0,0 +1,299 @@
+"""
+Materialized per-license and per-device entitlements
+
+Working out what a device may do takes a usage read, a license read, a
+whitelist check and an ISO date parse. Entitlements keeps the result in
+two bounded LRU maps (license key -> LicenseEntitlement, device
+fingerprint -> DeviceEntitlement), so hot endpoints resolve it with one
+dictionary lookup and only fall back to the database on a miss.
+
+Entries are dropped exactly when what they were computed from changes:
+the cache registers itself as a change listener on the database
+(BaseDatabase.add_listener). A usage change drops the device only when its
+license_key or email changed, so count/last_used bumps keep the entry; a
+license change drops the license and every device that points at it.
+Other processes sharing a SQLite store cannot notify this one, so entries
+also expire after ENTITLEMENT_CACHE_TTL seconds.
+
+Lookups that find nothing (an unknown license key, a device with neither a
+license nor an email) are cached too, but in separate LRUs of at most
+ENTITLEMENT_NEGATIVE_CACHE_SIZE entries: callers can send any key they
+like, and cycling random ones must not evict the real entitlements.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Set, Tuple
+
+ENTITLEMENT_CACHE_SIZE = int(os.environ.get("ENTITLEMENT_CACHE_SIZE", "100000"))
+ENTITLEMENT_CACHE_TTL = float(os.environ.get("ENTITLEMENT_CACHE_TTL", "30"))
+ENTITLEMENT_NEGATIVE_CACHE_SIZE = int(os.environ.get("ENTITLEMENT_NEGATIVE_CACHE_SIZE", "10000"))
+
+UNLIMITED_PLANS = frozenset({"unlimited", "pro"})
+# The usage fields a device entitlement is computed from
+DEVICE_FIELDS = frozenset({"license_key", "email"})
+
+_MISSING = object()
+
+
+class LicenseEntitlement:
+    """What a license grants, with its validity window precomputed"""
+
+    __slots__ = ("license_key", "user_id", "active", "plan", "start_date",
+                 "valid_until", "whitelisted", "status")
+
+    def __init__(
+        self,
+        license_key: str,
+        record: Dict,
+        period: timedelta,
+        is_whitelisted: Callable[[str], bool],
+    ):
+        self.license_key = license_key
+        self.user_id = record.get("user_id")
+        self.active = bool(record.get("active", False))
+        self.status = record.get("status")
+        self.plan = record.get("plan") or "standard"
+        self.start_date = record.get("start_date")
+        try:
+            self.valid_until: Optional[float] = (
+                datetime.fromisoformat(self.start_date) + period
+            ).timestamp()
+        except (TypeError, ValueError):
+            self.valid_until = None
+        self.whitelisted = bool(self.user_id) and is_whitelisted(self.user_id)
+
+    @property
+    def unlimited_auto_apply(self) -> bool:
+        return self.active and self.plan in UNLIMITED_PLANS
+
+    def rejection(self, now: Optional[float] = None) -> Optional[str]:
+        """Why the license does not validate right now, or None"""
+        if not self.active:
+            # Flipped by the expiry scheduler (expiry.py)
+            return "License expired" if self.status == "expired" else "License inactive"
+        if self.valid_until is None:
+            return "Validation error: invalid start_date"
+        if (time.time() if now is None else now) > self.valid_until:
+            return "License expired"
+        return None
+
+
+class DeviceEntitlement:
+    """What a device may do: its linked license and whitelist status"""
+
+    __slots__ = ("device_fingerprint", "license_key", "license", "email", "whitelisted")
+
+    def __init__(
+        self,
+        device_fingerprint: str,
+        usage: Dict,
+        license: Optional[LicenseEntitlement],
+        is_whitelisted: Callable[[str], bool],
+    ):
+        self.device_fingerprint = device_fingerprint
+        self.license_key = usage.get("license_key")
+        self.license = license
+        self.email = usage.get("email")
+        self.whitelisted = bool(license is not None and license.whitelisted) or (
+            bool(self.email) and is_whitelisted(self.email)
+        )
+
+    @property
+    def unlimited_auto_apply(self) -> bool:
+        return self.license is not None and self.license.unlimited_auto_apply
+
+
+class Entitlements:
+    """
+    LRU caches of license and device entitlements over the database that
+    `database()` returns; follows the instance if it is swapped out
+    """
+
+    def __init__(
+        self,
+        database: Callable,
+        is_whitelisted: Callable[[str], bool],
+        license_period: timedelta,
+        capacity: Optional[int] = None,
+        ttl: Optional[float] = None,
+        negative_capacity: Optional[int] = None,
+    ):
+        self.database = database
+        self.is_whitelisted = is_whitelisted
+        self.license_period = license_period
+        self.capacity = ENTITLEMENT_CACHE_SIZE if capacity is None else capacity
+        self.ttl = ENTITLEMENT_CACHE_TTL if ttl is None else ttl
+        self.negative_capacity = (
+            min(self.capacity, ENTITLEMENT_NEGATIVE_CACHE_SIZE)
+            if negative_capacity is None else negative_capacity
+        )
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._licenses: "OrderedDict[str, Tuple[float, Optional[LicenseEntitlement]]]" = OrderedDict()
+        self._devices: "OrderedDict[str, Tuple[float, DeviceEntitlement]]" = OrderedDict()
+        # Lookups that found nothing, kept apart so they cannot evict the above
+        self._unknown_licenses: "OrderedDict[str, Tuple[float, None]]" = OrderedDict()
+        self._unknown_devices: "OrderedDict[str, Tuple[float, DeviceEntitlement]]" = OrderedDict()
+        # license key -> devices whose entitlement was computed from it
+        self._dependents: Dict[str, Set[str]] = {}
+        # Bumped by every invalidation; a value computed across one is not cached
+        self._version = 0
+        self._lock = threading.Lock()
+        self._attached = None
+        self._subscribers: Tuple[Callable[[str, str], None], ...] = ()
+
+    def subscribe(self, callback: Callable[[str, str], None]):
+        """Call callback(table, key) whenever an entitlement input changes"""
+        self._subscribers += (callback,)
+
+    def _attach(self):
+        database = self.database()
+        if database is not self._attached:
+            with self._lock:
+                if database is not self._attached:
+                    database.add_listener(self.invalidate)
+                    self._attached = database
+                    self._clear()
+        return database
+
+    def _clear(self):
+        self._licenses.clear()
+        self._devices.clear()
+        self._unknown_licenses.clear()
+        self._unknown_devices.clear()
+        self._dependents.clear()
+        self._version += 1
+
+    def _get(self, tables: Tuple[OrderedDict, ...], key: str):
+        with self._lock:
+            for table in tables:
+                entry = table.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    table.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+            return _MISSING
+
+    def _put(self, table: OrderedDict, key: str, value, version: int, capacity: int) -> bool:
+        if capacity <= 0:
+            return False
+        with self._lock:
+            if self._version != version:
+                return False
+            if table is self._devices:
+                previous = table.get(key)
+                if previous is not None:
+                    self._unlink(key, previous[1])
+                # Registered in the same critical section as the entry, so a
+                # license invalidation either sees both or neither
+                if value.license_key:
+                    self._dependents.setdefault(value.license_key, set()).add(key)
+            table[key] = (time.monotonic() + self.ttl, value)
+            table.move_to_end(key)
+            while len(table) > capacity:
+                evicted, (_, entitlement) = table.popitem(last=False)
+                if table is self._devices:
+                    self._unlink(evicted, entitlement)
+            return True
+
+    def _unlink(self, device_fingerprint: str, entitlement: DeviceEntitlement):
+        dependents = self._dependents.get(entitlement.license_key)
+        if dependents is not None:
+            dependents.discard(device_fingerprint)
+            if not dependents:
+                del self._dependents[entitlement.license_key]
+
+    # Lookups
+    def license(self, license_key: str) -> Optional[LicenseEntitlement]:
+        """The license's entitlement, None if there is no such license"""
+        database = self._attach()
+        cached = self._get((self._licenses, self._unknown_licenses), license_key)
+        if cached is not _MISSING:
+            return cached
+        self.misses += 1
+        version = self._version
+        record = database.get_license(license_key)
+        entitlement = None if record is None else LicenseEntitlement(
+            license_key, record, self.license_period, self.is_whitelisted
+        )
+        if entitlement is None:
+            self._put(self._unknown_licenses, license_key, None, version, self.negative_capacity)
+        else:
+            self._put(self._licenses, license_key, entitlement, version, self.capacity)
+        return entitlement
+
+    def device(self, device_fingerprint: str) -> DeviceEntitlement:
+        database = self._attach()
+        cached = self._get((self._devices, self._unknown_devices), device_fingerprint)
+        if cached is not _MISSING:
+            return cached
+        self.misses += 1
+        version = self._version
+        usage = database.get_usage(device_fingerprint)
+        license_key = usage.get("license_key")
+        entitlement = DeviceEntitlement(
+            device_fingerprint,
+            usage,
+            self.license(license_key) if license_key else None,
+            self.is_whitelisted,
+        )
+        if not license_key and not entitlement.email:
+            self._put(
+                self._unknown_devices, device_fingerprint, entitlement, version,
+                self.negative_capacity,
+            )
+        else:
+            self._put(self._devices, device_fingerprint, entitlement, version, self.capacity)
+        return entitlement
+
+    async def alicense(self, license_key: str) -> Optional[LicenseEntitlement]:
+        """Cache hits are answered inline; misses run on the database executor"""
+        database = self._attach()
+        cached = self._get((self._licenses, self._unknown_licenses), license_key)
+        if cached is not _MISSING:
+            return cached
+        return await database.run(self.license, license_key)
+
+    async def adevice(self, device_fingerprint: str) -> DeviceEntitlement:
+        database = self._attach()
+        cached = self._get((self._devices, self._unknown_devices), device_fingerprint)
+        if cached is not _MISSING:
+            return cached
+        return await database.run(self.device, device_fingerprint)
+
+    # Invalidation (database change listener)
+    def invalidate(self, table: str, key: str, fields: Optional[Tuple] = None):
+        if table == "usage" and fields is not None and DEVICE_FIELDS.isdisjoint(fields):
+            return
+        with self._lock:
+            self._version += 1
+            self.invalidations += 1
+            if table == "usage":
+                self._unknown_devices.pop(key, None)
+                entry = self._devices.pop(key, None)
+                if entry is not None:
+                    self._unlink(key, entry[1])
+            elif table == "licenses":
+                self._licenses.pop(key, None)
+                self._unknown_licenses.pop(key, None)
+                for device_fingerprint in self._dependents.pop(key, ()):
+                    self._devices.pop(device_fingerprint, None)
+        for callback in self._subscribers:
+            callback(table, key)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "licenses": len(self._licenses),
+            "devices": len(self._devices),
+            "unknown": len(self._unknown_licenses) + len(self._unknown_devices),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
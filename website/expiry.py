@@ -0,0 +1,205 @@
+"""
+Background license expiry
+
+A license expires LICENSE_PERIOD after its start_date. ExpiryScheduler
+keeps every active license in a min-heap ordered by expiry, sleeps until
+the earliest one is due and then flips it inactive with status "expired".
+That update goes through the database like any other, so the entitlement
+cache and tokens that depend on the license are dropped with it.
+
+Renewals, revocations and new licenses reach the heap through a database
+change listener. Superseded heap entries are not removed; they are skipped
+when they surface, because they no longer match the license's current
+expiry. The heap also carries a warning entry LICENSE_EXPIRY_WARNING_HOURS
+before each expiry, which emits an "expiring" event to subscribers.
+
+Validation still compares the expiry itself, so a license is rejected on
+time even between sweeps or with LICENSE_EXPIRY_SWEEP=0.
+"""
+
+import heapq
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+LICENSE_EXPIRY_SWEEP = os.environ.get("LICENSE_EXPIRY_SWEEP", "1").lower() in ("1", "true", "yes")
+LICENSE_EXPIRY_WARNING_HOURS = float(os.environ.get("LICENSE_EXPIRY_WARNING_HOURS", "72"))
+# Wake up at least this often, so wall clock jumps are noticed
+MAX_WAIT_S = 60.0
+
+EXPIRE, WARN = 0, 1
+
+
+class ExpiryScheduler:
+    """Min-heap of (when, kind, license_key, expires_at) over active licenses"""
+
+    def __init__(
+        self,
+        database: Callable,
+        period: timedelta,
+        warning_hours: Optional[float] = None,
+        batch_size: int = 500,
+    ):
+        self.database = database
+        self.period = period
+        hours = LICENSE_EXPIRY_WARNING_HOURS if warning_hours is None else warning_hours
+        self.warning = timedelta(hours=hours).total_seconds()
+        self.batch_size = batch_size
+        self.expired = 0
+        self.warned = 0
+        self._heap: List[Tuple[float, int, str, float]] = []
+        # Active license -> its current expiry; the source of truth for the heap
+        self._expiries: Dict[str, float] = {}
+        self._changed_keys: Set[str] = set()
+        self._subscribers: Tuple[Callable[[str, str, float], None], ...] = ()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._db = None
+
+    def subscribe(self, callback: Callable[[str, str, float], None]):
+        """Call callback(event, license_key, expires_at) on "expiring" and "expired" """
+        self._subscribers += (callback,)
+
+    def _emit(self, event: str, license_key: str, expires_at: float):
+        for callback in self._subscribers:
+            try:
+                callback(event, license_key, expires_at)
+            except Exception as e:
+                print(f"Error in expiry subscriber: {e}")
+
+    def _expires_at(self, record: Optional[Dict]) -> Optional[float]:
+        if not record or not record.get("active", False):
+            return None
+        try:
+            return (datetime.fromisoformat(record["start_date"]) + self.period).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _schedule(self, license_key: str, record: Optional[Dict], now: float):
+        expires_at = self._expires_at(record)
+        with self._lock:
+            if expires_at is None:
+                self._expiries.pop(license_key, None)
+                return
+            if self._expiries.get(license_key) == expires_at:
+                return
+            self._expiries[license_key] = expires_at
+            heapq.heappush(self._heap, (expires_at, EXPIRE, license_key, expires_at))
+            if self.warning and expires_at - self.warning > now:
+                heapq.heappush(
+                    self._heap, (expires_at - self.warning, WARN, license_key, expires_at)
+                )
+
+    def _changed(self, table: str, key: str, fields: Optional[Tuple] = None):
+        # Runs inside the database's write path: only note the key
+        if table == "licenses":
+            with self._lock:
+                self._changed_keys.add(key)
+            self._wake.set()
+
+    # Lifecycle
+    def load(self):
+        """Attach to the database and schedule every active license"""
+        database = self.database()
+        if database is not self._db:
+            database.add_listener(self._changed)
+            self._db = database
+            with self._lock:
+                self._heap.clear()
+                self._expiries.clear()
+        now = time.time()
+        after = None
+        while True:
+            page = self._db.scan_licenses(after=after, limit=self.batch_size)
+            for _, license_key, record in page:
+                self._schedule(license_key, record, now)
+            if len(page) < self.batch_size:
+                break
+            after = page[-1][:2]
+
+    def start(self) -> "ExpiryScheduler":
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="license-expiry", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.load()
+            while not self._stop_event.is_set():
+                self.run_due()
+                self._wake.wait(self._next_wait())
+                self._wake.clear()
+        except Exception as e:
+            print(f"Error in license expiry scheduler: {e}")
+
+    def _next_wait(self) -> float:
+        with self._lock:
+            if self._changed_keys:
+                return 0
+            if not self._heap:
+                return MAX_WAIT_S
+            return min(max(self._heap[0][0] - time.time(), 0), MAX_WAIT_S)
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # Work
+    def run_due(self, now: Optional[float] = None) -> int:
+        """Apply pending changes, then handle every due entry; returns licenses expired"""
+        with self._lock:
+            changed, self._changed_keys = self._changed_keys, set()
+        now = time.time() if now is None else now
+        for license_key in changed:
+            self._schedule(license_key, self._db.get_license(license_key), now)
+
+        expired = 0
+        while True:
+            with self._lock:
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                _, kind, license_key, expires_at = heapq.heappop(self._heap)
+                if self._expiries.get(license_key) != expires_at:
+                    continue  # superseded by a renewal or deactivation
+                if kind == EXPIRE:
+                    del self._expiries[license_key]
+            if kind == WARN:
+                self.warned += 1
+                self._emit("expiring", license_key, expires_at)
+                continue
+            # Re-read: the license may have been renewed since it was scheduled
+            record = self._db.get_license(license_key)
+            if self._expires_at(record) != expires_at:
+                self._schedule(license_key, record, now)
+                continue
+            self._db.update_license(license_key, {"active": False, "status": "expired"})
+            self.expired += 1
+            expired += 1
+            self._emit("expired", license_key, expires_at)
+        if expired:
+            print(f"Expired {expired} licenses")
+        return expired
+
+    def stats(self) -> Dict:
+        with self._lock:
+            upcoming = [entry[0] for entry in self._heap if entry[1] == EXPIRE
+                        and self._expiries.get(entry[2]) == entry[3]]
+            return {
+                "active_licenses": len(self._expiries),
+                "scheduled": len(self._heap),
+                "expired": self.expired,
+                "warned": self.warned,
+                "next_expiry": (
+                    datetime.fromtimestamp(min(upcoming)).isoformat() if upcoming else None
+                ),
+            }
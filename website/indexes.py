@@ -0,0 +1,234 @@
+"""
+In-memory secondary indexes for the JSON database
+HashIndex answers equality lookups in O(1); SortedIndex keeps
+(value, key) pairs ordered in bounded chunks for O(log n) range scans and
+keyset pages, and writes that shift one chunk rather than the whole index.
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Set, Tuple
+
+
+class HashIndex:
+    """Maps an indexed value to the set of primary keys holding it"""
+
+    def __init__(self):
+        self._keys: Dict[Hashable, Set[str]] = {}
+        self._values: Dict[str, Hashable] = {}
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def update(self, key: str, value: Optional[Hashable]):
+        """(Re)index `key` under `value`; None removes it from the index"""
+        if key in self._values and self._values[key] == value:
+            return
+        self.discard(key)
+        if value is not None:
+            self._keys.setdefault(value, set()).add(key)
+            self._values[key] = value
+
+    def discard(self, key: str):
+        old = self._values.pop(key, None)
+        if old is not None:
+            keys = self._keys[old]
+            keys.discard(key)
+            if not keys:
+                del self._keys[old]
+
+    def get(self, value: Hashable) -> Set[str]:
+        return set(self._keys.get(value, ()))
+
+    def clear(self):
+        self._keys.clear()
+        self._values.clear()
+
+
+class SortedIndex:
+    """
+    Ordered (value, key) pairs supporting range scans
+
+    Entries live in a list of sorted chunks of at most 2 * chunk_size
+    pairs, with each chunk's last pair in `_maxes`: a write bisects
+    `_maxes` and shifts one chunk instead of the whole index, so hot
+    counters (usage count, last_used) stay cheap to maintain at millions
+    of rows. Positions are (chunk, offset) tuples.
+    """
+
+    def __init__(self, chunk_size: int = 1000):
+        self.chunk_size = chunk_size
+        self._chunks: List[List[Tuple[Any, str]]] = []
+        self._maxes: List[Tuple[Any, str]] = []
+        self._values: Dict[str, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def update(self, key: str, value: Any):
+        """(Re)index `key` at `value`; None removes it from the index"""
+        if key in self._values:
+            if self._values[key] == value:
+                return
+            self.discard(key)
+        if value is not None:
+            self._insert((value, key))
+            self._values[key] = value
+
+    def discard(self, key: str):
+        if key not in self._values:
+            return
+        entry = (self._values.pop(key), key)
+        i = bisect_left(self._maxes, entry)
+        chunk = self._chunks[i]
+        del chunk[bisect_left(chunk, entry)]
+        if not chunk:
+            del self._chunks[i]
+            del self._maxes[i]
+        else:
+            self._maxes[i] = chunk[-1]
+
+    def _insert(self, entry: Tuple[Any, str]):
+        if not self._chunks:
+            self._chunks.append([entry])
+            self._maxes.append(entry)
+            return
+        i = min(bisect_left(self._maxes, entry), len(self._chunks) - 1)
+        chunk = self._chunks[i]
+        insort(chunk, entry)
+        self._maxes[i] = chunk[-1]
+        if len(chunk) > 2 * self.chunk_size:
+            self._chunks.insert(i + 1, chunk[self.chunk_size:])
+            del chunk[self.chunk_size:]
+            self._maxes.insert(i, chunk[-1])
+
+    def _position(self, entry: Tuple, right: bool = False) -> Tuple[int, int]:
+        """Position of the first pair > entry (right) or >= entry"""
+        bisect = bisect_right if right else bisect_left
+        i = bisect(self._maxes, entry)
+        if i == len(self._chunks):
+            return i, 0
+        return i, bisect(self._chunks[i], entry)
+
+    def _bounds(self, start: Any, end: Any) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        lo = (0, 0) if start is None else self._position((start,))
+        hi = (len(self._chunks), 0) if end is None else self._position((end,))
+        return lo, hi
+
+    def _slice(
+        self, lo: Tuple[int, int], hi: Tuple[int, int], reverse: bool = False
+    ) -> Iterator[Tuple[Any, str]]:
+        """Pairs from position lo up to (not including) hi"""
+        if lo >= hi:
+            return
+        (first, offset), (last, stop) = lo, hi
+        chunks = range(first, min(last, len(self._chunks) - 1) + 1)
+        for i in reversed(chunks) if reverse else chunks:
+            chunk = self._chunks[i]
+            part = chunk[offset if i == first else 0:stop if i == last else len(chunk)]
+            yield from reversed(part) if reverse else part
+
+    def range(
+        self,
+        start: Any = None,
+        end: Any = None,
+        reverse: bool = False,
+    ) -> Iterator[Tuple[Any, str]]:
+        """Yield (value, key) pairs with start <= value < end"""
+        return self._slice(*self._bounds(start, end), reverse)
+
+    def page(
+        self,
+        start: Any = None,
+        end: Any = None,
+        after: Optional[Tuple[Any, str]] = None,
+        limit: int = 100,
+        reverse: bool = False,
+    ) -> List[Tuple[Any, str]]:
+        """
+        Up to `limit` pairs with start <= value < end that come after the
+        `after` pair in scan order. Keyset pagination stays correct while
+        the index changes between pages.
+        """
+        lo, hi = self._bounds(start, end)
+        if after is not None:
+            if reverse:
+                hi = min(hi, self._position(tuple(after)))
+            else:
+                lo = max(lo, self._position(tuple(after), right=True))
+        return list(islice(self._slice(lo, hi, reverse), max(limit, 0)))
+
+    def load(self, pairs):
+        """Bulk (re)build from (key, value) pairs with one sort"""
+        self._values = {key: value for key, value in pairs if value is not None}
+        entries = sorted((value, key) for key, value in self._values.items())
+        self._chunks = [
+            entries[i:i + self.chunk_size] for i in range(0, len(entries), self.chunk_size)
+        ]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+
+    def clear(self):
+        self._chunks.clear()
+        self._maxes.clear()
+        self._values.clear()
+
+
+class UsageIndexes:
+    """Sorted indexes over usage records for admin range queries"""
+
+    def __init__(self):
+        self.last_used = SortedIndex()
+        self.count = SortedIndex()
+
+    @staticmethod
+    def _values(record: Optional[Dict]):
+        record = record or {}
+        last_used, count = record.get("last_used"), record.get("count")
+        # Only index comparable values; anything else is left out
+        return (
+            last_used if type(last_used) is str else None,
+            count if type(count) is int else None,
+        )
+
+    def update(self, device_fingerprint: str, record: Optional[Dict]):
+        """Reindex one device; pass None when it is deleted"""
+        last_used, count = self._values(record)
+        self.last_used.update(device_fingerprint, last_used)
+        self.count.update(device_fingerprint, count)
+
+    def rebuild(self, usage):
+        values = [(key, self._values(record)) for key, record in usage.items()]
+        self.last_used.load((key, last_used) for key, (last_used, _) in values)
+        self.count.load((key, count) for key, (_, count) in values)
+
+
+class LicenseIndexes:
+    """Secondary indexes over license records, keyed by license key"""
+
+    def __init__(self):
+        self.user_id = HashIndex()
+        self.paypal_subscription_id = HashIndex()
+        self.paypal_order_id = HashIndex()
+        self.start_date = SortedIndex()
+
+    def update(self, license_key: str, record: Optional[Dict]):
+        """Reindex one license; pass None when it is deleted"""
+        record = record or {}
+        user_id = record.get("user_id")
+        self.user_id.update(license_key, user_id.lower() if user_id else None)
+        self.paypal_subscription_id.update(
+            license_key, record.get("paypal_subscription_id")
+        )
+        self.paypal_order_id.update(license_key, record.get("paypal_order_id"))
+        self.start_date.update(license_key, record.get("start_date"))
+
+    def rebuild(self, licenses: Dict[str, Dict]):
+        for index in (
+            self.user_id,
+            self.paypal_subscription_id,
+            self.paypal_order_id,
+            self.start_date,
+        ):
+            index.clear()
+        for license_key, record in licenses.items():
+            self.update(license_key, record)
@@ -0,0 +1,52 @@
+"""
+Record codec of the JSON store's append-only journal
+
+Each line is `<crc32 as 8 hex digits> <json payload>\n`. The payload is
+one [table, key, value] record, or a list of them written by a single
+commit; a value of null deletes the key. A torn or corrupt line decodes to
+None, and readers stop there.
+
+Kept apart from db.py so tools reading journals (dbtool.py, backup.py) can
+import it without touching the live database.
+"""
+
+import json
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+JOURNAL_SUFFIX = ".journal"
+
+
+def encode_journal_record(table: str, key: str, value: Optional[Dict]) -> bytes:
+    """Encode one journal record as `<crc32> <json>\\n`"""
+    payload = json.dumps([table, key, value], separators=(",", ":")).encode()
+    return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+
+def encode_journal_group(records) -> bytes:
+    """
+    Encode several (table, key, value) records as one framed line, so a
+    crash mid-append loses the whole group rather than part of it
+    """
+    payload = json.dumps([list(record) for record in records], separators=(",", ":")).encode()
+    return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+
+def decode_journal_records(line: bytes) -> Optional[List[Tuple]]:
+    """
+    Decode one journal line into its (table, key, value) records, returning
+    None if it is torn or corrupt
+    """
+    if not line.endswith(b"\n") or len(line) < 10 or line[8:9] != b" ":
+        return None
+    payload = line[9:-1]
+    try:
+        if int(line[:8], 16) != zlib.crc32(payload):
+            return None
+        records = json.loads(payload)
+        if records and isinstance(records[0], list):
+            return [(table, key, value) for table, key, value in records]
+        table, key, value = records
+    except (ValueError, TypeError):
+        return None
+    return [(table, key, value)]
@@ -22,12 +22,39 @@ from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
 import os
 import glob
+from contextlib import asynccontextmanager
 from adcash_config import get_zone_id, get_primary_zone_id, ANTI_ADBLOCK_CONFIG
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start the optional schema sweeper and license expiry scheduler; close
+    upstream clients and flush pending counters and database writes when
+    the server shuts down
+    """
+    import expiry
+    import schema
+    from api import expiry_scheduler, upstream, usage_counters
+    from db import db
+
+    sweeper = schema.SchemaSweeper(db).start() if schema.DB_SCHEMA_SWEEP else None
+    if expiry.LICENSE_EXPIRY_SWEEP:
+        expiry_scheduler.start()
+    yield
+    if sweeper is not None:
+        sweeper.stop()
+    expiry_scheduler.stop()
+    await upstream.aclose()
+    usage_counters.close()
+    db.close()
+
+
 app = FastAPI(
     title="Hired Always",
     description="AI-powered job application assistant",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 
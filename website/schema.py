@@ -0,0 +1,121 @@
+"""
+Versioned record schema with lazy, per-record upgrades
+
+Every stored license/usage record carries its schema version in the
+SCHEMA_VERSION_FIELD key; records without one are version 1, so nothing
+stored today needs rewriting. A format change appends an upgrade function
+for its table:
+
+    @schema.upgrade_to("licenses", 2)
+    def _licenses_v2(record):
+        return {**record, "plan": record.get("plan") or "standard"}
+
+Backends run upgrade() on every record they read or write, so old records
+move to the current version the first time they are touched, without a
+stop-the-world rewrite at startup. SchemaSweeper (DB_SCHEMA_SWEEP=1) can
+additionally walk the tables in small, paced batches in the background.
+
+Records written by a newer deploy (version above current) are left alone,
+so rolling back does not corrupt them.
+"""
+
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+DB_SCHEMA_SWEEP = os.environ.get("DB_SCHEMA_SWEEP", "").lower() in ("1", "true", "yes")
+DB_SCHEMA_SWEEP_BATCH = int(os.environ.get("DB_SCHEMA_SWEEP_BATCH", "500"))
+DB_SCHEMA_SWEEP_PAUSE_MS = int(os.environ.get("DB_SCHEMA_SWEEP_PAUSE_MS", "50"))
+
+SCHEMA_VERSION_FIELD = "_v"
+TABLES = ("licenses", "usage")
+
+# UPGRADES[table][i] turns a version i + 1 record into version i + 2
+UPGRADES: Dict[str, List[Callable[[Dict], Dict]]] = {table: [] for table in TABLES}
+
+
+def upgrade_to(table: str, version: int):
+    """Register the function that upgrades `table` records to `version`"""
+
+    def register(fn: Callable[[Dict], Dict]):
+        if version != current_version(table) + 1:
+            raise ValueError(
+                f"{table} upgrades must be registered in order; "
+                f"next is version {current_version(table) + 1}"
+            )
+        UPGRADES[table].append(fn)
+        return fn
+
+    return register
+
+
+def current_version(table: str) -> int:
+    return 1 + len(UPGRADES[table])
+
+
+def needs_upgrade(table: str, record: Dict) -> bool:
+    return record.get(SCHEMA_VERSION_FIELD, 1) < 1 + len(UPGRADES[table])
+
+
+def upgrade(table: str, record: Optional[Dict]) -> Optional[Dict]:
+    """The record at the current version; the same object if already there"""
+    if record is None or not needs_upgrade(table, record):
+        return record
+    for fn in UPGRADES[table][record.get(SCHEMA_VERSION_FIELD, 1) - 1:]:
+        record = fn(dict(record))
+    return stamp(table, record)
+
+
+def stamp(table: str, record: Dict) -> Dict:
+    """Mark a record written by this code as current (version 1 is implicit)"""
+    version = current_version(table)
+    if version > 1:
+        record[SCHEMA_VERSION_FIELD] = version
+    return record
+
+
+class SchemaSweeper:
+    """
+    Background thread that upgrades every outdated record, one batch at a
+    time with a pause in between so request traffic keeps priority
+    """
+
+    def __init__(
+        self,
+        database,
+        batch_size: Optional[int] = None,
+        pause_ms: Optional[int] = None,
+    ):
+        self.database = database
+        self.batch_size = batch_size or DB_SCHEMA_SWEEP_BATCH
+        self.pause_ms = DB_SCHEMA_SWEEP_PAUSE_MS if pause_ms is None else pause_ms
+        self.upgraded = 0
+        self.done = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "SchemaSweeper":
+        self._thread = threading.Thread(
+            target=self._run, name="schema-sweeper", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            for upgraded in self.database.sweep_schema(self.batch_size):
+                self.upgraded += upgraded
+                if self._stop_event.wait(self.pause_ms / 1000):
+                    return
+            if self.upgraded:
+                print(f"Schema sweep upgraded {self.upgraded} records")
+        except Exception as e:
+            print(f"Error during schema sweep: {e}")
+        finally:
+            self.done.set()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,54 @@
+"""
+Single-flight coalescing of identical concurrent upstream calls
+
+When many clients ask the same thing at once (a popular job posting going
+around), only the first caller for a key starts the upstream call; callers
+arriving while it is in flight await the same task instead of starting
+their own. The key is a hash of the normalized request, supplied by the
+caller.
+
+- every waiter gets the leader's result, or the same exception
+- waiters are shielded: a cancelled waiter (client disconnect) stops
+  waiting but does not cancel the shared call for the others
+- the key is released as soon as the call finishes, so later requests
+  start a fresh call; nothing is cached here (see ai_cache.py for that)
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """In-flight tasks by key, for the running event loop"""
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def _release(self, key: str, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every waiter went away
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Await fn(), or the call already in flight for `key`"""
+        task = self._tasks.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._release(key, done))
+            self.calls += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self._tasks),
+            "calls": self.calls,
+            "shared": self.shared,
+        }
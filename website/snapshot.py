@@ -0,0 +1,331 @@
+"""
+Compact binary snapshot format for the license/usage database
+
+Layout: MAGIC, format version byte, compression byte, then the (optionally
+compressed) body made of length-prefixed sections:
+
+    header     JSON {"rows": n}
+    licenses   compact JSON of the licenses table (small next to usage)
+    irregular  compact JSON of usage records that do not fit the columns
+    keys, license_key, last_used, created_at
+               \\0-joined UTF-8 string columns, NULL_MARK standing for None
+    count      little-endian int64 array
+    extra      compact JSON {key: other fields} for rows that have any
+
+Columns decode with C-level split/array calls instead of parsing one huge
+pretty-printed JSON document, so cold start stays cheap as devices grow.
+
+Convert an existing JSON database with:
+    python snapshot.py convert /data/hiredalways.json /data/hiredalways.snap
+"""
+
+import argparse
+import gc
+import json
+import struct
+import sys
+import zlib
+from array import array
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+MAGIC = b"HADB"
+VERSION = 1
+COMPRESSION_CODES = {"none": 0, "zlib": 1, "zstd": 2}
+NULL_MARK = "\x01"
+STRING_COLUMNS = ("license_key", "last_used", "created_at")
+_SECTION = struct.Struct("<Q")
+_COMPACT = (",", ":")
+
+
+def is_snapshot(head: bytes) -> bool:
+    """True if the leading bytes of a file belong to a binary snapshot"""
+    return head[: len(MAGIC)] == MAGIC
+
+
+def _fits_column(value) -> bool:
+    return value is None or (
+        isinstance(value, str) and "\0" not in value and value != NULL_MARK
+    )
+
+
+def _is_regular(key, record) -> bool:
+    """Records that can be stored column-wise without losing information"""
+    count = record.get("count") if isinstance(record, dict) else None
+    return (
+        isinstance(key, str)
+        and "\0" not in key
+        and type(count) is int
+        and -(2 ** 63) <= count < 2 ** 63
+        and all(c in record and _fits_column(record[c]) for c in STRING_COLUMNS)
+    )
+
+
+def _join(values) -> bytes:
+    return "\0".join(NULL_MARK if v is None else v for v in values).encode()
+
+
+_NULLS = {NULL_MARK: None}
+
+
+def _split(blob: bytes, rows: int):
+    if not rows:
+        return []
+    values = blob.decode().split("\0")
+    # map(dict.get, v, v) swaps NULL_MARK for None without a Python-level loop
+    return list(map(_NULLS.get, values, values))
+
+
+def _compress(body: bytes, compression: str) -> bytes:
+    if compression == "zlib":
+        return zlib.compress(body, 6)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return body
+
+
+def _decompress(body: bytes, code: int) -> bytes:
+    if code == COMPRESSION_CODES["zlib"]:
+        return zlib.decompress(body)
+    if code == COMPRESSION_CODES["zstd"]:
+        if zstandard is None:
+            raise ValueError("snapshot is zstd-compressed; install zstandard")
+        return zstandard.ZstdDecompressor().decompress(body)
+    return body
+
+
+def dumps(data: Dict, compression: str = "zlib") -> bytes:
+    """Encode a {"licenses": ..., "usage": ...} database into snapshot bytes"""
+    if compression not in COMPRESSION_CODES:
+        raise ValueError(f"Unknown snapshot compression: {compression}")
+
+    keys, counts, extras = [], array("q"), {}
+    strings = {column: [] for column in STRING_COLUMNS}
+    irregular = {}
+    for key, record in data.get("usage", {}).items():
+        if not _is_regular(key, record):
+            irregular[key] = record
+            continue
+        keys.append(key)
+        counts.append(record["count"])
+        for column in STRING_COLUMNS:
+            strings[column].append(record[column])
+        rest = {k: v for k, v in record.items() if k != "count" and k not in strings}
+        if rest:
+            extras[key] = rest
+    if sys.byteorder != "little":  # pragma: no cover - big-endian hosts
+        counts.byteswap()
+
+    sections = [
+        json.dumps({"rows": len(keys)}).encode(),
+        json.dumps(data.get("licenses", {}), separators=_COMPACT).encode(),
+        json.dumps(irregular, separators=_COMPACT).encode(),
+        "\0".join(keys).encode(),
+        *(_join(strings[column]) for column in STRING_COLUMNS),
+        counts.tobytes(),
+        json.dumps(extras, separators=_COMPACT).encode(),
+    ]
+    body = b"".join(_SECTION.pack(len(s)) + s for s in sections)
+    header = MAGIC + bytes([VERSION, COMPRESSION_CODES[compression]])
+    return header + _compress(body, compression)
+
+
+@contextmanager
+def gc_paused():
+    """
+    Pause the cyclic GC while decoding: millions of fresh dicts would
+    otherwise trigger repeated passes over everything built so far, and
+    decoded records cannot form reference cycles.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def loads(blob: bytes) -> Dict:
+    """Decode snapshot bytes back into the database dict"""
+    with gc_paused():
+        return _loads(blob)
+
+
+def _loads(blob: bytes) -> Dict:
+    if not is_snapshot(blob):
+        raise ValueError("Not a binary database snapshot")
+    version, code = blob[len(MAGIC)], blob[len(MAGIC) + 1]
+    if version != VERSION:
+        raise ValueError(f"Unsupported snapshot version: {version}")
+    body = memoryview(_decompress(blob[len(MAGIC) + 2:], code))
+
+    sections, offset = [], 0
+    while offset < len(body):
+        (size,) = _SECTION.unpack_from(body, offset)
+        offset += _SECTION.size
+        sections.append(bytes(body[offset:offset + size]))
+        offset += size
+    header, licenses, irregular, keys, *columns, counts, extras = sections
+    rows = json.loads(header)["rows"]
+
+    count_column = array("q")
+    count_column.frombytes(counts)
+    if sys.byteorder != "little":  # pragma: no cover - big-endian hosts
+        count_column.byteswap()
+    license_keys, last_used, created_at = (_split(c, rows) for c in columns)
+    key_column = keys.decode().split("\0") if rows else []
+
+    usage = {
+        key: {
+            "count": count,
+            "license_key": license_key,
+            "last_used": used,
+            "created_at": created,
+        }
+        for key, count, license_key, used, created in zip(
+            key_column, count_column, license_keys, last_used, created_at
+        )
+    }
+    for key, rest in json.loads(extras).items():
+        usage[key].update(rest)
+    usage.update(json.loads(irregular))
+    return {"licenses": json.loads(licenses), "usage": usage}
+
+
+def dump_json(data, f):
+    """
+    Stream the database to a text file as JSON, one record per line.
+    Works on any Mapping tables and encodes each record with the C encoder
+    (json.dump with indent falls back to the pure-Python one).
+    """
+    f.write("{")
+    for i, (table, records) in enumerate(data.items()):
+        f.write(",\n  " if i else "\n  ")
+        f.write(json.dumps(table))
+        f.write(": {")
+        separator = "\n    "
+        for key, record in records.items():
+            f.write(separator)
+            f.write(json.dumps(key))
+            f.write(": ")
+            f.write(json.dumps(record))
+            separator = ",\n    "
+        f.write("\n  }")
+    f.write("\n}\n")
+
+
+def iter_json(f, chunk_size: int = 1 << 16):
+    """
+    Stream (table, key, record) triples out of a {table: {key: record}}
+    JSON file. Memory is bounded by the largest single record plus one
+    chunk, whatever the size of the file (pretty-printed or not).
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+
+    def token(expected: str) -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf):
+                break
+            if eof:
+                raise ValueError("Unexpected end of JSON database")
+            fill()
+        char = buf[pos]
+        if char not in expected:
+            raise ValueError(f"Expected one of {expected!r} at {char!r}")
+        pos += 1
+        return char
+
+    def value():
+        nonlocal pos
+        token('"{[')  # keys and records are strings or objects
+        pos -= 1
+        while True:
+            try:
+                result, pos = decoder.raw_decode(buf, pos)
+                return result
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+
+    fill()
+    token("{")
+    if token('"}') == "}":
+        return
+    pos -= 1
+    while True:
+        table = value()
+        token(":")
+        token("{")
+        if token('"}') == '"':
+            pos -= 1
+            while True:
+                key = value()
+                token(":")
+                yield table, key, value()
+                if token(",}") == "}":
+                    break
+        if token(",}") == "}":
+            return
+
+
+def convert(src: str, dst: str, compression: str = "zlib") -> Dict[str, int]:
+    """Convert a JSON database file to a binary snapshot (or back, by extension)"""
+    with open(src, "rb") as f:
+        blob = f.read()
+    data = loads(blob) if is_snapshot(blob) else json.loads(blob)
+    if dst.endswith(".json"):
+        out = json.dumps(data, indent=2).encode()
+    else:
+        out = dumps(data, compression)
+    with open(dst, "wb") as f:
+        f.write(out)
+    return {
+        "licenses": len(data.get("licenses", {})),
+        "usage": len(data.get("usage", {})),
+        "bytes_in": len(blob),
+        "bytes_out": len(out),
+    }
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Database snapshot tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert_cmd = commands.add_parser(
+        "convert", help="convert JSON <-> binary snapshot (.json output = JSON)"
+    )
+    convert_cmd.add_argument("src")
+    convert_cmd.add_argument("dst")
+    convert_cmd.add_argument(
+        "--compression", choices=sorted(COMPRESSION_CODES), default="zlib"
+    )
+    args = parser.parse_args(argv)
+
+    stats = convert(args.src, args.dst, args.compression)
+    print(
+        f"Converted {stats['licenses']} licenses and {stats['usage']} devices: "
+        f"{stats['bytes_in']} -> {stats['bytes_out']} bytes"
+    )
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
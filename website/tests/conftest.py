@@ -31,6 +31,15 @@ def mock_db():
     if os.path.exists(path):
         os.remove(path)
 
+@pytest.fixture(params=["json", "sqlite"])
+def store(request, monkeypatch, tmp_path):
+    """A fresh store of each backend, so the same test runs against both"""
+    suffix = ".json" if request.param == "json" else ".db"
+    monkeypatch.setattr(db_module, "DB_FILE", str(tmp_path / f"data{suffix}"))
+    store = db_module.create_database(request.param)
+    yield store
+    store.close()
+
 # Fixture for the client
 @pytest.fixture
 def client(mock_db):
@@ -0,0 +1,116 @@
+import os
+
+import pytest
+
+import ai_cache as ai_cache_module
+from ai_cache import ResponseCache, cache_key
+
+pytestmark = pytest.mark.unit
+
+MODEL = "gemini-2.5-flash"
+
+
+def answer(text):
+    return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+
+def test_cache_key_normalizes_prompts():
+    assert cache_key(MODEL, "Why  us?\n") == cache_key(MODEL, "Why us?")
+    assert cache_key(MODEL, "caf\u00e9") == cache_key(MODEL, "cafe\u0301")
+    assert cache_key(MODEL, "Why us?") != cache_key("other-model", "Why us?")
+    assert cache_key(MODEL, "Why us?") != cache_key(MODEL, "Why them?")
+
+
+@pytest.mark.anyio
+async def test_disabled_cache_is_inert():
+    cache = ResponseCache(enabled=False)
+    await cache.put(MODEL, "hi", answer("hello"))
+    assert await cache.get(MODEL, "hi") is None
+    assert cache.stats()["misses"] == 0
+
+
+@pytest.mark.anyio
+async def test_memory_tier(monkeypatch):
+    cache = ResponseCache(enabled=True, memory_entries=2, memory_ttl=60, directory="")
+    assert await cache.get(MODEL, "a") is None
+    for prompt in ("a", "b", "c"):
+        await cache.put(MODEL, prompt, answer(prompt))
+    assert await cache.get(MODEL, "a") is None  # evicted
+    assert await cache.get(MODEL, " c ") == answer("c")
+
+    now = ai_cache_module.time.time()
+    monkeypatch.setattr(ai_cache_module.time, "time", lambda: now + 61)
+    assert await cache.get(MODEL, "c") is None
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["misses"], stats["stores"]) == (1, 3, 3)
+    assert stats["hit_rate"] == 0.25
+
+
+@pytest.mark.anyio
+async def test_disk_tier_survives_restarts(tmp_path, monkeypatch):
+    cache = ResponseCache(enabled=True, memory_entries=0, directory=str(tmp_path), disk_ttl=60)
+    await cache.put(MODEL, "hi", answer("hello"))
+
+    restarted = ResponseCache(enabled=True, memory_ttl=60, directory=str(tmp_path), disk_ttl=60)
+    assert await restarted.get(MODEL, "hi") == answer("hello")
+    assert await restarted.get(MODEL, "hi") == answer("hello")  # promoted to memory
+    assert (restarted.stats()["disk_hits"], restarted.stats()["memory_hits"]) == (1, 1)
+
+    now = ai_cache_module.time.time()
+    monkeypatch.setattr(ai_cache_module.time, "time", lambda: now + 61)
+    assert await cache.get(MODEL, "hi") is None
+    assert not os.path.exists(cache._path(cache_key(MODEL, "hi")))
+    assert cache.stats()["disk_bytes"] == 0
+
+
+@pytest.mark.anyio
+async def test_disk_tier_evicts_least_recently_used(tmp_path):
+    entry_size = len(ai_cache_module.json.dumps({"expires_at": 0.0, "response": answer("a")}))
+    cache = ResponseCache(
+        enabled=True, memory_entries=0, directory=str(tmp_path), disk_max_bytes=entry_size * 5 // 2
+    )
+    await cache.put(MODEL, "a", answer("a"))
+    await cache.put(MODEL, "b", answer("b"))
+    assert await cache.get(MODEL, "a") == answer("a")
+    await cache.put(MODEL, "c", answer("c"))
+
+    assert await cache.get(MODEL, "b") is None
+    assert await cache.get(MODEL, "a") == answer("a")
+    assert await cache.get(MODEL, "c") == answer("c")
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["disk_bytes"] <= entry_size * 5 // 2
+
+    # Entries larger than the whole tier are not written
+    await cache.put(MODEL, "big", answer("x" * entry_size * 3))
+    assert await cache.get(MODEL, "big") is None
+
+
+@pytest.mark.anyio
+async def test_disk_errors_are_contained(tmp_path, capsys):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    cache = ResponseCache(enabled=True, directory=str(blocker))
+    await cache.put(MODEL, "hi", answer("hello"))
+    assert "Error writing AI cache entry" in capsys.readouterr().out
+    assert await cache.get(MODEL, "hi") == answer("hello")  # still in memory
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "content",
+    ["[1, 2]", '{"response": {}}', '{"expires_at": 9e99}', '{"expires_at": "x", "response": {}}',
+     '{"expires_at": 9e99, "response": "text"}', '{"expires_at": 1'],
+)
+async def test_malformed_disk_entries_are_misses(tmp_path, content):
+    cache = ResponseCache(enabled=True, memory_entries=0, directory=str(tmp_path))
+    path = cache._path(cache_key(MODEL, "hi"))
+    os.makedirs(os.path.dirname(path))
+    with open(path, "w") as f:
+        f.write(content)
+
+    assert await cache.get(MODEL, "hi") is None
+    assert not os.path.exists(path)
+    assert cache.stats()["disk_bytes"] == 0
+
+    await cache.put(MODEL, "hi", answer("hello"))
+    assert await cache.get(MODEL, "hi") == answer("hello")
@@ -1,7 +1,10 @@
 import pytest
 from fastapi.testclient import TestClient
+import httpx
+import json
 import types
 import api
+from upstream import UpstreamClients
 
 pytestmark = pytest.mark.integration
 
@@ -28,6 +31,26 @@ def test_track_usage_increments(client, mock_db):
     assert data["usage_count"] == 2
 
 
+def test_track_usage_with_sharded_counters(client, mock_db, monkeypatch):
+    from counters import UsageCounters
+
+    counters = UsageCounters(mock_db.merge_usage, interval_ms=60_000)
+    monkeypatch.setattr(api, "usage_counters", counters)
+    saves = []
+    monkeypatch.setattr(mock_db, "save", lambda: saves.append(1))
+
+    for expected in (1, 2, 3):
+        response = client.post(
+            "/api/track-usage", json={"device_fingerprint": "device-2"}
+        )
+        assert response.json()["usage_count"] == expected
+    assert saves == []
+
+    counters.close()
+    assert len(saves) == 1
+    assert mock_db.get_usage("device-2")["count"] == 3
+
+
 def test_validate_license_invalid_format(client):
     response = client.post(
         "/api/validate-license",
@@ -94,6 +117,60 @@ def test_admin_revoke_license_not_found(client, monkeypatch):
     assert response.status_code == 404
 
 
+def read_ndjson(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_admin_batch_create_and_revoke(client, mock_db, monkeypatch):
+    monkeypatch.setenv("ADMIN_SECRET", "secret")
+    saves = []
+    monkeypatch.setattr(mock_db, "save", lambda: saves.append(True))
+    params = {"secret_key": "secret"}
+
+    response = client.post(
+        "/api/admin/create-licenses",
+        params=params,
+        json=["a@example.com", {"user_id": "b@example.com", "plan": "pro"}, {"plan": "pro"},
+              {"user_id": "c@example.com", "plan": 3}],
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    created = read_ndjson(response)
+    assert [item["index"] for item in created] == [0, 1, 2, 3]
+    assert created[2] == {"index": 2, "error": "user_id is required"}
+    assert created[3] == {"index": 3, "error": "plan must be a string"}
+    keys = [created[0]["license_key"], created[1]["license_key"]]
+    assert mock_db.get_license(keys[0])["user_id"] == "a@example.com"
+    assert mock_db.get_license(keys[1])["plan"] == "pro"
+    assert saves == [True]  # one commit for the whole batch
+
+    response = client.post(
+        "/api/admin/revoke-licenses",
+        params=params,
+        content="\n".join(json.dumps(item) for item in [keys[0], {"license_key": keys[1]}, "missing", 7]),
+        headers={"content-type": "application/x-ndjson"},
+    )
+    revoked = read_ndjson(response)
+    assert [item.get("revoked") for item in revoked] == [True, True, None, None]
+    assert revoked[2]["error"] == "License not found"
+    assert revoked[3]["error"] == "license_key is required"
+    assert mock_db.get_license(keys[0])["active"] is False
+    assert mock_db.get_license(keys[1])["active"] is False
+    assert saves == [True, True]
+
+
+def test_admin_batch_rejects_bad_uploads(client, monkeypatch):
+    monkeypatch.setenv("ADMIN_SECRET", "secret")
+    monkeypatch.setattr(api, "ADMIN_BATCH_LIMIT", 2)
+    for endpoint in ("/api/admin/create-licenses", "/api/admin/revoke-licenses"):
+        assert client.post(endpoint, params={"secret_key": "bad"}, json=[]).status_code == 403
+        params = {"secret_key": "secret"}
+        assert client.post(endpoint, params=params, content="[").status_code == 400
+        assert client.post(endpoint, params=params, json={"a": 1}).status_code == 400
+        assert client.post(endpoint, params=params, json=["a", "b", "c"]).status_code == 413
+        assert read_ndjson(client.post(endpoint, params=params, json=[])) == []
+
+
 def test_create_subscription(client):
     response = client.post(
         "/api/create-subscription",
@@ -227,21 +304,6 @@ def test_check_whitelist_from_device(monkeypatch, mock_db):
     assert api.check_whitelist_from_device("device-7") is True
 
 
-@pytest.mark.unit
-def test_get_user_email_from_license(monkeypatch, mock_db):
-    key = "license-1"
-    mock_db.data["licenses"][key] = {"user_id": "user@example.com"}
-    monkeypatch.setattr(api, "db", mock_db)
-
-    assert api.get_user_email_from_license(key) == "user@example.com"
-
-
-@pytest.mark.unit
-def test_get_user_email_from_license_missing(monkeypatch, mock_db):
-    monkeypatch.setattr(api, "db", mock_db)
-    assert api.get_user_email_from_license("missing") is None
-
-
 @pytest.mark.unit
 def test_check_whitelist_from_device_with_license(monkeypatch, mock_db):
     key = api.generate_license_key("laynefaler@gmail.com")
@@ -307,52 +369,106 @@ def test_proxy_ai_missing_key(client, monkeypatch):
     assert response.status_code == 500
 
 
-def test_proxy_ai_success(client, monkeypatch):
+@pytest.fixture
+def upstream(monkeypatch):
+    """Answer upstream calls with handler(request) instead of the network"""
+    def install(handler):
+        clients = UpstreamClients(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(api, "upstream", clients)
+        return clients
+    return install
+
+
+def test_proxy_ai_success(client, monkeypatch, upstream):
     monkeypatch.setattr(api, "GEMINI_API_KEY", "key")
+    requests = []
 
-    class FakeResponse:
-        status_code = 200
-        def json(self):
-            return {"ok": True}
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={"ok": True})
 
-    class FakeClient:
-        async def __aenter__(self):
-            return self
+    clients = upstream(handler)
 
-        async def __aexit__(self, exc_type, exc, tb):
-            return False
+    for _ in range(2):
+        response = client.post(
+            "/api/proxy-ai",
+            json={"prompt": "hi", "device_fingerprint": "dev"},
+        )
+        assert response.status_code == 200
+        assert response.json()["ok"] is True
+    assert requests[0].url.path == "/v1/models/gemini-2.5-flash:generateContent"
+    assert requests[0].headers["x-goog-api-key"] == "key"
+    assert json.loads(requests[0].content) == {"contents": [{"parts": [{"text": "hi"}]}]}
+    # Both calls went through the same pooled client
+    assert clients.stats()["clients"]["gemini"]["requests"] == 2
 
-        async def post(self, *args, **kwargs):
-            return FakeResponse()
 
-    monkeypatch.setattr(api.httpx, "AsyncClient", lambda: FakeClient())
+def test_proxy_ai_cache(client, monkeypatch, upstream):
+    from ai_cache import ResponseCache
+
+    monkeypatch.setattr(api, "GEMINI_API_KEY", "key")
+    monkeypatch.setattr(api, "ai_cache", ResponseCache(enabled=True, directory=""))
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        status = 200 if len(requests) < 3 else 500
+        return httpx.Response(status, json={"answer": len(requests)})
+
+    upstream(handler)
+
+    def ask(prompt, **fields):
+        return client.post(
+            "/api/proxy-ai", json={"prompt": prompt, "device_fingerprint": "dev", **fields}
+        )
+
+    assert ask("Why us?").json() == {"answer": 1}
+    assert ask("Why  us? ").json() == {"answer": 1}
+    assert ask("Why us?", bypass_cache=True).json() == {"answer": 2}
+    assert ask("Why us?").json() == {"answer": 2}
+    # Failed calls are not cached
+    assert ask("Other").status_code == 500
+    assert len(requests) == 3
+    assert api.ai_cache.stats()["memory_hits"] == 2
+
+    monkeypatch.setenv("ADMIN_SECRET", "secret")
+    stats = client.get("/api/admin/stats", params={"secret_key": "secret"}).json()
+    assert stats["ai_cache"]["stores"] == 2
+
+
+def test_proxy_ai_error_status(client, monkeypatch, upstream):
+    monkeypatch.setattr(api, "GEMINI_API_KEY", "key")
+    upstream(lambda request: httpx.Response(500, text="bad"))
 
     response = client.post(
         "/api/proxy-ai",
         json={"prompt": "hi", "device_fingerprint": "dev"},
     )
-    assert response.status_code == 200
-    assert response.json()["ok"] is True
+    assert response.status_code == 500
 
 
-def test_proxy_ai_error_status(client, monkeypatch):
+def test_proxy_ai_timeout(client, monkeypatch, upstream):
     monkeypatch.setattr(api, "GEMINI_API_KEY", "key")
 
-    class FakeResponse:
-        status_code = 500
-        text = "bad"
+    def handler(request):
+        raise api.httpx.TimeoutException("timeout")
 
-    class FakeClient:
-        async def __aenter__(self):
-            return self
+    upstream(handler)
 
-        async def __aexit__(self, exc_type, exc, tb):
-            return False
+    response = client.post(
+        "/api/proxy-ai",
+        json={"prompt": "hi", "device_fingerprint": "dev"},
+    )
+    assert response.status_code == 504
 
-        async def post(self, *args, **kwargs):
-            return FakeResponse()
 
-    monkeypatch.setattr(api.httpx, "AsyncClient", lambda: FakeClient())
+def test_proxy_ai_unexpected_error(client, monkeypatch, upstream):
+    monkeypatch.setattr(api, "GEMINI_API_KEY", "key")
+
+    def handler(request):
+        raise Exception("boom")
+
+    upstream(handler)
 
     response = client.post(
         "/api/proxy-ai",
@@ -361,45 +477,565 @@ def test_proxy_ai_error_status(client, monkeypatch):
     assert response.status_code == 500
 
 
-def test_proxy_ai_timeout(client, monkeypatch):
-    monkeypatch.setattr(api, "GEMINI_API_KEY", "key")
+@pytest.mark.anyio
+async def test_event_loop_stays_responsive_during_slow_writes(monkeypatch, mock_db):
+    """Handlers await the db executor, so slow disk writes never block the loop"""
+    import asyncio
+    import gc
+    import time
+
+    monkeypatch.setattr(api, "db", mock_db)
+    monkeypatch.setattr(mock_db, "save", lambda: time.sleep(0.05))
+    # A full collection of the test process's heap can pause the loop for
+    # longer than the bound below; that is not what this test measures
+    gc.collect()
+    gc.disable()
+
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - started - 0.005)
+
+    tick_task = asyncio.create_task(ticker())
+    try:
+        await asyncio.gather(
+            *(
+                api.track_usage(api.TrackUsageRequest(device_fingerprint=f"device-{i}"))
+                for i in range(5)
+            )
+        )
+        stop.set()
+        await tick_task
+    finally:
+        gc.enable()
+
+    # 5 devices x 3 writes x 50ms of blocking I/O ran while the loop kept ticking
+    assert len(lags) > 20
+    assert max(lags) < 0.04
+
+
+def _create_subscription(client, subscription_id):
+    response = client.post(
+        "/api/create-subscription",
+        json={"email": "sub@example.com", "subscription_id": subscription_id},
+    )
+    return response.json()["license_key"]
 
-    class FakeClient:
-        async def __aenter__(self):
-            return self
 
-        async def __aexit__(self, exc_type, exc, tb):
-            return False
+@pytest.mark.parametrize(
+    "event_type, active, status",
+    [
+        ("BILLING.SUBSCRIPTION.CANCELLED", False, "cancelled"),
+        ("BILLING.SUBSCRIPTION.SUSPENDED", False, "suspended"),
+        ("BILLING.SUBSCRIPTION.RE-ACTIVATED", True, "active"),
+    ],
+)
+def test_paypal_webhook_subscription_status(client, mock_db, event_type, active, status):
+    license_key = _create_subscription(client, "sub_status")
+    mock_db.update_license(license_key, {"active": not active})
 
-        async def post(self, *args, **kwargs):
-            raise api.httpx.TimeoutException("timeout")
+    response = client.post(
+        "/api/webhook/paypal",
+        json={"event_type": event_type, "resource": {"id": "sub_status"}},
+    )
+    assert response.status_code == 200
+    assert response.json()["license_keys"] == [license_key]
+    assert mock_db.get_license(license_key)["active"] is active
+    assert mock_db.get_license(license_key)["status"] == status
 
-    monkeypatch.setattr(api.httpx, "AsyncClient", lambda: FakeClient())
 
+def test_paypal_webhook_unknown_subscription(client):
     response = client.post(
-        "/api/proxy-ai",
-        json={"prompt": "hi", "device_fingerprint": "dev"},
+        "/api/webhook/paypal",
+        json={"event_type": "BILLING.SUBSCRIPTION.CANCELLED", "resource": {"id": "nope"}},
     )
-    assert response.status_code == 504
+    assert response.status_code == 200
+    assert response.json()["license_keys"] == []
 
+    response = client.post(
+        "/api/webhook/paypal",
+        json={"event_type": "BILLING.SUBSCRIPTION.CANCELLED", "resource": {}},
+    )
+    assert response.json()["license_keys"] == []
 
-def test_proxy_ai_unexpected_error(client, monkeypatch):
-    monkeypatch.setattr(api, "GEMINI_API_KEY", "key")
 
-    class FakeClient:
-        async def __aenter__(self):
-            return self
+def test_paypal_webhook_renewal_restarts_window(client, mock_db):
+    license_key = _create_subscription(client, "sub_renew")
+    mock_db.update_license(license_key, {"start_date": "2020-01-01T00:00:00", "active": False})
+
+    response = client.post(
+        "/api/webhook/paypal",
+        json={
+            "event_type": "PAYMENT.SALE.COMPLETED",
+            "resource": {"billing_agreement_id": "sub_renew"},
+        },
+    )
+    assert response.json()["license_keys"] == [license_key]
+    assert api.validate_license_signature(license_key)["valid"] is True
+
+
+def test_paypal_webhook_activation_reuses_existing_license(client, mock_db):
+    license_key = _create_subscription(client, "sub_existing")
+    response = client.post(
+        "/api/webhook/paypal",
+        json={
+            "event_type": "BILLING.SUBSCRIPTION.ACTIVATED",
+            "resource": {"subscriber": {"email_address": "sub@example.com"},
+                         "id": "sub_existing"},
+        },
+    )
+    assert response.json()["license_key"] == license_key
+    assert len(mock_db.find_licenses(user_id="sub@example.com")) == 1
+
 
-        async def __aexit__(self, exc_type, exc, tb):
-            return False
+def test_admin_stats(client, monkeypatch, mock_db):
+    monkeypatch.setenv("ADMIN_SECRET", "secret")
+    mock_db.increment_usage("device-1")
+
+    assert client.get("/api/admin/stats", params={"secret_key": "bad"}).status_code == 403
+    response = client.get("/api/admin/stats", params={"secret_key": "secret"})
+    assert response.status_code == 200
+    stats = response.json()["database"]
+    assert stats["backend"] == "json"
+    assert stats["usage"] == 1
+    assert "usage_table" not in stats
 
-        async def post(self, *args, **kwargs):
-            raise Exception("boom")
 
-    monkeypatch.setattr(api.httpx, "AsyncClient", lambda: FakeClient())
+@pytest.mark.anyio
+async def test_check_usage_never_writes(monkeypatch, mock_db):
+    """Random fingerprints (scanners, new installs) must not be stored"""
+    import uuid
+
+    writes = []
+    monkeypatch.setattr(api, "db", mock_db)
+    monkeypatch.setattr(mock_db, "save", lambda: writes.append("save"))
+    monkeypatch.setattr(mock_db, "_persist", lambda keys: writes.append(keys))
+
+    for _ in range(100_000):
+        fingerprint = uuid.uuid4().hex
+        response = await api.check_usage(
+            api.CheckUsageRequest(device_fingerprint=fingerprint)
+        )
+        assert response["valid"] is True
+        assert api.check_whitelist_from_device(fingerprint) is False
+
+    assert writes == []
+    assert len(mock_db.data["usage"]) == 0
+
+
+def test_admin_backup(client, monkeypatch, mock_db, tmp_path):
+    import backup
+
+    monkeypatch.setenv("ADMIN_SECRET", "secret")
+    monkeypatch.setattr(backup, "DB_BACKUP_DIR", str(tmp_path / "backups"))
+    mock_db.increment_usage("device-1")
 
+    assert client.post("/api/admin/backup", params={"secret_key": "bad"}).status_code == 403
+    response = client.post("/api/admin/backup", params={"secret_key": "secret"})
+    assert response.json()["backup"]["kind"] == "full"
+    mock_db.increment_usage("device-1")
     response = client.post(
-        "/api/proxy-ai",
-        json={"prompt": "hi", "device_fingerprint": "dev"},
+        "/api/admin/backup", params={"secret_key": "secret", "incremental": "true"}
     )
-    assert response.status_code == 500
+    assert response.json()["backup"]["kind"] == "incr"
+    assert response.json()["backup"]["records"] == 1
+
+
+def test_admin_usage_pages_and_filters(client, monkeypatch, mock_db):
+    monkeypatch.setenv("ADMIN_SECRET", "secret")
+    for i in range(5):
+        for _ in range(i + 1):
+            mock_db.increment_usage(f"device-{i}")
+
+    assert client.get("/api/admin/usage", params={"secret_key": "bad"}).status_code == 403
+    params = {"secret_key": "secret", "order": "count", "limit": 2}
+    seen = []
+    while True:
+        page = client.get("/api/admin/usage", params=params).json()
+        seen += [(item["device_fingerprint"], item["count"]) for item in page["items"]]
+        if not page["next_cursor"]:
+            break
+        params["cursor"] = page["next_cursor"]
+    assert seen == [(f"device-{i}", i + 1) for i in range(5)]
+
+    response = client.get("/api/admin/usage", params={
+        "secret_key": "secret", "order": "count", "start": 2, "end": 4, "reverse": True,
+    })
+    assert [item["count"] for item in response.json()["items"]] == [3, 2]
+    response = client.get("/api/admin/usage", params={"secret_key": "secret"})
+    assert len(response.json()["items"]) == 5
+
+
+@pytest.mark.parametrize("params", [
+    {"order": "email"},
+    {"order": "count", "start": "x"},
+    {"cursor": "not-a-cursor"},
+    {"format": "xml"},
+])
+def test_admin_usage_bad_requests(client, monkeypatch, mock_db, params):
+    monkeypatch.setenv("ADMIN_SECRET", "secret")
+    response = client.get("/api/admin/usage", params={"secret_key": "secret", **params})
+    assert response.status_code == 400
+
+
+def test_admin_usage_ndjson_streams_in_batches(client, monkeypatch, mock_db):
+    import json
+
+    monkeypatch.setenv("ADMIN_SECRET", "secret")
+    monkeypatch.setattr(api, "ADMIN_STREAM_BATCH", 2)
+    pages = []
+    scan_usage = mock_db.scan_usage
+    monkeypatch.setattr(
+        mock_db, "scan_usage",
+        lambda *args: pages.append(args[4]) or scan_usage(*args),
+    )
+    for i in range(5):
+        mock_db.increment_usage(f"device-{i}")
+
+    response = client.get(
+        "/api/admin/usage", params={"secret_key": "secret", "format": "ndjson"}
+    )
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["device_fingerprint"] for line in lines) == [
+        f"device-{i}" for i in range(5)
+    ]
+    assert pages == [2, 2, 2]
+
+
+def test_admin_licenses_by_expiry(client, monkeypatch, mock_db):
+    import json
+
+    monkeypatch.setenv("ADMIN_SECRET", "secret")
+    for key, start in [("key1", "2026-03-01T00:00:00"), ("key2", "2026-01-01T00:00:00"),
+                       ("key3", "2026-02-01T00:00:00")]:
+        mock_db.create_license(key, "user@example.com")
+        mock_db.update_license(key, {"start_date": start})
+
+    assert client.get("/api/admin/licenses", params={"secret_key": "bad"}).status_code == 403
+    response = client.get("/api/admin/licenses", params={
+        "secret_key": "secret",
+        "expires_after": "2026-02-15T00:00:00",
+        "expires_before": "2026-04-02T00:00:00",
+    })
+    items = response.json()["items"]
+    assert [item["license_key"] for item in items] == ["key3", "key1"]
+    assert items[0]["expires_at"] == "2026-03-04T00:00:00"
+
+    response = client.get("/api/admin/licenses", params={
+        "secret_key": "secret", "reverse": True, "format": "ndjson",
+    })
+    keys = [json.loads(line)["license_key"] for line in response.text.splitlines()]
+    assert keys == ["key1", "key3", "key2"]
+
+    response = client.get(
+        "/api/admin/licenses", params={"secret_key": "secret", "expires_after": "soon"}
+    )
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def v2_keys(monkeypatch, mock_db):
+    monkeypatch.setattr(api, "db", mock_db)
+    monkeypatch.setattr(api, "LICENSE_SECRET", "testsecret")
+    monkeypatch.setattr(api, "LICENSE_SECRET_CONFIGURED", True)
+    monkeypatch.setattr(api, "rejected_keys", api.RejectedKeys(100, 60))
+    lookups = []
+    get_license = mock_db.get_license
+    monkeypatch.setattr(
+        mock_db, "get_license", lambda key: lookups.append(key) or get_license(key)
+    )
+    return lookups
+
+
+@pytest.mark.unit
+def test_v2_license_keys_are_verified_without_the_database(mock_db, v2_keys):
+    key = api.generate_license_key("user@example.com")
+    assert key.startswith("HA-SUB-V2-")
+    mock_db.create_license(key, "user@example.com")
+    assert api.validate_license_signature(key)["valid"] is True
+    assert v2_keys == [key]
+
+    forged = key[:-1] + ("0" if key[-1] != "0" else "1")
+    for bad, reason in [
+        (forged, "Invalid signature"),
+        ("HA-SUB-V2-123-abc", "Invalid structure"),
+        ("HA-SUB-V2-x-abc-def", "Invalid structure"),
+    ]:
+        assert api.validate_license_signature(bad) == {"valid": False, "reason": reason}
+    assert v2_keys == [key]
+
+
+@pytest.mark.unit
+def test_v1_license_keys_still_validate(mock_db, v2_keys, monkeypatch):
+    monkeypatch.setattr(api, "LICENSE_SECRET_CONFIGURED", False)
+    key = api.generate_license_key("user@example.com")
+    assert len(key.split("-")) == 5
+    mock_db.create_license(key, "user@example.com")
+    assert api.validate_license_signature(key)["valid"] is True
+
+
+@pytest.mark.unit
+def test_unknown_keys_are_negatively_cached(v2_keys, monkeypatch):
+    for _ in range(3):
+        result = api.validate_license_signature("HA-SUB-123-abc-xyz")
+        assert result == {"valid": False, "reason": "License not found"}
+    assert v2_keys == ["HA-SUB-123-abc-xyz"]
+    assert api.rejected_keys.hits == 2
+
+    # Entries expire, and issuing a key drops any stale rejection of it
+    monkeypatch.setattr(api.time, "monotonic", lambda: 10**9)
+    api.validate_license_signature("HA-SUB-123-abc-xyz")
+    assert len(v2_keys) == 2
+    api.rejected_keys.add("HA-SUB-1-2-3", "License not found")
+    monkeypatch.setattr(api.secrets, "token_hex", lambda n: "2")
+    monkeypatch.setattr(api.time, "time", lambda: 1)
+    monkeypatch.setattr(api, "LICENSE_SECRET_CONFIGURED", False)
+    monkeypatch.setattr(api, "_sign", lambda message, length: "3")
+    assert api.generate_license_key("u") == "HA-SUB-1-2-3"
+    assert api.rejected_keys.get("HA-SUB-1-2-3") is None
+
+
+@pytest.mark.unit
+def test_rejected_keys_are_bounded():
+    cache = api.RejectedKeys(2, 60)
+    for key in ("a", "b", "c"):
+        cache.add(key, "License not found")
+    assert len(cache) == 2
+    assert cache.get("a") is None
+    assert cache.get("b") == "License not found"
+
+    disabled = api.RejectedKeys(0, 60)
+    disabled.add("a", "License not found")
+    assert len(disabled) == 0
+
+
+def test_entitlements_follow_license_changes(client, monkeypatch, mock_db):
+    monkeypatch.setenv("ADMIN_SECRET", "secret")
+    key = client.post(
+        "/api/admin/create-license", params={"user_id": "u", "secret_key": "secret"}
+    ).json()["license_key"]
+    assert api.validate_license_signature(key)["valid"] is True
+    reads = api.entitlements.stats()["misses"]
+    assert api.validate_license_signature(key)["valid"] is True
+    assert api.entitlements.stats()["misses"] == reads
+
+    client.post("/api/admin/revoke-license", params={"license_key": key, "secret_key": "secret"})
+    assert api.validate_license_signature(key) == {
+        "valid": False, "reason": "License inactive",
+    }
+
+
+def test_check_usage_reports_whitelisted_devices(client):
+    body = {"device_fingerprint": "device-wl"}
+    assert client.post("/api/check-usage", json=body).json()["is_whitelisted"] is False
+    client.post(
+        "/api/activate-whitelist",
+        json={"email": "laynefaler@gmail.com", "device_fingerprint": "device-wl"},
+    )
+    assert client.post("/api/check-usage", json=body).json()["is_whitelisted"] is True
+
+
+def test_check_usage_issues_and_honours_entitlement_tokens(client, monkeypatch, mock_db):
+    body = {"device_fingerprint": "device-tok", "issue_token": True}
+    issued = client.post("/api/check-usage", json=body).json()
+    token = issued["entitlement_token"]
+    assert issued["token_expires_at"] > 0
+
+    # A good token answers without resolving the entitlement
+    lookups = []
+    adevice = api.entitlements.adevice
+    monkeypatch.setattr(
+        api.entitlements, "adevice", lambda fp: lookups.append(fp) or adevice(fp)
+    )
+    response = client.post("/api/check-usage", json={**body, "entitlement_token": token})
+    data = response.json()
+    assert data["is_whitelisted"] is False
+    assert "entitlement_token" not in data and "token_error" not in data
+    assert lookups == []
+
+    response = client.post(
+        "/api/check-usage",
+        json={"device_fingerprint": "other-device", "entitlement_token": token},
+    )
+    assert response.json()["token_error"] == "Token issued for another device"
+    assert lookups == ["other-device"]
+
+
+def test_validate_license_token_is_revoked_with_the_license(client, monkeypatch, mock_db):
+    monkeypatch.setenv("ADMIN_SECRET", "secret")
+    key = client.post(
+        "/api/admin/create-license", params={"user_id": "u", "secret_key": "secret"}
+    ).json()["license_key"]
+    mock_db.update_license(key, {"plan": "pro"})
+    response = client.post(
+        "/api/validate-license",
+        json={"license_key": key, "device_fingerprint": "device-rev", "issue_token": True},
+    )
+    token = response.json()["entitlement_token"]
+    check = {"device_fingerprint": "device-rev", "entitlement_token": token}
+    assert "token_error" not in client.post("/api/check-usage", json=check).json()
+
+    refreshed = client.post("/api/refresh-token", json=check)
+    assert refreshed.status_code == 200
+    assert refreshed.json()["entitlement_token"]
+
+    client.post("/api/admin/revoke-license", params={"license_key": key, "secret_key": "secret"})
+    assert client.post("/api/check-usage", json=check).json()["token_error"] == "Token revoked"
+    response = client.post("/api/refresh-token", json=check)
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Token revoked"
+
+
+def test_auto_apply_uses_token_claims(client, monkeypatch, mock_db):
+    mock_db.create_license("key-tok", "user@example.com", plan="unlimited")
+    mock_db.update_usage("device-auto", {"license_key": "key-tok"})
+    token = client.post(
+        "/api/check-usage", json={"device_fingerprint": "device-auto", "issue_token": True}
+    ).json()["entitlement_token"]
+
+    monkeypatch.setattr(api.entitlements, "alicense", None)
+    job = {"id": "1", "title": "t", "company": "c", "location": "l", "url": "u",
+           "source": "s", "remote": True}
+    response = client.post("/api/jobs/auto-apply", json={
+        "device_fingerprint": "device-auto",
+        "jobs": [job] * 6,
+        "profile": {"full_name": "n", "email": "e", "resume_url": "r"},
+        "license_key": "key-tok",
+        "entitlement_token": token,
+    })
+    assert response.json()["unlimited"] is True
+    assert response.json()["applied_count"] == 6
+
+
+@pytest.mark.anyio
+async def test_identical_upstream_calls_are_coalesced(monkeypatch):
+    import asyncio
+    from main import app
+
+    monkeypatch.setattr(api, "GEMINI_API_KEY", "key")
+    monkeypatch.setattr(api, "JOB_API_BASE_URL", "https://jobs.example.com")
+    monkeypatch.setattr(api, "upstream_flights", api.SingleFlight())
+    release = asyncio.Event()
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url.host)
+        await release.wait()
+        if request.url.host == "jobs.example.com":
+            return httpx.Response(200, json={"results": [{"id": "1", "title": "Engineer"}]})
+        return httpx.Response(200, json={"answer": "shared"})
+
+    monkeypatch.setattr(api, "upstream", UpstreamClients(transport=httpx.MockTransport(handler)))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        asks = [
+            client.post("/api/proxy-ai", json={"prompt": prompt, "device_fingerprint": "dev"})
+            for prompt in ("Why us?", "Why  us?", "Why us? ")
+        ]
+        searches = [
+            client.post("/api/jobs/search", json={"query": query, "location": "Remote"})
+            for query in ("engineer", " engineer")
+        ]
+        pending = asyncio.gather(*asks, *searches)
+        while len(calls) < 2:
+            await asyncio.sleep(0.01)
+        release.set()
+        responses = await pending
+
+    assert sorted(calls) == ["generativelanguage.googleapis.com", "jobs.example.com"]
+    assert [r.json() for r in responses[:3]] == [{"answer": "shared"}] * 3
+    assert [r.json()["results"][0]["title"] for r in responses[3:]] == ["Engineer"] * 2
+    assert api.upstream_flights.stats() == {"in_flight": 0, "calls": 2, "shared": 3}
+
+
+@pytest.mark.anyio
+async def test_proxy_ai_batch(monkeypatch):
+    import asyncio
+    from main import app
+
+    monkeypatch.setattr(api, "GEMINI_API_KEY", "key")
+    monkeypatch.setattr(api, "AI_BATCH_CONCURRENCY", 2)
+    running = []
+    peak = []
+
+    async def handler(request):
+        prompt = json.loads(request.content)["contents"][0]["parts"][0]["text"]
+        running.append(prompt)
+        peak.append(len(running))
+        # Later prompts answer sooner, so completion order differs from input order
+        await asyncio.sleep(0.01 * (5 - len(prompt) % 5))
+        running.remove(prompt)
+        if "fail" in prompt:
+            return httpx.Response(503, text="overloaded")
+        return httpx.Response(200, json={"answer": prompt})
+
+    monkeypatch.setattr(api, "upstream", UpstreamClients(transport=httpx.MockTransport(handler)))
+    transport = httpx.ASGITransport(app=app)
+    body = {
+        "device_fingerprint": "dev",
+        "prompts": ["Summarize my resume"],
+        "fields": ["First name", "Why us?", "fail"],
+        "context": "Resume: ...",
+    }
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.post("/api/proxy-ai/batch", json=body)
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [item["index"] for item in results] == [0, 1, 2, 3]
+        assert results[0]["response"] == {"answer": "Summarize my resume"}
+        assert results[2]["response"] == {"answer": "Resume: ...\n\nWhy us?"}
+        assert results[3]["error"].startswith("AI service error")
+        assert "response" not in results[3]
+        assert max(peak) == 2
+
+        response = await client.post(
+            "/api/proxy-ai/batch", params={"format": "ndjson"},
+            json={"device_fingerprint": "dev", "fields": ["a", "bb", "ccc"]},
+        )
+        assert response.headers["content-type"] == "application/x-ndjson"
+        streamed = [json.loads(line) for line in response.text.splitlines()]
+        assert sorted(item["index"] for item in streamed) == [0, 1, 2]
+        assert {item["index"]: item["response"]["answer"] for item in streamed} == {
+            0: "a", 1: "bb", 2: "ccc",
+        }
+
+        monkeypatch.setattr(api, "AI_BATCH_MAX_ITEMS", 2)
+        for params, payload, status in (
+            ({"format": "xml"}, body, 400),
+            ({}, {"device_fingerprint": "dev"}, 400),
+            ({}, body, 413),
+        ):
+            response = await client.post("/api/proxy-ai/batch", params=params, json=payload)
+            assert response.status_code == status
+        monkeypatch.setattr(api, "GEMINI_API_KEY", "")
+        response = await client.post("/api/proxy-ai/batch", json=body)
+        assert response.status_code == 500
+
+
+@pytest.mark.anyio
+async def test_proxy_ai_batch_stream_stops_on_disconnect(monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(api, "GEMINI_API_KEY", "key")
+    started = []
+
+    async def slow_answer(prompt, bypass_cache=False):
+        started.append(prompt)
+        if prompt != "quick":
+            await asyncio.sleep(10)
+        return {"answer": prompt}
+
+    monkeypatch.setattr(api, "answer_prompt", slow_answer)
+    response = await api.proxy_ai_batch(
+        api.AIBatchRequest(device_fingerprint="dev", prompts=["slow", "quick", "slower"]),
+        "ndjson",
+    )
+    first = await response.body_iterator.__anext__()
+    assert json.loads(first) == {"index": 1, "response": {"answer": "quick"}}
+    await asyncio.wait_for(response.body_iterator.aclose(), 1)
+    assert sorted(started) == ["quick", "slow", "slower"]
@@ -0,0 +1,208 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import backup
+import db as db_module
+from db import Database
+from db_sqlite import SQLiteDatabase
+
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = str(tmp_path / "data.json")
+    monkeypatch.setattr(db_module, "DB_FILE", path)
+    return path
+
+
+@pytest.fixture
+def backup_dir(tmp_path):
+    return str(tmp_path / "backups")
+
+
+def restored(backup_dir, tmp_path, **kwargs):
+    dst = str(tmp_path / "restored.json")
+    backup.restore(backup_dir, dst, **kwargs)
+    with open(dst) as f:
+        return json.load(f)
+
+
+def test_full_then_incremental_chain(db_path, backup_dir, tmp_path):
+    db = Database()
+    db.create_license("key1", "a@b.c")
+    db.increment_usage("device-1")
+    full = db.backup(backup_dir)
+    assert full["kind"] == "full"
+    assert full["file"] == "000001-full.json"
+    assert full["records"] == 2
+
+    db.increment_usage("device-1")
+    db.increment_usage("device-2")
+    db.revoke_license("key1")
+    incr = db.backup(backup_dir, incremental=True)
+    assert incr["kind"] == "incr"
+    assert incr["records"] == 3  # changed records only, not the database
+    assert incr["backup_id"] == full["backup_id"]
+
+    data = restored(backup_dir, tmp_path)
+    assert data == {"licenses": db.data["licenses"], "usage": db.data["usage"]}
+    assert restored(backup_dir, tmp_path, sequence=1)["usage"]["device-1"]["count"] == 1
+
+    db.increment_usage("device-3")
+    assert db.backup(backup_dir, incremental=True)["records"] == 1
+    assert db.backup(backup_dir, incremental=True)["records"] == 0
+    assert [e["sequence"] for e in backup.read_manifest(backup_dir)["entries"]] == [1, 2, 3, 4]
+
+
+def test_incremental_needs_a_chain_from_this_process(db_path, backup_dir):
+    assert Database().backup(backup_dir, incremental=True)["kind"] == "full"
+    # A restarted server no longer knows what changed since that backup
+    assert Database().backup(backup_dir, incremental=True)["kind"] == "full"
+
+
+def test_deleted_records_are_replayed(db_path, backup_dir, tmp_path):
+    db = Database()
+    db.increment_usage("device-1")
+    db.backup(backup_dir)
+    db._apply("usage", "device-1", None)
+    db._commit("usage", "device-1")
+    db.backup(backup_dir, incremental=True)
+    assert restored(backup_dir, tmp_path)["usage"] == {}
+
+
+def test_backups_are_consistent_while_writes_continue(db_path, backup_dir, tmp_path):
+    db = Database(flush_interval_ms=50)
+    stop = threading.Event()
+
+    def writer():
+        # Both devices move together in one atomic merge
+        while not stop.is_set():
+            db.merge_usage({"device-a": (1, "2026-01-01"), "device-b": (1, "2026-01-01")})
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        entries = [db.backup(backup_dir, incremental=i > 0) for i in range(5)]
+    finally:
+        stop.set()
+        thread.join()
+        db.close()
+
+    for entry in entries:
+        usage = restored(backup_dir, tmp_path, sequence=entry["sequence"])["usage"]
+        if usage:
+            assert usage["device-a"]["count"] == usage["device-b"]["count"]
+
+
+def test_binary_and_custom_tables(monkeypatch, db_path, backup_dir, tmp_path):
+    db = Database(snapshot_format="binary", compact_usage=True)
+    db.increment_usage("device-1")
+    assert db.backup(backup_dir)["file"].endswith(".snap")
+    db.increment_usage("device-1")
+    db.backup(backup_dir, incremental=True)
+    usage = restored(backup_dir, tmp_path)["usage"]
+    assert [record["count"] for record in usage.values()] == [2]
+
+    dst = str(tmp_path / "restored.snap")
+    backup.restore(backup_dir, dst)
+    with open(dst, "rb") as f:
+        assert backup.snapshot.is_snapshot(f.read())
+
+
+def test_failed_write_starts_a_new_chain(monkeypatch, db_path, backup_dir):
+    db = Database()
+    db.backup(backup_dir)
+
+    def broken(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(backup, "write_segment", broken)
+    with pytest.raises(OSError):
+        db.backup(backup_dir, incremental=True)
+    monkeypatch.undo()
+    assert db.backup(backup_dir, incremental=True)["kind"] == "full"
+
+
+def test_restore_verifies_checksums(db_path, backup_dir, tmp_path):
+    with pytest.raises(ValueError):
+        backup.restore(backup_dir, str(tmp_path / "x.json"))
+    db = Database()
+    db.increment_usage("device-1")
+    entry = db.backup(backup_dir)
+    with open(os.path.join(backup_dir, entry["file"]), "a") as f:
+        f.write(" ")
+    with pytest.raises(ValueError, match="Checksum"):
+        backup.restore(backup_dir, str(tmp_path / "x.json"))
+
+
+def test_corrupt_segment_is_rejected(db_path, backup_dir, tmp_path):
+    db = Database()
+    db.backup(backup_dir)
+    entry = backup.write_segment(backup_dir, db._backup_id, [b"garbage\n"])
+    assert entry["kind"] == "incr"
+    with pytest.raises(ValueError, match="Corrupt"):
+        backup.restore(backup_dir, str(tmp_path / "x.json"))
+
+
+def test_sqlite_online_backup(backup_dir, tmp_path):
+    store = SQLiteDatabase(str(tmp_path / "live.db"))
+    store.create_license("key1", "a@b.c")
+    store.increment_usage("device-1")
+    entry = store.backup(backup_dir, incremental=True)
+    assert entry["kind"] == "full" and entry["file"].endswith(".db")
+    assert entry["records"] == 2
+
+    dst = str(tmp_path / "restored.db")
+    backup.restore(backup_dir, dst)
+    copy = SQLiteDatabase(dst)
+    assert copy.get_usage("device-1")["count"] == 1
+    copy.close()
+    store.close()
+
+
+def test_cli(monkeypatch, db_path, backup_dir, tmp_path, capsys):
+    db = Database()
+    db.increment_usage("device-1")
+    db.backup(backup_dir)
+    assert backup.main(["list", backup_dir]) == 0
+    assert "000001-full.json" in capsys.readouterr().out
+    dst = str(tmp_path / "out.json")
+    assert backup.main(["restore", backup_dir, dst]) == 0
+    assert "up to backup 1" in capsys.readouterr().out
+
+    requests = []
+
+    def fake_urlopen(request, timeout):
+        requests.append(request)
+        body = {"backup": {"file": "000002-incr.journal", "records": 0}}
+        return io.BytesIO(json.dumps(body).encode())
+
+    monkeypatch.setenv("ADMIN_SECRET", "s3cret")
+    monkeypatch.setattr(backup.urllib.request, "urlopen", fake_urlopen)
+    assert backup.main(["create", "--incremental", "--url", "http://app"]) == 0
+    assert "Wrote 000002-incr.journal" in capsys.readouterr().out
+    assert requests[0].method == "POST"
+    assert requests[0].full_url == (
+        "http://app/api/admin/backup?secret_key=s3cret&incremental=true"
+    )
+
+
+def test_import_leaves_the_live_store_alone(tmp_path):
+    path = str(tmp_path / "live.json")
+    with open(path + db_module.JOURNAL_SUFFIX, "wb") as f:
+        f.write(b"torn")
+    env = dict(os.environ, DB_FILE=path, DB_JOURNAL="1")
+    subprocess.run(
+        [sys.executable, "-c", "import sys, backup; assert 'db' not in sys.modules"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env, check=True,
+    )
+    with open(path + db_module.JOURNAL_SUFFIX, "rb") as f:
+        assert f.read() == b"torn"
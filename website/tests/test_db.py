@@ -5,6 +5,9 @@ import db as db_module
 import os
 import tempfile
 import importlib
+import json
+import time
+import threading
 
 pytestmark = pytest.mark.unit
 
@@ -114,3 +117,315 @@ class TestDatabase:
 
         db = Database()
         db.save()
+
+
+class TestJournal:
+    @pytest.fixture
+    def db_path(self, monkeypatch, tmp_path):
+        path = str(tmp_path / "data.json")
+        monkeypatch.setattr(db_module, "DB_FILE", path)
+        return path
+
+    def test_mutations_append_to_journal_not_snapshot(self, db_path):
+        db = Database(journal=True)
+        db.create_license("key1", "user@example.com")
+        db.increment_usage("device-1")
+
+        assert not os.path.exists(db_path)
+        with open(db_path + db_module.JOURNAL_SUFFIX, "rb") as f:
+            lines = f.readlines()
+        assert len(lines) == 2  # license, usage increment (no phantom creation)
+        assert db_module.decode_journal_records(lines[0])[0][:2] == ("licenses", "key1")
+
+    def test_replay_restores_state(self, db_path):
+        db = Database(journal=True)
+        db.create_license("key1", "user@example.com", plan="pro")
+        db.increment_usage("device-1")
+        db.increment_usage("device-1")
+
+        db2 = Database(journal=True)
+        assert db2.get_license("key1")["plan"] == "pro"
+        assert db2.get_usage("device-1")["count"] == 2
+
+    def test_torn_tail_is_truncated(self, db_path):
+        db = Database(journal=True)
+        db.increment_usage("device-1")
+        journal_path = db_path + db_module.JOURNAL_SUFFIX
+        good_size = os.path.getsize(journal_path)
+        with open(journal_path, "ab") as f:
+            f.write(db_module.encode_journal_record("usage", "device-2", {"count": 5})[:-7])
+
+        db2 = Database(journal=True)
+        assert db2.get_usage("device-1")["count"] == 1
+        assert "device-2" not in db2.data["usage"]
+        assert os.path.getsize(journal_path) == good_size
+
+    def test_corrupt_record_stops_replay(self, db_path):
+        journal_path = db_path + db_module.JOURNAL_SUFFIX
+        good = db_module.encode_journal_record("usage", "device-1", {"count": 1})
+        bad = db_module.encode_journal_record("usage", "device-2", {"count": 2})
+        bad = bad.replace(b'"count":2', b'"count":3')
+        after = db_module.encode_journal_record("usage", "device-3", {"count": 3})
+        with open(journal_path, "wb") as f:
+            f.write(good + bad + after)
+
+        db = Database(journal=True)
+        assert db.data["usage"] == {"device-1": {"count": 1}}
+        assert os.path.getsize(journal_path) == len(good)
+
+    def test_decode_rejects_garbage(self):
+        assert db_module.decode_journal_records(b"not a record\n") is None
+        assert db_module.decode_journal_records(b"zzzzzzzz {}\n") is None
+
+    def test_delete_record(self, db_path):
+        with open(db_path + db_module.JOURNAL_SUFFIX, "wb") as f:
+            f.write(db_module.encode_journal_record("usage", "device-1", {"count": 1}))
+            f.write(db_module.encode_journal_record("usage", "device-1", None))
+
+        db = Database(journal=True)
+        assert "device-1" not in db.data["usage"]
+
+    def test_checkpoint_folds_journal_into_snapshot(self, db_path, monkeypatch):
+        monkeypatch.setattr(db_module, "DB_CHECKPOINT_RECORDS", 3)
+        db = Database(journal=True)
+        db.increment_usage("device-1")
+        db.increment_usage("device-1")
+        db.increment_usage("device-1")  # 3rd record triggers a checkpoint
+
+        journal_path = db_path + db_module.JOURNAL_SUFFIX
+        assert os.path.getsize(journal_path) == 0
+        with open(db_path) as f:
+            assert json.load(f)["usage"]["device-1"]["count"] == 3
+
+        db.increment_usage("device-1")
+        assert os.path.getsize(journal_path) > 0
+        db2 = Database(journal=True)
+        assert db2.get_usage("device-1")["count"] == 4
+
+    def test_close_checkpoints(self, db_path):
+        db = Database(journal=True)
+        db.increment_usage("device-1")
+        db.close()
+
+        assert os.path.getsize(db_path + db_module.JOURNAL_SUFFIX) == 0
+        db2 = Database(journal=True)
+        assert db2.get_usage("device-1")["count"] == 1
+
+    def test_journal_follows_db_file_change(self, db_path, monkeypatch, tmp_path):
+        db = Database(journal=True)
+        db.increment_usage("device-1")
+        other = str(tmp_path / "other.json")
+        monkeypatch.setattr(db_module, "DB_FILE", other)
+        db.increment_usage("device-1")
+        assert os.path.exists(other + db_module.JOURNAL_SUFFIX)
+
+    def test_append_error_falls_back_to_save(self, db_path, monkeypatch):
+        db = Database(journal=True)
+
+        def bad_append(*_args):
+            raise OSError("disk full")
+
+        monkeypatch.setattr(db, "_append_journal", bad_append)
+        db.increment_usage("device-1")
+        with open(db_path) as f:
+            assert json.load(f)["usage"]["device-1"]["count"] == 1
+
+    def test_replay_error_is_handled(self, db_path, monkeypatch):
+        with open(db_path + db_module.JOURNAL_SUFFIX, "wb") as f:
+            f.write(db_module.encode_journal_record("missing_table", "k", {}))
+
+        db = Database(journal=True)
+        assert db.data["usage"] == {}
+
+
+    def test_batch_is_one_record(self, db_path):
+        db = Database(journal=True)
+        db.create_licenses({f"key{i}": {"user_id": "u@example.com"} for i in range(100)})
+        with open(db_path + db_module.JOURNAL_SUFFIX, "rb") as f:
+            lines = f.readlines()
+        assert len(lines) == 1
+        assert len(db_module.decode_journal_records(lines[0])) == 100
+
+        assert len(Database(journal=True).data["licenses"]) == 100
+
+    def test_cut_batch_is_not_applied(self, db_path):
+        db = Database(journal=True)
+        db.create_license("before", "u@example.com")
+        journal_path = db_path + db_module.JOURNAL_SUFFIX
+        good_size = os.path.getsize(journal_path)
+        db.create_licenses({f"key{i}": {"user_id": "u@example.com"} for i in range(100)})
+        db.revoke_licenses([f"key{i}" for i in range(100)])
+        os.truncate(journal_path, good_size + (os.path.getsize(journal_path) - good_size) // 4)
+
+        db2 = Database(journal=True)
+        assert list(db2.data["licenses"]) == ["before"]
+        assert os.path.getsize(journal_path) == good_size
+
+
+class TestGroupCommit:
+    @pytest.fixture
+    def db_path(self, monkeypatch, tmp_path):
+        path = str(tmp_path / "data.json")
+        monkeypatch.setattr(db_module, "DB_FILE", path)
+        return path
+
+    def test_unknown_fsync_policy_rejected(self, db_path):
+        with pytest.raises(ValueError):
+            Database(fsync="sometimes")
+
+    def test_burst_is_coalesced_into_few_writes(self, db_path, monkeypatch):
+        monkeypatch.setattr(db_module, "DB_FLUSH_MAX_PENDING", 10_000)
+        db = Database(flush_interval_ms=60_000)
+        saves = []
+        original_save = db.save
+        monkeypatch.setattr(db, "save", lambda: (saves.append(1), original_save()))
+
+        for _ in range(2000):
+            db.increment_usage("device-1")
+        assert len(saves) == 0  # nothing written synchronously
+
+        db.close()
+        assert len(saves) == 1
+        with open(db_path) as f:
+            assert json.load(f)["usage"]["device-1"]["count"] == 2000
+
+    def test_flusher_writes_in_background(self, db_path):
+        db = Database(flush_interval_ms=10)
+        db.increment_usage("device-1")
+        deadline = time.monotonic() + 2
+        while db.flush_count == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert db.flush_count >= 1
+        with open(db_path) as f:
+            assert json.load(f)["usage"]["device-1"]["count"] == 1
+        db.close()
+
+    def test_max_pending_triggers_early_flush(self, db_path, monkeypatch):
+        monkeypatch.setattr(db_module, "DB_FLUSH_MAX_PENDING", 5)
+        db = Database(flush_interval_ms=60_000)
+        for _ in range(5):
+            db.increment_usage("device-1")
+        deadline = time.monotonic() + 2
+        while db.flush_count == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert db.flush_count == 1
+        db.close()
+
+    def test_group_commit_with_journal(self, db_path):
+        db = Database(journal=True, flush_interval_ms=60_000, fsync="always")
+        db.increment_usage("device-1")
+        db.increment_usage("device-2")
+        db.increment_usage("device-1")
+        db.flush()
+        with open(db_path + db_module.JOURNAL_SUFFIX, "rb") as f:
+            lines = f.readlines()
+        assert len(lines) == 1  # one framed group holding a record per dirty key
+        assert len(db_module.decode_journal_records(lines[0])) == 2
+
+        db2 = Database(journal=True)
+        assert db2.get_usage("device-1")["count"] == 2
+        db.close()
+
+    def test_fsync_policies(self, db_path, monkeypatch):
+        synced = []
+        monkeypatch.setattr(db_module.os, "fsync", lambda fd: synced.append(fd))
+
+        Database(fsync="never").increment_usage("device-1")
+        assert synced == []
+
+        Database(fsync="always").increment_usage("device-1")
+        assert len(synced) == 1
+
+        monkeypatch.setattr(db_module, "DB_FSYNC_INTERVAL_MS", 60_000)
+        db = Database(journal=True, fsync="interval")
+        db.increment_usage("device-1")
+        db.increment_usage("device-1")
+        assert len(synced) == 1
+        assert db._unsynced is True
+
+    def test_flusher_syncs_outstanding_interval_writes(self, db_path, monkeypatch):
+        synced = []
+        monkeypatch.setattr(db_module.os, "fsync", lambda fd: synced.append(fd))
+        monkeypatch.setattr(db_module, "DB_FSYNC_INTERVAL_MS", 0)
+        db = Database(journal=True, flush_interval_ms=10, fsync="interval")
+        db._unsynced = True
+        db.increment_usage("device-1")
+        deadline = time.monotonic() + 2
+        while db._unsynced and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert synced
+        db.close()
+
+    def test_flusher_survives_errors(self, db_path, monkeypatch):
+        db = Database(flush_interval_ms=10)
+        calls = []
+
+        def bad_persist(_keys):
+            calls.append(1)
+            raise OSError("boom")
+
+        monkeypatch.setattr(db, "_persist", bad_persist)
+        db.increment_usage("device-1")
+        deadline = time.monotonic() + 2
+        while not calls and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert calls
+        monkeypatch.undo()
+        db._flusher.join(0)
+        assert db._flusher.is_alive()
+
+    def test_flush_without_changes_is_noop(self, db_path):
+        db = Database()
+        db.flush()
+        assert db.flush_count == 0
+
+
+class TestAsyncAPI:
+    @pytest.mark.anyio
+    async def test_async_methods_mirror_sync_api(self, mock_db):
+        await mock_db.acreate_license("key1", "user@example.com", plan="pro")
+        await mock_db.aupdate_license("key1", {"plan": "unlimited"})
+        assert (await mock_db.aget_license("key1"))["plan"] == "unlimited"
+        await mock_db.arevoke_license("key1")
+        assert mock_db.get_license("key1")["active"] is False
+
+        await mock_db.aincrement_usage("device-1")
+        await mock_db.aupdate_usage("device-1", {"email": "a@b.c"})
+        usage = await mock_db.aget_usage("device-1")
+        assert usage["count"] == 1
+        assert usage["email"] == "a@b.c"
+
+    @pytest.mark.anyio
+    async def test_calls_run_off_the_event_loop(self, mock_db):
+        loop_thread = threading.current_thread()
+        ran_on = await mock_db.run(threading.current_thread)
+        assert ran_on is not loop_thread
+        assert ran_on.name.startswith("db-io")
+
+    @pytest.mark.anyio
+    async def test_close_shuts_down_executor(self, mock_db):
+        await mock_db.aget_usage("device-1")
+        assert mock_db._io_executor is not None
+        mock_db.close()
+        assert mock_db._io_executor is None
+        # The executor is recreated on demand
+        assert (await mock_db.aget_usage("device-1"))["count"] == 0
+        mock_db.close()
+
+
+class TestLicenseIndexes:
+    def test_indexes_rebuilt_on_load_and_replay(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(db_module, "DB_FILE", str(tmp_path / "data.json"))
+        db = Database()
+        db.create_license("key1", "user@example.com", paypal_subscription_id="sub_1")
+        journaled = Database(journal=True)
+        journaled.create_license("key2", "user@example.com", paypal_subscription_id="sub_2")
+
+        reloaded = Database(journal=True)
+        assert set(reloaded.find_licenses(user_id="user@example.com")) == {"key1", "key2"}
+        assert list(reloaded.find_licenses(paypal_subscription_id="sub_2")) == ["key2"]
+
+    def test_lookup_skips_records_removed_behind_the_index(self, mock_db):
+        mock_db.create_license("key1", "user@example.com")
+        del mock_db.data["licenses"]["key1"]
+        assert mock_db.find_licenses(user_id="user@example.com") == {}
@@ -0,0 +1,316 @@
+import multiprocessing
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import db as db_module
+from db import Database, create_database
+from db_sqlite import SQLiteDatabase
+
+pytestmark = pytest.mark.unit
+
+
+class TestBackendContract:
+    def test_missing_license(self, store):
+        assert store.get_license("missing") is None
+
+    def test_create_license(self, store):
+        store.create_license(
+            "key1", "user@example.com", plan="pro", paypal_subscription_id="sub_1",
+            payment_method="paypal",
+        )
+        license_data = store.get_license("key1")
+        assert license_data["active"] is True
+        assert license_data["user_id"] == "user@example.com"
+        assert license_data["plan"] == "pro"
+        assert license_data["paypal_subscription_id"] == "sub_1"
+        assert license_data["payment_method"] == "paypal"
+        assert "start_date" in license_data and "created_at" in license_data
+
+    def test_license_without_optional_fields(self, store):
+        store.create_license("key1", "user@example.com")
+        license_data = store.get_license("key1")
+        assert "plan" not in license_data
+        assert (license_data.get("plan") or "standard") == "standard"
+
+    def test_update_and_revoke_license(self, store):
+        store.create_license("key1", "user@example.com")
+        store.update_license("key1", {"plan": "unlimited"})
+        assert store.get_license("key1")["plan"] == "unlimited"
+
+        store.revoke_license("key1")
+        assert store.get_license("key1")["active"] is False
+        store.update_license("missing", {"active": False})
+        assert store.get_license("missing") is None
+
+    def test_license_batches(self, store):
+        changes = []
+        store.add_listener(lambda table, key, fields: changes.append((key, fields)))
+        store.create_licenses({
+            "key1": {"user_id": "a@example.com", "plan": "pro"},
+            "key2": {"user_id": "b@example.com"},
+        })
+        assert store.get_license("key1")["plan"] == "pro"
+        assert store.get_license("key2")["active"] is True
+        assert [page[1] for page in store.scan_licenses()] == ["key1", "key2"]
+
+        assert store.revoke_licenses(["key2", "missing", "key1"]) == ["key2", "key1"]
+        assert store.get_license("key1")["active"] is False
+        assert store.get_license("missing") is None
+        assert store.update_licenses({"key1": {"plan": "unlimited"}}) == ["key1"]
+        assert store.get_license("key1")["plan"] == "unlimited"
+        assert store.update_licenses({"missing": {"plan": "pro"}}) == []
+        assert changes == [
+            ("key1", None), ("key2", None),
+            ("key2", ("active",)), ("key1", ("active",)),
+            ("key1", ("plan",)),
+        ]
+
+    def test_get_usage_defaults(self, store):
+        usage = store.get_usage("device-1")
+        assert usage["count"] == 0
+        assert usage["license_key"] is None
+        assert usage["last_used"] is None
+        assert "created_at" in usage
+
+    def test_merge_usage(self, store):
+        store.increment_usage("device-1")
+        last_used = store.get_usage("device-1")["last_used"]
+        store.merge_usage({
+            "device-1": (4, "2000-01-01T00:00:00"),
+            "device-2": (2, "2030-01-01T00:00:00"),
+        })
+        assert store.get_usage("device-1")["count"] == 5
+        assert store.get_usage("device-1")["last_used"] == last_used
+        assert store.get_usage("device-2")["count"] == 2
+        assert store.get_usage("device-2")["last_used"] == "2030-01-01T00:00:00"
+
+    def test_get_usage_does_not_store_unknown_devices(self, store):
+        store.get_usage("device-1")
+        assert store.stats()["usage"] == 0
+        store.update_usage("device-1", {"email": "a@b.c"})
+        assert store.stats()["usage"] == 1
+        assert store.get_usage("device-1")["count"] == 0
+
+    def test_increment_usage(self, store):
+        store.increment_usage("device-1")
+        store.increment_usage("device-1")
+        usage = store.get_usage("device-1")
+        assert usage["count"] == 2
+        assert usage["last_used"] is not None
+
+    def test_update_usage(self, store):
+        store.update_usage("device-1", {"license_key": "key1", "email": "a@b.c"})
+        store.update_usage("device-1", {"last_auto_apply_job_ids": ["1", "2"]})
+        usage = store.get_usage("device-1")
+        assert usage["license_key"] == "key1"
+        assert usage["email"] == "a@b.c"
+        assert usage["last_auto_apply_job_ids"] == ["1", "2"]
+        assert usage["count"] == 0
+
+    def test_find_licenses(self, store):
+        store.create_license("key1", "User@Example.com", paypal_subscription_id="sub_1",
+                             paypal_order_id="order_1")
+        store.create_license("key2", "user@example.com")
+        store.create_license("key3", "other@example.com", paypal_subscription_id="sub_2")
+
+        assert list(store.find_licenses(user_id="USER@example.com")) == ["key1", "key2"]
+        assert list(store.find_licenses(paypal_subscription_id="sub_1")) == ["key1"]
+        assert list(store.find_licenses(paypal_order_id="order_1")) == ["key1"]
+        assert list(store.find_licenses(
+            user_id="user@example.com", paypal_subscription_id="sub_2"
+        )) == []
+        assert store.find_licenses() == {}
+        assert store.find_licenses(paypal_subscription_id="sub_1")["key1"]["active"] is True
+
+    def test_find_licenses_follows_updates(self, store):
+        store.create_license("key1", "user@example.com", paypal_subscription_id="sub_1")
+        store.update_license("key1", {"paypal_subscription_id": "sub_9"})
+        assert store.find_licenses(paypal_subscription_id="sub_1") == {}
+        assert list(store.find_licenses(paypal_subscription_id="sub_9")) == ["key1"]
+
+    def test_scan_licenses(self, store):
+        for key, start in [("key1", "2026-03-01"), ("key2", "2026-01-01"),
+                           ("key3", "2026-02-01"), ("key4", "2026-02-01")]:
+            store.create_license(key, "user@example.com")
+            store.update_license(key, {"start_date": start})
+
+        page = store.scan_licenses(limit=2)
+        assert [key for _, key, _ in page] == ["key2", "key3"]
+        assert page[0][2]["user_id"] == "user@example.com"
+        page = store.scan_licenses(after=page[-1][:2], limit=2)
+        assert [key for _, key, _ in page] == ["key4", "key1"]
+        assert store.scan_licenses(after=page[-1][:2]) == []
+
+        page = store.scan_licenses("2026-02-01", "2026-03-01", reverse=True)
+        assert [key for _, key, _ in page] == ["key4", "key3"]
+        page = store.scan_licenses(after=("2026-02-01", "key4"), reverse=True)
+        assert [key for _, key, _ in page] == ["key3", "key2"]
+
+    def test_scan_usage(self, store):
+        for device, uses in [("d1", 3), ("d2", 1), ("d3", 2)]:
+            for _ in range(uses):
+                store.increment_usage(device)
+        store.update_usage("d2", {"last_used": "2026-01-01T00:00:00"})
+        store.merge_usage({"d4": (2, "2026-01-02T00:00:00")})
+
+        page = store.scan_usage("count", limit=2)
+        assert [(value, key) for value, key, _ in page] == [(1, "d2"), (2, "d3")]
+        page = store.scan_usage("count", after=page[-1][:2])
+        assert [(value, key) for value, key, _ in page] == [(2, "d4"), (3, "d1")]
+        assert page[-1][2]["count"] == 3
+        assert [k for _, k, _ in store.scan_usage("count", start=2, end=3)] == ["d3", "d4"]
+        assert [k for _, k, _ in store.scan_usage("count", reverse=True, limit=2)] == [
+            "d1", "d4",
+        ]
+
+        page = store.scan_usage("last_used", end="2026-02-01", reverse=True)
+        assert [key for _, key, _ in page] == ["d4", "d2"]
+
+        # Writes after the first scan keep the ordering current
+        store.increment_usage("d2")
+        store.update_usage("d3", {"count": 10})
+        assert [k for _, k, _ in store.scan_usage("count")] == ["d2", "d4", "d1", "d3"]
+
+        with pytest.raises(ValueError):
+            store.scan_usage("email")
+
+
+class TestSQLiteDatabase:
+    def test_wal_mode_and_indexes(self, tmp_path):
+        path = str(tmp_path / "data.db")
+        SQLiteDatabase(path)
+        conn = sqlite3.connect(path)
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        indexes = {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )}
+        assert {"idx_licenses_user_id", "idx_usage_last_used"} <= indexes
+
+    def test_instances_share_state(self, tmp_path):
+        path = str(tmp_path / "data.db")
+        first, second = SQLiteDatabase(path), SQLiteDatabase(path)
+        first.increment_usage("device-1")
+        second.increment_usage("device-1")
+        first.create_license("key1", "user@example.com")
+        assert first.get_usage("device-1")["count"] == 2
+        assert second.get_license("key1")["user_id"] == "user@example.com"
+
+    def test_failed_transaction_rolls_back(self, tmp_path):
+        store = SQLiteDatabase(str(tmp_path / "data.db"))
+        with pytest.raises(RuntimeError):
+            with store._transaction() as conn:
+                conn.execute(
+                    "INSERT INTO usage (device_fingerprint, count) VALUES ('d', 5)"
+                )
+                raise RuntimeError("boom")
+        assert store.get_usage("d")["count"] == 0
+
+    def test_stats(self, tmp_path):
+        store = SQLiteDatabase(str(tmp_path / "data.db"))
+        store.create_license("key1", "user@example.com")
+        store.increment_usage("device-1")
+        store.increment_usage("device-2")
+        assert store.stats() == {"backend": "sqlite", "licenses": 1, "usage": 2}
+
+    def test_close_is_idempotent(self, tmp_path):
+        store = SQLiteDatabase(str(tmp_path / "data.db"))
+        store.close()
+        store.close()
+        assert store.get_usage("device-1")["count"] == 0
+
+
+DEVICES = ("device-a", "device-b", "device-c")
+
+
+def _hammer(path: str, worker: int, increments: int):
+    """One 'uvicorn worker': several threads hitting shared devices"""
+    store = SQLiteDatabase(path)
+
+    def work(thread: int):
+        for i in range(increments):
+            store.increment_usage(DEVICES[i % len(DEVICES)])
+            store.update_usage(DEVICES[i % len(DEVICES)], {"email": f"w{worker}"})
+        store.create_license(f"key-{worker}-{thread}", f"user{worker}@example.com")
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(work, range(4)))
+    store.close()
+
+
+class TestMultiProcess:
+    def test_workers_never_lose_counts(self, tmp_path):
+        path = str(tmp_path / "shared.db")
+        SQLiteDatabase(path).close()  # create the schema once up front
+        workers, increments = 4, 150
+        ctx = multiprocessing.get_context("spawn")
+        processes = [
+            ctx.Process(target=_hammer, args=(path, worker, increments))
+            for worker in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(timeout=120)
+            assert process.exitcode == 0
+
+        store = SQLiteDatabase(path)
+        total = sum(store.get_usage(device)["count"] for device in DEVICES)
+        assert total == workers * 4 * increments
+        assert store.stats() == {
+            "backend": "sqlite",
+            "licenses": workers * 4,
+            "usage": len(DEVICES),
+        }
+        store.close()
+
+
+class TestCreateDatabase:
+    def test_backend_inferred_from_db_file(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(db_module, "DB_BACKEND", "")
+        monkeypatch.setattr(db_module, "DB_FILE", str(tmp_path / "data.sqlite"))
+        assert isinstance(create_database(), SQLiteDatabase)
+        monkeypatch.setattr(db_module, "DB_FILE", str(tmp_path / "data.json"))
+        assert isinstance(create_database(), Database)
+
+    def test_backend_from_env(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(db_module, "DB_FILE", str(tmp_path / "data.json"))
+        monkeypatch.setattr(db_module, "DB_BACKEND", "sqlite")
+        assert isinstance(create_database(), SQLiteDatabase)
+
+    def test_multiple_workers_need_a_shared_store(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(db_module, "DB_FILE", str(tmp_path / "data.json"))
+        with pytest.raises(ValueError, match="WEB_CONCURRENCY"):
+            create_database("json", workers=4)
+        monkeypatch.setattr(db_module, "WEB_CONCURRENCY", 4)
+        with pytest.raises(ValueError):
+            create_database()
+        assert isinstance(create_database("sqlite"), SQLiteDatabase)
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            create_database("postgres")
+
+    def test_base_interface_is_abstract(self):
+        base = db_module.BaseDatabase()
+        for call in (
+            lambda: base.get_license("k"),
+            lambda: base.create_license("k", "u"),
+            lambda: base.revoke_license("k"),
+            lambda: base.create_licenses({}),
+            lambda: base.revoke_licenses(["k"]),
+            lambda: base.find_licenses(user_id="u"),
+            lambda: base.scan_licenses(),
+            lambda: base.scan_usage("count"),
+            lambda: base.get_usage("d"),
+            lambda: base.increment_usage("d"),
+            lambda: base.update_usage("d", {}),
+            lambda: base.merge_usage({}),
+            lambda: base.stats(),
+            lambda: base.backup("dir"),
+            lambda: base.sweep_schema(),
+        ):
+            with pytest.raises(NotImplementedError):
+                call()
+        base.close()
@@ -0,0 +1,282 @@
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+
+import pytest
+
+import db as db_module
+import dbtool
+import snapshot
+from db import Database
+from db_sqlite import SQLiteDatabase
+
+pytestmark = pytest.mark.unit
+
+DATA = {
+    "licenses": {
+        "key1": {"active": True, "user_id": "a@b.c", "start_date": "2026-01-01T00:00:00",
+                 "created_at": "2026-01-01T00:00:00", "plan": "pro"},
+        "key2": {"active": False, "user_id": "c@d.e", "start_date": "2026-02-01T00:00:00",
+                 "created_at": "2026-02-01T00:00:00", "paypal_order_id": "o-1",
+                 "payment_method": "paypal"},
+    },
+    "usage": {
+        "device-1": {"count": 3, "license_key": "key1", "last_used": "2026-01-03T00:00:00",
+                     "created_at": "2026-01-01T00:00:00", "email": "a@b.c"},
+        "device-2": {"count": 0, "license_key": None, "last_used": None,
+                     "created_at": "2026-01-02T00:00:00",
+                     "last_auto_apply_job_ids": ["1", "2"], "note": ""},
+    },
+}
+
+
+def write_store(path, data=DATA):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def read_back(path):
+    tables = {"licenses": {}, "usage": {}}
+    for table, key, record in dbtool.READERS[dbtool.detect_format(path)](path):
+        tables[table][key] = record
+    return tables
+
+
+def test_detect_format():
+    assert dbtool.detect_format("x.sqlite3") == "sqlite"
+    assert dbtool.detect_format("x.jsonl") == "ndjson"
+    assert dbtool.detect_format("x.CSV") == "csv"
+    assert dbtool.detect_format("x.snap") == "snapshot"
+    with pytest.raises(ValueError):
+        dbtool.detect_format("x.txt")
+
+
+def test_roundtrip_through_every_format(tmp_path):
+    src = str(tmp_path / "src.json")
+    write_store(src)
+    chain = ["a.ndjson", "b.db", "c.csv", "d.json", "e.db"]
+    previous = src
+    for name in chain:
+        target = str(tmp_path / name)
+        assert dbtool.copy(previous, target, report=lambda message: None) == 4
+        assert read_back(target) == DATA, name
+        previous = target
+    assert not os.path.exists(str(tmp_path / "e.db") + dbtool.PROGRESS_SUFFIX)
+
+    # The JSON store written by the tool is loadable by the server
+    with open(str(tmp_path / "d.json")) as f:
+        assert json.load(f) == DATA
+
+
+def test_binary_snapshot_source(tmp_path):
+    src = str(tmp_path / "src.snap")
+    with open(src, "wb") as f:
+        f.write(snapshot.dumps(DATA))
+    dst = str(tmp_path / "out.ndjson")
+    dbtool.copy(src, dst, report=lambda message: None)
+    assert read_back(dst) == DATA
+
+    # .json files holding a binary snapshot are detected by their magic
+    os.replace(src, str(tmp_path / "binary.json"))
+    assert read_back(str(tmp_path / "binary.json")) == DATA
+
+
+def test_json_store_journal_is_folded_in(monkeypatch, tmp_path):
+    path = str(tmp_path / "live.json")
+    monkeypatch.setattr(db_module, "DB_FILE", path)
+    monkeypatch.setattr(db_module, "DB_CHECKPOINT_RECORDS", 10_000)
+    live = Database(journal=True)
+    live.create_license("key1", "a@b.c")
+    live.increment_usage("device-1")
+    live.checkpoint()
+    # Journal-only changes: an update, a new license and a deletion
+    live.increment_usage("device-1")
+    live.create_license("key2", "c@d.e")
+    live.increment_usage("device-2")
+    live._apply("usage", "device-2", None)
+    live._append_journal([("usage", "device-2")])
+
+    dst = str(tmp_path / "copy.db")
+    assert dbtool.copy(path, dst, report=lambda message: None) == 3
+    store = SQLiteDatabase(dst)
+    assert store.get_usage("device-1")["count"] == 2
+    assert store.get_license("key2")["user_id"] == "c@d.e"
+    assert store.stats()["usage"] == 1
+    store.close()
+    live.close()
+
+
+def test_checkpoint_during_read_is_retried(monkeypatch, tmp_path):
+    path = str(tmp_path / "live.json")
+    monkeypatch.setattr(db_module, "DB_FILE", path)
+    monkeypatch.setattr(db_module, "DB_CHECKPOINT_RECORDS", 10_000)
+    live = Database(journal=True)
+    live.increment_usage("device-1")
+    live.checkpoint()
+    live.increment_usage("device-1")
+
+    read_journal = dbtool.read_journal
+    calls = []
+
+    def racing_read_journal(journal_path):
+        calls.append(journal_path)
+        overrides = read_journal(journal_path)
+        if len(calls) == 1:
+            live.increment_usage("device-1")
+            live.checkpoint()
+        return overrides
+
+    monkeypatch.setattr(dbtool, "read_journal", racing_read_journal)
+    records = list(dbtool.read_json_store(path))
+    assert [record["count"] for _, _, record in records] == [3]
+    assert len(calls) == 2
+
+    monkeypatch.setattr(dbtool, "JOURNAL_READ_ATTEMPTS", 1)
+    calls.clear()
+    with pytest.raises(ValueError):
+        list(dbtool.read_json_store(path))
+    live.close()
+
+
+def test_journal_only_tables_are_emitted(tmp_path):
+    path = str(tmp_path / "db.json")
+    write_store(path, {"licenses": {}})
+    with open(path + db_module.JOURNAL_SUFFIX, "wb") as f:
+        f.write(db_module.encode_journal_record("usage", "device-1", {"count": 1}))
+        f.write(db_module.encode_journal_record("licenses", "key1", {"active": True}))
+    assert list(dbtool.read_json_store(path)) == [
+        ("licenses", "key1", {"active": True}),
+        ("usage", "device-1", {"count": 1}),
+    ]
+
+
+@pytest.mark.parametrize("dst_name", ["out.ndjson", "out.csv", "out.db"])
+def test_resume_after_crash(monkeypatch, tmp_path, dst_name):
+    src = str(tmp_path / "src.json")
+    usage = {f"device-{i}": {"count": i, "license_key": None, "last_used": None,
+                             "created_at": None} for i in range(25)}
+    write_store(src, {"licenses": {}, "usage": usage})
+    dst = str(tmp_path / dst_name)
+
+    real_reader = dbtool.READERS["json"]
+
+    def crashing_reader(path):
+        for i, record in enumerate(real_reader(path)):
+            if i == 17:
+                raise KeyboardInterrupt
+            yield record
+
+    monkeypatch.setitem(dbtool.READERS, "json", crashing_reader)
+    with pytest.raises(KeyboardInterrupt):
+        dbtool.copy(src, dst, checkpoint_every=5, report=lambda message: None)
+    with open(dst + dbtool.PROGRESS_SUFFIX) as f:
+        assert json.load(f)["records"] == 15
+
+    monkeypatch.setitem(dbtool.READERS, "json", real_reader)
+    messages = []
+    assert dbtool.copy(src, dst, resume=True, checkpoint_every=5,
+                       report=messages.append) == 25
+    assert messages[0] == "Resuming after 15 records"
+    assert read_back(dst)["usage"] == usage
+    if dst_name.endswith(".ndjson"):
+        with open(dst) as f:
+            assert len(f.readlines()) == 25  # nothing written twice
+    assert not os.path.exists(dst + dbtool.PROGRESS_SUFFIX)
+
+
+def test_resume_checks_source(tmp_path):
+    src = str(tmp_path / "src.json")
+    write_store(src)
+    dst = str(tmp_path / "out.ndjson")
+    with open(dst + dbtool.PROGRESS_SUFFIX, "w") as f:
+        json.dump({"src": "/elsewhere.json", "records": 1, "state": {"offset": 0}}, f)
+    with pytest.raises(ValueError):
+        dbtool.copy(src, dst, resume=True, report=lambda message: None)
+
+    messages = []
+    dbtool.copy(src, str(tmp_path / "fresh.ndjson"), resume=True, report=messages.append)
+    assert messages[0].startswith("Nothing to resume")
+
+
+def test_resume_refuses_a_changed_source(monkeypatch, tmp_path):
+    src = str(tmp_path / "src.json")
+    write_store(src)
+    dst = str(tmp_path / "out.ndjson")
+    real_reader = dbtool.READERS["json"]
+
+    def crashing_reader(path):
+        for i, record in enumerate(real_reader(path)):
+            if i == 2:
+                raise KeyboardInterrupt
+            yield record
+
+    monkeypatch.setitem(dbtool.READERS, "json", crashing_reader)
+    with pytest.raises(KeyboardInterrupt):
+        dbtool.copy(src, dst, checkpoint_every=1, report=lambda message: None)
+    monkeypatch.setitem(dbtool.READERS, "json", real_reader)
+
+    # A license added between runs would be skipped by a count-based resume
+    with open(src + db_module.JOURNAL_SUFFIX, "wb") as f:
+        f.write(db_module.encode_journal_record("licenses", "L2", {"active": True}))
+    with pytest.raises(ValueError, match="changed since the interrupted copy"):
+        dbtool.copy(src, dst, resume=True, report=lambda message: None)
+    assert dbtool.copy(src, dst, report=lambda message: None) == 5
+
+
+def test_streaming_memory_is_bounded(tmp_path):
+    src = str(tmp_path / "big.json")
+    usage = {
+        f"device-{i:06d}-{'f' * 40}": {"count": i, "license_key": None,
+                                       "last_used": "2026-01-01T00:00:00",
+                                       "created_at": "2026-01-01T00:00:00"}
+        for i in range(20_000)
+    }
+    write_store(src, {"licenses": {}, "usage": usage})
+    del usage
+    dst = str(tmp_path / "big.ndjson")
+
+    tracemalloc.start()
+    dbtool.copy(src, dst, report=lambda message: None)
+    _size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert os.path.getsize(src) > 3_000_000
+    assert peak < 1_000_000
+
+
+def test_cli(tmp_path, capsys):
+    src = str(tmp_path / "src.json")
+    write_store(src)
+    dst = str(tmp_path / "out.csv")
+    assert dbtool.main(["export", src, dst, "--checkpoint-every", "1"]) == 0
+    assert "Copied 4 records" in capsys.readouterr().out
+    assert dbtool.main(["import", dst, str(tmp_path / "in.db")]) == 0
+    assert dbtool.main(["migrate", str(tmp_path / "in.db"), str(tmp_path / "x.json")]) == 0
+    assert read_back(str(tmp_path / "x.json")) == DATA
+
+    for argv in (
+        ["export", src, str(tmp_path / "x.db")],
+        ["import", src, str(tmp_path / "x.db")],
+    ):
+        with pytest.raises(SystemExit):
+            dbtool.main(argv)
+    with pytest.raises(ValueError):
+        dbtool.copy(src, str(tmp_path / "x.snap"))
+
+
+def test_import_leaves_the_live_store_alone(tmp_path):
+    path = str(tmp_path / "live.json")
+    write_store(path, {"usage": {}})
+    torn = db_module.encode_journal_record("usage", "device-1", {"count": 1})[:-3]
+    with open(path + db_module.JOURNAL_SUFFIX, "wb") as f:
+        f.write(torn)
+    env = dict(os.environ, DB_FILE=path, DB_JOURNAL="1", DB_HOT_USAGE_RECORDS="10")
+    subprocess.run(
+        [sys.executable, "-c", "import dbtool, db; assert 'db' not in vars(db)"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env, check=True,
+    )
+    with open(path + db_module.JOURNAL_SUFFIX, "rb") as f:
+        assert f.read() == torn
+    assert not [name for name in os.listdir(tmp_path) if ".cold" in name]
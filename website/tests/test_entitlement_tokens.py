@@ -0,0 +1,85 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import entitlement_tokens as tokens_module
+from entitlement_tokens import EntitlementTokens
+
+pytestmark = pytest.mark.unit
+
+
+def entitlement(license_key="key1", plan="pro", whitelisted=False):
+    license = SimpleNamespace(plan=plan) if license_key else None
+    return SimpleNamespace(
+        license_key=license_key,
+        license=license,
+        whitelisted=whitelisted,
+        unlimited_auto_apply=plan == "pro",
+    )
+
+
+@pytest.fixture
+def tokens():
+    return EntitlementTokens(lambda: "secret", ttl=60, epoch=3)
+
+
+def test_roundtrip(tokens):
+    issued = tokens.issue("device-1", entitlement(whitelisted=True))
+    claims, reason = tokens.verify(issued["token"], "device-1")
+    assert reason is None
+    assert claims["lic"] == "key1"
+    assert claims["plan"] == "pro"
+    assert claims["wl"] is True
+    assert claims["unl"] is True
+    assert claims["exp"] == issued["expires_at"]
+
+    unlicensed = tokens.issue("device-2", entitlement(license_key=None))["token"]
+    assert tokens.verify(unlicensed, "device-2")[0]["plan"] is None
+
+
+def test_rejections(tokens, monkeypatch):
+    token = tokens.issue("device-1", entitlement())["token"]
+    payload, signature = token.split(".")
+    assert tokens.verify(token, "device-2") == (None, "Token issued for another device")
+    assert tokens.verify(payload + "." + signature[::-1], "device-1")[1] == (
+        "Invalid token signature"
+    )
+    for malformed in ("", "a.b.c", None):
+        assert tokens.verify(malformed, "device-1") == (None, "Malformed token")
+    other_secret = EntitlementTokens(lambda: "other", ttl=60, epoch=3)
+    assert other_secret.verify(token, "device-1")[1] == "Invalid token signature"
+    next_epoch = EntitlementTokens(lambda: "secret", ttl=60, epoch=4)
+    assert next_epoch.verify(token, "device-1")[1] == "Token revoked"
+
+    now = time.time()
+    monkeypatch.setattr(tokens_module.time, "time", lambda: now + 90)
+    assert tokens.verify(token, "device-1") == (None, "Token expired")
+    assert tokens.verify(token, "device-1", grace=60)[1] is None
+
+
+def test_changes_revoke_earlier_tokens(tokens, monkeypatch):
+    before = time.time()
+    license_token = tokens.issue("device-1", entitlement(), before)["token"]
+    device_token = tokens.issue("device-2", entitlement(license_key=None), before)["token"]
+
+    tokens.revoke("licenses", "key1")
+    tokens.revoke("usage", "device-2")
+    assert tokens.verify(license_token, "device-1")[1] == "Token revoked"
+    assert tokens.verify(device_token, "device-2")[1] == "Token revoked"
+
+    # Tokens issued after the change are fine
+    monkeypatch.setattr(tokens_module.time, "time", lambda: before + 1)
+    fresh = tokens.issue("device-1", entitlement())["token"]
+    assert tokens.verify(fresh, "device-1")[1] is None
+
+
+def test_old_revocations_are_pruned(tokens, monkeypatch):
+    now = time.time()
+    tokens.revoke("licenses", "key1")
+    tokens.revoke("licenses", "key2")
+    tokens.revoke("licenses", "key1")
+    assert len(tokens) == 2
+    monkeypatch.setattr(tokens_module.time, "time", lambda: now + 121)
+    tokens.revoke("usage", "device-1")
+    assert len(tokens) == 1
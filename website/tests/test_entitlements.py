@@ -0,0 +1,237 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import db as db_module
+from db import create_database
+from entitlements import Entitlements, LicenseEntitlement
+
+pytestmark = pytest.mark.unit
+
+PERIOD = timedelta(days=31)
+
+
+def whitelisted(email):
+    return email.lower() == "owner@example.com"
+
+
+class Recording:
+    """Delegates to a store, recording the reads made through it"""
+
+    def __init__(self, store):
+        self.store = store
+        self.reads = []
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def get_license(self, license_key):
+        self.reads.append(license_key)
+        return self.store.get_license(license_key)
+
+    def get_usage(self, device_fingerprint):
+        self.reads.append(device_fingerprint)
+        return self.store.get_usage(device_fingerprint)
+
+
+@pytest.fixture
+def counted(store):
+    """Entitlements over `store`, and the database reads they make"""
+    recording = Recording(store)
+    entitlements = Entitlements(lambda: recording, whitelisted, PERIOD, capacity=100, ttl=60)
+    return entitlements, recording.reads
+
+
+def test_license_entitlement_window():
+    start = datetime(2026, 1, 1)
+    entitlement = LicenseEntitlement(
+        "key1",
+        {"user_id": "Owner@example.com", "active": True, "start_date": start.isoformat(),
+         "plan": "pro"},
+        PERIOD,
+        whitelisted,
+    )
+    assert entitlement.whitelisted is True
+    assert entitlement.unlimited_auto_apply is True
+    assert entitlement.rejection(now=(start + timedelta(days=30)).timestamp()) is None
+    assert entitlement.rejection(now=(start + timedelta(days=32)).timestamp()) == (
+        "License expired"
+    )
+
+    inactive = LicenseEntitlement("key2", {"active": False}, PERIOD, whitelisted)
+    assert inactive.rejection() == "License inactive"
+    assert inactive.plan == "standard"
+    expired = LicenseEntitlement("key4", {"active": False, "status": "expired"}, PERIOD, whitelisted)
+    assert expired.rejection() == "License expired"
+    broken = LicenseEntitlement("key3", {"active": True, "start_date": "soon"}, PERIOD, whitelisted)
+    assert broken.rejection() == "Validation error: invalid start_date"
+
+
+def test_hits_skip_the_database(store, counted):
+    entitlements, reads = counted
+    store.create_license("key1", "owner@example.com", plan="unlimited")
+    store.update_usage("device-1", {"license_key": "key1"})
+
+    for _ in range(3):
+        device = entitlements.device("device-1")
+        assert device.whitelisted is True
+        assert device.unlimited_auto_apply is True
+        assert entitlements.license("key1") is device.license
+    assert reads == ["device-1", "key1"]
+    assert entitlements.stats()["hits"] == 5
+
+
+def test_counter_bumps_keep_entries(store, counted):
+    entitlements, reads = counted
+    entitlements.device("device-1")
+    store.increment_usage("device-1")
+    store.merge_usage({"device-1": (2, datetime.now().isoformat())})
+    store.update_usage("device-1", {"last_used": datetime.now().isoformat()})
+    entitlements.device("device-1")
+    assert reads == ["device-1"]
+
+
+def test_usage_changes_invalidate_the_device(store, counted):
+    entitlements, reads = counted
+    assert entitlements.device("device-1").whitelisted is False
+    store.update_usage("device-1", {"email": "owner@example.com"})
+    assert entitlements.device("device-1").whitelisted is True
+    assert reads == ["device-1", "device-1"]
+
+
+def test_license_changes_invalidate_dependent_devices(store, counted):
+    entitlements, reads = counted
+    store.update_usage("device-1", {"license_key": "key1"})
+    # Unknown license: cached as missing until it is created
+    assert entitlements.device("device-1").license is None
+    assert entitlements.license("key1") is None
+
+    store.create_license("key1", "user@example.com", plan="pro")
+    assert entitlements.device("device-1").unlimited_auto_apply is True
+
+    store.update_license("key1", {"active": False})
+    assert entitlements.license("key1").rejection() == "License inactive"
+    assert entitlements.device("device-1").unlimited_auto_apply is False
+    assert reads.count("key1") == 3
+
+
+def test_entries_expire(store, monkeypatch):
+    import entitlements as entitlements_module
+
+    entitlements = Entitlements(lambda: store, whitelisted, PERIOD, capacity=10, ttl=5)
+    entitlements.device("device-1")
+    now = entitlements_module.time.monotonic()
+    monkeypatch.setattr(entitlements_module.time, "monotonic", lambda: now + 10)
+    entitlements.device("device-1")
+    assert entitlements.stats()["misses"] == 2
+
+
+def test_capacity_is_bounded(store):
+    store.create_license("key1", "user@example.com")
+    entitlements = Entitlements(lambda: store, whitelisted, PERIOD, capacity=2, ttl=60)
+    for i in range(3):
+        store.update_usage(f"device-{i}", {"license_key": "key1"})
+        entitlements.device(f"device-{i}")
+    assert entitlements.stats()["devices"] == 2
+    assert entitlements._dependents == {"key1": {"device-1", "device-2"}}
+
+    uncached = Entitlements(lambda: store, whitelisted, PERIOD, capacity=0, ttl=60)
+    uncached.device("device-0")
+    assert uncached.stats()["devices"] == 0
+
+
+def test_license_change_right_after_caching_a_device(store):
+    store.create_license("key1", "user@example.com")
+    store.update_usage("device-1", {"license_key": "key1"})
+    entitlements = Entitlements(lambda: store, whitelisted, PERIOD, capacity=10, ttl=60)
+    put = entitlements._put
+
+    def racing_put(table, key, value, version, capacity):
+        stored = put(table, key, value, version, capacity)
+        if table is entitlements._devices:
+            store.update_license("key1", {"active": False})
+        return stored
+
+    entitlements._put = racing_put
+    assert entitlements.device("device-1").license.active is True
+    entitlements._put = put
+    assert entitlements.device("device-1").license.active is False
+    assert entitlements._dependents == {"key1": {"device-1"}}
+
+
+def test_unknown_keys_cannot_evict_entitlements(store):
+    store.create_license("key1", "user@example.com")
+    store.update_usage("device-1", {"license_key": "key1"})
+    entitlements = Entitlements(
+        lambda: store, whitelisted, PERIOD, capacity=2, ttl=60, negative_capacity=3
+    )
+    entitlements.device("device-1")
+    for i in range(10):
+        assert entitlements.device(f"random-{i}").license is None
+        assert entitlements.license(f"random-{i}") is None
+    assert entitlements.stats()["devices"] == 1
+    assert entitlements.stats()["licenses"] == 1
+    assert entitlements.stats()["unknown"] == 6
+
+    misses = entitlements.stats()["misses"]
+    entitlements.device("device-1")
+    entitlements.device("random-9")
+    assert entitlements.stats()["misses"] == misses
+
+    # Becoming known moves them out of the negative cache
+    store.update_usage("random-9", {"email": "owner@example.com"})
+    store.create_license("random-9", "user@example.com")
+    assert entitlements.device("random-9").whitelisted is True
+    assert entitlements.license("random-9") is not None
+    assert entitlements.stats()["devices"] == 2
+
+
+def test_changes_during_a_load_are_not_cached(store):
+    entitlements = Entitlements(lambda: store, whitelisted, PERIOD, capacity=10, ttl=60)
+    entitlements.device("device-0")  # attach the listener
+    get_usage = store.get_usage
+
+    def racing_get_usage(key):
+        store.get_usage = get_usage
+        usage = get_usage(key)
+        store.update_usage(key, {"email": "owner@example.com"})
+        return usage
+
+    store.get_usage = racing_get_usage
+    assert entitlements.device("device-1").whitelisted is False
+    assert entitlements.device("device-1").whitelisted is True
+
+
+def test_follows_a_swapped_database(monkeypatch, tmp_path):
+    monkeypatch.setattr(db_module, "DB_FILE", str(tmp_path / "a.json"))
+    first = create_database("json")
+    monkeypatch.setattr(db_module, "DB_FILE", str(tmp_path / "b.json"))
+    second = create_database("json")
+    second.update_usage("device-1", {"email": "owner@example.com"})
+
+    active = [first]
+    entitlements = Entitlements(lambda: active[0], whitelisted, PERIOD)
+    assert entitlements.device("device-1").whitelisted is False
+    active[0] = second
+    assert entitlements.device("device-1").whitelisted is True
+
+
+def test_listener_errors_are_contained(store, capsys):
+    def broken(table, key, fields):
+        raise RuntimeError("boom")
+
+    store.add_listener(broken)
+    store.increment_usage("device-1")
+    assert store.get_usage("device-1")["count"] == 1
+    assert "Error in change listener: boom" in capsys.readouterr().out
+
+
+@pytest.mark.anyio
+async def test_async_lookups(store):
+    store.create_license("key1", "user@example.com")
+    entitlements = Entitlements(lambda: store, whitelisted, PERIOD)
+    assert (await entitlements.alicense("key1")).user_id == "user@example.com"
+    assert (await entitlements.alicense("key1")).user_id == "user@example.com"
+    assert (await entitlements.adevice("device-1")).license is None
+    assert (await entitlements.adevice("device-1")).license is None
+    assert entitlements.stats()["hits"] == 2
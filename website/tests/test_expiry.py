@@ -0,0 +1,114 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from entitlements import Entitlements
+from expiry import ExpiryScheduler
+
+pytestmark = pytest.mark.unit
+
+PERIOD = timedelta(days=31)
+START = datetime.now().replace(microsecond=0)
+EXPIRES = (START + PERIOD).timestamp()
+HOUR = 3600
+
+
+def add_license(store, key, start=START, **fields):
+    store.create_license(key, f"{key}@example.com")
+    store.update_license(key, {"start_date": start.isoformat(), **fields})
+
+
+@pytest.fixture
+def scheduler(store):
+    add_license(store, "key1")
+    add_license(store, "key2", START + timedelta(days=1))
+    add_license(store, "inactive", active=False)
+    scheduler = ExpiryScheduler(lambda: store, PERIOD, warning_hours=24, batch_size=2)
+    events = []
+    scheduler.subscribe(lambda event, key, expires_at: events.append((event, key)))
+    scheduler.load()
+    return scheduler, events
+
+
+def test_load_schedules_active_licenses(scheduler):
+    scheduler, _ = scheduler
+    stats = scheduler.stats()
+    assert stats["active_licenses"] == 2
+    assert stats["next_expiry"] == (START + PERIOD).isoformat()
+
+
+def test_expires_licenses_when_due(store, scheduler):
+    scheduler, events = scheduler
+    entitlements = Entitlements(lambda: store, lambda email: False, PERIOD)
+    assert entitlements.license("key1").rejection(now=EXPIRES - 1) is None
+
+    assert scheduler.run_due(now=EXPIRES - 25 * HOUR) == 0
+    assert events == []
+    assert scheduler.run_due(now=EXPIRES - 23 * HOUR) == 0
+    assert events == [("expiring", "key1")]
+
+    assert scheduler.run_due(now=EXPIRES + 1) == 1
+    # key2 expires a day later, so its warning is due too
+    assert events[1:] == [("expired", "key1"), ("expiring", "key2")]
+    record = store.get_license("key1")
+    assert record["active"] is False
+    assert record["status"] == "expired"
+    # The cached entitlement was invalidated by the update
+    assert entitlements.license("key1").rejection(now=EXPIRES - 1) == "License expired"
+    stats = scheduler.stats()
+    assert (stats["active_licenses"], stats["expired"], stats["warned"]) == (1, 1, 2)
+
+
+def test_renewals_and_revocations_reschedule(store, scheduler):
+    scheduler, events = scheduler
+    store.update_license("key1", {"start_date": (START + timedelta(days=10)).isoformat()})
+    store.update_license("key2", {"active": False})
+    add_license(store, "key3")
+
+    # Scheduled past its warning time: no warning, only the expiry
+    assert scheduler.run_due(now=EXPIRES + 1) == 1
+    assert events == [("expired", "key3")]
+    assert store.get_license("key1")["active"] is True
+    assert store.get_license("key2").get("status") is None
+    assert scheduler.stats()["active_licenses"] == 1
+
+
+def test_changes_missed_by_the_listener_are_rechecked(store, scheduler):
+    scheduler, events = scheduler
+    # Renewed behind the scheduler's back, e.g. by another process
+    store._listeners = ()
+    store.update_license("key1", {"start_date": (START + timedelta(days=10)).isoformat()})
+
+    assert scheduler.run_due(now=EXPIRES + 1) == 0
+    assert store.get_license("key1")["active"] is True
+    assert scheduler.stats()["active_licenses"] == 2
+
+
+def test_subscriber_errors_are_contained(scheduler, capsys):
+    scheduler, events = scheduler
+
+    def broken(event, key, expires_at):
+        raise RuntimeError("boom")
+
+    scheduler.subscribe(broken)
+    assert scheduler.run_due(now=EXPIRES + 1) == 1
+    assert ("expired", "key1") in events
+    assert "Error in expiry subscriber: boom" in capsys.readouterr().out
+
+
+def test_thread_expires_overdue_licenses(store):
+    add_license(store, "old", datetime.now() - PERIOD - timedelta(days=1))
+    add_license(store, "current", datetime.now())
+    scheduler = ExpiryScheduler(lambda: store, PERIOD).start()
+    try:
+        store.update_license("current", {"start_date": (datetime.now() - PERIOD * 2).isoformat()})
+        for _ in range(200):
+            if not store.get_license("current")["active"]:
+                break
+            time.sleep(0.01)
+    finally:
+        scheduler.stop()
+    assert store.get_license("old")["status"] == "expired"
+    assert store.get_license("current")["status"] == "expired"
+    assert scheduler.stats()["active_licenses"] == 0
@@ -0,0 +1,151 @@
+import random
+
+import pytest
+
+from indexes import HashIndex, LicenseIndexes, SortedIndex, UsageIndexes
+
+pytestmark = pytest.mark.unit
+
+
+def test_hash_index_update_and_discard():
+    index = HashIndex()
+    index.update("k1", "a")
+    index.update("k2", "a")
+    index.update("k3", "b")
+    assert index.get("a") == {"k1", "k2"}
+    assert len(index) == 3
+
+    index.update("k1", "b")
+    index.update("k1", "b")  # unchanged value is a no-op
+    assert index.get("a") == {"k2"}
+    assert index.get("b") == {"k1", "k3"}
+
+    index.update("k2", None)
+    assert index.get("a") == set()
+    index.discard("missing")
+    index.clear()
+    assert len(index) == 0
+
+
+def test_hash_index_get_returns_copy():
+    index = HashIndex()
+    index.update("k1", "a")
+    index.get("a").add("k2")
+    assert index.get("a") == {"k1"}
+
+
+def test_sorted_index_range_scans():
+    index = SortedIndex()
+    for key, value in [("k1", "2026-01-03"), ("k2", "2026-01-01"), ("k3", "2026-01-02")]:
+        index.update(key, value)
+
+    assert [k for _, k in index.range()] == ["k2", "k3", "k1"]
+    assert [k for _, k in index.range("2026-01-02")] == ["k3", "k1"]
+    assert [k for _, k in index.range(None, "2026-01-03")] == ["k2", "k3"]
+    assert [k for _, k in index.range(reverse=True)] == ["k1", "k3", "k2"]
+
+
+def test_sorted_index_reindex_and_discard():
+    index = SortedIndex()
+    index.update("k1", 5)
+    index.update("k2", 1)
+    index.update("k1", 5)
+    index.update("k1", 0)
+    assert list(index.range()) == [(0, "k1"), (1, "k2")]
+
+    index.update("k2", None)
+    index.discard("missing")
+    assert list(index.range()) == [(0, "k1")]
+    index.clear()
+    assert len(index) == 0
+
+
+def test_license_indexes_rebuild():
+    indexes = LicenseIndexes()
+    indexes.rebuild(
+        {
+            "k1": {"user_id": "User@Example.com", "paypal_subscription_id": "sub_1",
+                   "start_date": "2026-01-01"},
+            "k2": {"user_id": "user@example.com", "paypal_order_id": "order_1"},
+        }
+    )
+    assert indexes.user_id.get("user@example.com") == {"k1", "k2"}
+    assert indexes.paypal_subscription_id.get("sub_1") == {"k1"}
+    assert indexes.paypal_order_id.get("order_1") == {"k2"}
+    assert len(indexes.start_date) == 1
+
+    indexes.update("k1", None)
+    assert indexes.user_id.get("user@example.com") == {"k2"}
+
+
+def test_sorted_index_keyset_pages():
+    index = SortedIndex()
+    index.load([(f"k{i}", i % 3) for i in range(7)] + [("none", None)])
+    assert len(index) == 7
+
+    first = index.page(limit=3)
+    assert first == [(0, "k0"), (0, "k3"), (0, "k6")]
+    second = index.page(after=first[-1], limit=3)
+    assert second == [(1, "k1"), (1, "k4"), (2, "k2")]
+    assert index.page(start=1, end=2) == [(1, "k1"), (1, "k4")]
+    assert index.page(after=(2, "k5")) == []
+
+    # Descending pages walk back from the upper bound
+    assert index.page(end=2, limit=2, reverse=True) == [(1, "k4"), (1, "k1")]
+    assert index.page(end=2, after=(1, "k1"), limit=2, reverse=True) == [
+        (0, "k6"), (0, "k3"),
+    ]
+
+    # Rows inserted behind the cursor do not shift the next page
+    index.update("a", 0)
+    assert index.page(after=(0, "k6"), limit=1) == [(1, "k1")]
+
+
+def test_sorted_index_chunks_match_a_sorted_list():
+    rng = random.Random(5)
+    index = SortedIndex(chunk_size=4)
+    expected = {}
+    for step in range(2000):
+        key = f"k{rng.randrange(60)}"
+        if rng.random() < 0.2:
+            index.discard(key)
+            expected.pop(key, None)
+        else:
+            value = rng.randrange(20)
+            index.update(key, value)
+            expected[key] = value
+        if step % 100 == 0:
+            index.load(list(expected.items()))
+    entries = sorted((value, key) for key, value in expected.items())
+
+    assert len(index) == len(entries)
+    assert all(len(chunk) <= 8 for chunk in index._chunks)
+    assert list(index.range()) == entries
+    assert list(index.range(5, 12, reverse=True)) == [e for e in entries if 5 <= e[0] < 12][::-1]
+    pages, after = [], None
+    while True:
+        page = index.page(start=3, after=after, limit=7)
+        if not page:
+            break
+        pages += page
+        after = page[-1]
+    assert pages == [e for e in entries if e[0] >= 3]
+    assert index.page(end=10, after=entries[20], limit=5, reverse=True) == (
+        [e for e in entries if e < entries[20] and e[0] < 10][::-1][:5]
+    )
+
+
+def test_usage_indexes():
+    indexes = UsageIndexes()
+    indexes.rebuild({
+        "d1": {"count": 5, "last_used": "2026-01-02"},
+        "d2": {"count": 1, "last_used": "2026-01-03"},
+        "d3": {"count": "bad", "last_used": None},
+    })
+    assert [k for _, k in indexes.count.page()] == ["d2", "d1"]
+    assert [k for _, k in indexes.last_used.page()] == ["d1", "d2"]
+
+    indexes.update("d3", {"count": 9, "last_used": "2026-01-01"})
+    indexes.update("d2", None)
+    assert [k for _, k in indexes.count.page()] == ["d1", "d3"]
+    assert [k for _, k in indexes.last_used.page()] == ["d3", "d1"]
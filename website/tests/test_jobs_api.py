@@ -1,59 +1,40 @@
+import httpx
 import pytest
-import types
+
 import api
+from upstream import UpstreamClients
 
 
 pytestmark = pytest.mark.integration
 
 
-class DummyResponse:
-    def __init__(self, payload):
-        self._payload = payload
-        self.status_code = 200
-
-    def json(self):
-        return self._payload
-
-    def raise_for_status(self):
-        return None
-
-
-class DummyClient:
-    def __init__(self, *args, **kwargs):
-        self._response = DummyResponse(
-            {
-                "results": [
-                    {
-                        "id": "1",
-                        "title": "Software Engineer",
-                        "company": "Acme",
-                        "location": "Remote",
-                        "url": "https://example.com/job/1",
-                        "source": "dummy",
-                        "remote": True,
-                    }
-                ]
-            }
-        )
-
-    async def __aenter__(self):
-        return self
-
-    async def __aexit__(self, exc_type, exc, tb):
-        return False
-
-    async def get(self, url, params=None, headers=None):
-        return self._response
+JOBS_PAYLOAD = {
+    "results": [
+        {
+            "id": "1",
+            "title": "Software Engineer",
+            "company": "Acme",
+            "location": "Remote",
+            "url": "https://example.com/job/1",
+            "source": "dummy",
+            "remote": True,
+        }
+    ]
+}
 
 
 @pytest.mark.anyio
 async def test_fetch_jobs_uses_external_api(monkeypatch):
     monkeypatch.setattr(api, "JOB_API_BASE_URL", "https://jobs.example.com")
     monkeypatch.setattr(api, "JOB_API_KEY", "key")
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json=JOBS_PAYLOAD)
+
     monkeypatch.setattr(
-        api,
-        "httpx",
-        types.SimpleNamespace(AsyncClient=DummyClient),
+        api, "upstream", UpstreamClients(transport=httpx.MockTransport(handler))
     )
     request = api.JobSearchRequest(
         query="engineer",
@@ -67,6 +48,10 @@ async def test_fetch_jobs_uses_external_api(monkeypatch):
     assert job.title == "Software Engineer"
     assert job.company == "Acme"
     assert job.remote is True
+    assert requests[0].headers["authorization"] == "Bearer key"
+    assert requests[0].url.params["q"] == "engineer"
+    assert requests[0].url.params["remote"] == "true"
+    await api.upstream.aclose()
 
 
 def test_search_jobs_endpoint_returns_empty_when_api_disabled(client, monkeypatch):
@@ -203,16 +188,31 @@ def test_auto_apply_unlimited_with_paid_license(client, mock_db, monkeypatch):
     assert data["unlimited"] is True
 
 
-def test_has_unlimited_auto_apply_missing_license(monkeypatch, mock_db):
-    monkeypatch.setattr(api, "db", mock_db)
-    result = api.has_unlimited_auto_apply("missing")
-    assert result is False
-
-
-def test_has_unlimited_auto_apply_inactive_license(monkeypatch, mock_db):
-    license_key = "license-inactive"
-    mock_db.create_license(license_key, "user@example.com", plan="unlimited")
-    mock_db.update_license(license_key, {"active": False})
-    monkeypatch.setattr(api, "db", mock_db)
-    result = api.has_unlimited_auto_apply(license_key)
-    assert result is False
+@pytest.mark.parametrize("license_key", ["missing", "license-inactive"])
+def test_auto_apply_limited_without_active_license(client, mock_db, license_key):
+    mock_db.create_license("license-inactive", "user@example.com", plan="unlimited")
+    mock_db.update_license("license-inactive", {"active": False})
+    job = {
+        "id": "1",
+        "title": "Software Engineer",
+        "company": "Acme",
+        "location": "Remote",
+        "url": "https://example.com/job/1",
+        "source": "dummy",
+        "remote": True,
+    }
+    response = client.post(
+        "/api/jobs/auto-apply",
+        json={
+            "device_fingerprint": "device-apply-3",
+            "jobs": [job],
+            "license_key": license_key,
+            "profile": {
+                "full_name": "Test User",
+                "email": "test@example.com",
+                "resume_url": "https://example.com/resume.pdf",
+            },
+        },
+    )
+    assert response.status_code == 200
+    assert response.json()["unlimited"] is False
@@ -147,3 +147,73 @@ async def test_adblock_library_handles_exception(monkeypatch, tmp_path):
 
     response = await main.adblock_library()
     assert "Error loading anti-adblock library" in response.body.decode()
+
+
+def test_lifespan_flushes_database_on_shutdown(monkeypatch):
+    from fastapi.testclient import TestClient
+    import db as db_module
+
+    closed = []
+    monkeypatch.setattr(db_module.db, "close", lambda: closed.append(True))
+    with TestClient(main.app) as client:
+        assert client.get("/health").status_code == 200
+        assert closed == []
+    assert closed == [True]
+
+
+def test_lifespan_runs_schema_sweeper(monkeypatch):
+    from fastapi.testclient import TestClient
+    import db as db_module
+    import schema
+
+    events = []
+
+    class FakeSweeper:
+        def __init__(self, database):
+            events.append("created")
+
+        def start(self):
+            return self
+
+        def stop(self):
+            events.append("stopped")
+
+    monkeypatch.setattr(schema, "DB_SCHEMA_SWEEP", True)
+    monkeypatch.setattr(schema, "SchemaSweeper", FakeSweeper)
+    monkeypatch.setattr(db_module.db, "close", lambda: None)
+    with TestClient(main.app):
+        assert events == ["created"]
+    assert events == ["created", "stopped"]
+
+
+def test_lifespan_runs_expiry_scheduler(monkeypatch):
+    from fastapi.testclient import TestClient
+    import api
+    import db as db_module
+    import expiry
+
+    events = []
+    monkeypatch.setattr(expiry, "LICENSE_EXPIRY_SWEEP", True)
+    monkeypatch.setattr(api.expiry_scheduler, "start", lambda: events.append("started"))
+    monkeypatch.setattr(api.expiry_scheduler, "stop", lambda: events.append("stopped"))
+    monkeypatch.setattr(db_module.db, "close", lambda: None)
+    with TestClient(main.app):
+        assert events == ["started"]
+    assert events == ["started", "stopped"]
+
+
+def test_lifespan_closes_upstream_clients(monkeypatch):
+    from fastapi.testclient import TestClient
+    import api
+    import db as db_module
+
+    closed = []
+
+    async def aclose():
+        closed.append(True)
+
+    monkeypatch.setattr(api.upstream, "aclose", aclose)
+    monkeypatch.setattr(db_module.db, "close", lambda: None)
+    with TestClient(main.app):
+        assert closed == []
+    assert closed == [True]
@@ -0,0 +1,174 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import api
+from main import app
+from upstream import UpstreamClients
+
+pytestmark = pytest.mark.integration
+
+CHUNKS = [{"candidates": [{"content": {"parts": [{"text": f"part {i}"}]}}]} for i in range(5)]
+
+
+class FakeGemini:
+    """Local streamGenerateContent stand-in speaking chunked HTTP/1.1 SSE"""
+
+    def __init__(self, status=200, chunks=CHUNKS, truncate=False, delay=0.0):
+        self.status = status
+        self.chunks = chunks
+        self.truncate = truncate
+        self.delay = delay
+        self.requests = []
+        self.sent = 0
+        self.disconnected = asyncio.Event()
+        self.finished = asyncio.Event()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode().split("\r\n")
+        length = next(int(l.split(":")[1]) for l in lines if l.lower().startswith("content-length"))
+        self.requests.append((lines[0], json.loads(await reader.readexactly(length))))
+
+        async def watch():
+            await reader.read()  # EOF: the client went away
+            self.disconnected.set()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            if self.status != 200:
+                body = b"quota exceeded"
+                writer.write(b"HTTP/1.1 %d Error\r\ncontent-length: %d\r\n\r\n%s"
+                             % (self.status, len(body), body))
+                await writer.drain()
+                return
+            writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\n"
+                         b"transfer-encoding: chunked\r\n\r\n")
+            for chunk in self.chunks:
+                if self.disconnected.is_set():
+                    return
+                event = b"data: %s\r\n\r\n" % json.dumps(chunk).encode()
+                writer.write(b"%x\r\n%s\r\n" % (len(event), event))
+                await writer.drain()
+                self.sent += 1
+                await asyncio.sleep(self.delay)
+            if not self.truncate:
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.finished.set()
+            await asyncio.sleep(0.05)
+            watcher.cancel()
+            writer.close()
+
+
+@pytest.fixture
+async def gemini(monkeypatch):
+    servers = []
+
+    async def start(**kwargs):
+        server = FakeGemini(**kwargs)
+        servers.append(server)
+        monkeypatch.setattr(api, "GEMINI_API_BASE", await server.start())
+        return server
+
+    monkeypatch.setattr(api, "GEMINI_API_KEY", "key")
+    monkeypatch.setattr(api, "upstream", UpstreamClients(http2=False))
+    yield start
+    await api.upstream.aclose()
+    for server in servers:
+        await server.stop()
+
+
+async def post(format="sse"):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.post(
+            "/api/proxy-ai/stream",
+            params={"format": format},
+            json={"prompt": "Write a cover letter", "device_fingerprint": "dev"},
+        )
+
+
+@pytest.mark.anyio
+async def test_relays_sse(gemini):
+    server = await gemini()
+    response = await post()
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["cache-control"] == "no-cache"
+    events = [e for e in response.text.split("\n\n") if e]
+    assert [json.loads(e[len("data: "):]) for e in events] == CHUNKS
+
+    request_line, body = server.requests[0]
+    assert request_line.startswith(
+        "POST /v1/models/gemini-2.5-flash:streamGenerateContent?alt=sse "
+    )
+    assert body == {"contents": [{"parts": [{"text": "Write a cover letter"}]}]}
+
+
+@pytest.mark.anyio
+async def test_relays_ndjson(gemini):
+    await gemini()
+    response = await post("ndjson")
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == CHUNKS
+
+
+@pytest.mark.anyio
+async def test_upstream_errors(gemini, monkeypatch):
+    await gemini(status=429)
+    response = await post()
+    assert response.status_code == 429
+    assert response.json()["detail"] == "AI service error: quota exceeded"
+
+    # A stream cut off midway ends with an error event
+    await gemini(truncate=True)
+    response = await post()
+    events = [e for e in response.text.split("\n\n") if e]
+    assert len(events) == len(CHUNKS) + 1
+    assert events[-1].startswith("event: error\ndata: ")
+
+    assert (await post("xml")).status_code == 400
+    monkeypatch.setattr(api, "GEMINI_API_BASE", "http://127.0.0.1:1")
+    assert (await post()).status_code == 500
+    monkeypatch.setattr(api, "GEMINI_API_KEY", "")
+    assert (await post()).status_code == 500
+
+
+@pytest.mark.anyio
+async def test_upstream_timeout(gemini, monkeypatch):
+    def handler(request):
+        raise httpx.ReadTimeout("timeout")
+
+    monkeypatch.setattr(
+        api, "upstream", UpstreamClients(transport=httpx.MockTransport(handler))
+    )
+    assert (await post()).status_code == 504
+
+
+@pytest.mark.anyio
+async def test_disconnect_closes_upstream(gemini):
+    server = await gemini(chunks=CHUNKS * 20, delay=0.01)
+    response = await api.proxy_ai_stream(
+        api.AIProxyRequest(prompt="hi", device_fingerprint="dev"), "sse"
+    )
+    first = await response.body_iterator.__anext__()
+    assert json.loads(first[len("data: "):]) == CHUNKS[0]
+    # What Starlette does when the client goes away
+    await response.body_iterator.aclose()
+    await asyncio.wait_for(server.disconnected.wait(), 2)
+    await asyncio.wait_for(server.finished.wait(), 2)
+    assert server.sent < len(CHUNKS) * 20
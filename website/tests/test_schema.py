@@ -0,0 +1,153 @@
+import json
+
+import pytest
+
+import db as db_module
+import schema
+from db import Database
+from db_sqlite import SQLiteDatabase
+
+pytestmark = pytest.mark.unit
+
+OLD_LICENSE = {"active": True, "user_id": "a@b.c", "start_date": "2026-01-01T00:00:00",
+               "created_at": "2026-01-01T00:00:00"}
+OLD_USAGE = {"count": 2, "license_key": None, "last_used": None,
+             "created_at": "2026-01-01T00:00:00"}
+
+
+@pytest.fixture
+def upgrades(monkeypatch):
+    """Licenses at v3 (plan default, then tier rename), usage at v2"""
+    monkeypatch.setattr(schema, "UPGRADES", {table: [] for table in schema.TABLES})
+
+    @schema.upgrade_to("licenses", 2)
+    def licenses_v2(record):
+        record.setdefault("plan", "standard")
+        return record
+
+    @schema.upgrade_to("licenses", 3)
+    def licenses_v3(record):
+        record["tier"] = record.pop("plan")
+        return record
+
+    @schema.upgrade_to("usage", 2)
+    def usage_v2(record):
+        record["apply_count"] = record.pop("last_auto_apply_count", 0)
+        return record
+
+
+def test_no_upgrades_means_records_are_untouched():
+    record = dict(OLD_USAGE)
+    assert schema.upgrade("usage", record) is record
+    assert schema.stamp("usage", {}) == {}
+    assert schema.upgrade("usage", None) is None
+
+
+def test_upgrade_chain(upgrades):
+    assert schema.current_version("licenses") == 3
+    upgraded = schema.upgrade("licenses", OLD_LICENSE)
+    assert upgraded == {**OLD_LICENSE, "tier": "standard", "_v": 3}
+    assert "_v" not in OLD_LICENSE  # the input is never modified
+    assert schema.upgrade("licenses", upgraded) is upgraded
+
+    v2 = {**OLD_LICENSE, "plan": "pro", "_v": 2}
+    assert schema.upgrade("licenses", v2)["tier"] == "pro"
+    # Written by a newer deploy: left alone
+    newer = {**OLD_LICENSE, "_v": 9}
+    assert schema.upgrade("licenses", newer) is newer
+
+
+def test_upgrades_register_in_order(upgrades):
+    with pytest.raises(ValueError):
+        schema.upgrade_to("usage", 4)(lambda record: record)
+
+
+@pytest.fixture
+def old_json_store(monkeypatch, tmp_path):
+    path = str(tmp_path / "data.json")
+    monkeypatch.setattr(db_module, "DB_FILE", path)
+    with open(path, "w") as f:
+        json.dump({"licenses": {"key1": OLD_LICENSE}, "usage": {"device-1": OLD_USAGE}}, f)
+    return path
+
+
+def test_json_store_upgrades_lazily(upgrades, old_json_store, monkeypatch):
+    db = Database()
+    # Cold start does not touch the records
+    assert db.data["licenses"]["key1"] == OLD_LICENSE
+    saves = []
+    monkeypatch.setattr(db, "save", lambda: saves.append(1))
+
+    license_data = db.get_license("key1")
+    assert license_data["tier"] == "standard" and license_data["_v"] == 3
+    assert db.data["licenses"]["key1"] is license_data
+    assert db.find_licenses(user_id="A@b.c")["key1"]["_v"] == 3
+    assert db.get_usage("device-1")["_v"] == 2
+    assert saves == []  # reads never write
+
+    db.increment_usage("device-1")
+    assert db.data["usage"]["device-1"]["count"] == 3
+    assert db.data["usage"]["device-1"]["_v"] == 2
+    db.update_license("key1", {"active": False})
+    assert db.get_license("key1") == {**OLD_LICENSE, "active": False, "tier": "standard", "_v": 3}
+    assert len(saves) == 2
+
+    # New records are written at the current version
+    db.create_license("key2", "c@d.e")
+    assert db.data["licenses"]["key2"]["_v"] == 3
+    assert db.get_usage("unknown")["_v"] == 2
+    db.data["licenses"]["key3"] = dict(OLD_LICENSE, start_date="2026-03-01T00:00:00")
+    db.license_indexes.update("key3", db.data["licenses"]["key3"])
+    assert [license["_v"] for _, key, license in db.scan_licenses() if key == "key3"] == [3]
+
+
+def test_json_store_sweeper(upgrades, old_json_store):
+    db = Database()
+    for i in range(5):
+        db.data["usage"][f"device-{i + 2}"] = dict(OLD_USAGE)
+    sweeper = schema.SchemaSweeper(db, batch_size=2, pause_ms=0).start()
+    assert sweeper.done.wait(5)
+    sweeper.stop()
+    assert sweeper.upgraded == 7
+
+    with open(old_json_store) as f:
+        data = json.load(f)
+    assert data["licenses"]["key1"]["_v"] == 3
+    assert all(record["_v"] == 2 for record in data["usage"].values())
+    # Nothing left to do on a second pass
+    assert sum(db.sweep_schema()) == 0
+
+
+def test_sweeper_can_be_stopped_and_survives_errors(upgrades, old_json_store, capsys):
+    db = Database()
+    sweeper = schema.SchemaSweeper(db, batch_size=1, pause_ms=60_000).start()
+    sweeper.stop()
+    assert sweeper.upgraded == 1
+
+    class Broken:
+        def sweep_schema(self, batch_size):
+            raise RuntimeError("boom")
+            yield
+
+    failing = schema.SchemaSweeper(Broken()).start()
+    assert failing.done.wait(5)
+    assert "Error during schema sweep: boom" in capsys.readouterr().out
+
+
+def test_sqlite_upgrades_on_read_and_write(upgrades, tmp_path):
+    store = SQLiteDatabase(str(tmp_path / "data.db"))
+    store.put_records("licenses", [("key1", dict(OLD_LICENSE))])
+    store.put_records("usage", [(f"device-{i}", dict(OLD_USAGE)) for i in range(5)])
+    assert store.get_license("key1")["tier"] == "standard"
+    assert store.find_licenses(user_id="a@b.c")["key1"]["_v"] == 3
+    # Reads do not write back ...
+    assert dict(store.iter_records("licenses"))["key1"] == OLD_LICENSE
+    # ... updates do
+    store.update_usage("device-0", {"email": "a@b.c"})
+    assert dict(store.iter_records("usage"))["device-0"]["_v"] == 2
+
+    # licenses: [key1]; usage: [device-0 (already current), device-1], ...
+    assert list(store.sweep_schema(batch_size=2)) == [1, 1, 2, 1]
+    assert all(record["_v"] == 2 for _, record in store.iter_records("usage"))
+    assert dict(store.iter_records("licenses"))["key1"]["_v"] == 3
+    store.close()
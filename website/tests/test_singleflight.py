@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+pytestmark = pytest.mark.unit
+
+
+class Upstream:
+    """A call that blocks until released, counting how often it starts"""
+
+    def __init__(self, result="ok", error=None):
+        self.result = result
+        self.error = error
+        self.started = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.started += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+@pytest.mark.anyio
+async def test_concurrent_calls_share_one_upstream_call():
+    flights = SingleFlight()
+    upstream = Upstream()
+    waiters = [asyncio.ensure_future(flights.do("key", upstream)) for _ in range(5)]
+    other_upstream = Upstream("other")
+    other = asyncio.ensure_future(flights.do("other", other_upstream))
+    await asyncio.sleep(0)
+    assert flights.stats() == {"in_flight": 2, "calls": 2, "shared": 4}
+
+    upstream.release.set()
+    assert await asyncio.gather(*waiters) == ["ok"] * 5
+    assert upstream.started == 1
+    other_upstream.release.set()
+    assert await other == "other"
+
+    # Finished calls are not reused
+    upstream.release = asyncio.Event()
+    upstream.release.set()
+    assert await flights.do("key", upstream) == "ok"
+    assert upstream.started == 2
+
+
+@pytest.mark.anyio
+async def test_errors_reach_every_waiter():
+    flights = SingleFlight()
+    upstream = Upstream(error=ValueError("upstream down"))
+    waiters = [asyncio.ensure_future(flights.do("key", upstream)) for _ in range(3)]
+    await asyncio.sleep(0)
+    upstream.release.set()
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+    assert [str(result) for result in results] == ["upstream down"] * 3
+    assert flights.stats()["in_flight"] == 0
+
+
+@pytest.mark.anyio
+async def test_cancelled_waiter_does_not_cancel_the_call():
+    flights = SingleFlight()
+    upstream = Upstream()
+    leader = asyncio.ensure_future(flights.do("key", upstream))
+    follower = asyncio.ensure_future(flights.do("key", upstream))
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    await asyncio.sleep(0)
+    upstream.release.set()
+    assert await follower == "ok"
+    assert leader.cancelled()
+    assert upstream.started == 1
+
+
+@pytest.mark.anyio
+async def test_abandoned_failures_are_retrieved(caplog):
+    flights = SingleFlight()
+    upstream = Upstream(error=ValueError("nobody listening"))
+    waiter = asyncio.ensure_future(flights.do("key", upstream))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    upstream.release.set()
+    for _ in range(3):
+        await asyncio.sleep(0)
+    assert flights.stats()["in_flight"] == 0
+    assert "never retrieved" not in caplog.text
@@ -0,0 +1,131 @@
+import json
+
+import pytest
+
+import db as db_module
+import snapshot
+from db import Database
+
+pytestmark = pytest.mark.unit
+
+DATA = {
+    "licenses": {"key1": {"active": True, "user_id": "user@example.com"}},
+    "usage": {
+        "device-1": {"count": 3, "license_key": "key1", "last_used": "2026-01-01T00:00:00",
+                     "created_at": "2026-01-01T00:00:00"},
+        "device-2": {"count": 0, "license_key": None, "last_used": None,
+                     "created_at": "2026-01-02T00:00:00", "email": "a@b.c",
+                     "last_auto_apply_job_ids": ["1", "2"]},
+        # Records that cannot be stored column-wise survive unchanged
+        "device-3": {"license_key": None, "email": "nope@example.com"},
+        "device-4": {"count": 1, "license_key": "\x01", "last_used": None,
+                     "created_at": None},
+        "device\x005": {"count": 1, "license_key": None, "last_used": None,
+                        "created_at": None},
+        "device-6": {"count": True, "license_key": None, "last_used": None,
+                     "created_at": None},
+    },
+}
+
+
+@pytest.mark.parametrize("compression", ["none", "zlib"])
+def test_roundtrip(compression):
+    blob = snapshot.dumps(DATA, compression)
+    assert snapshot.is_snapshot(blob)
+    assert snapshot.loads(blob) == DATA
+
+
+def test_roundtrip_empty():
+    assert snapshot.loads(snapshot.dumps({})) == {"licenses": {}, "usage": {}}
+
+
+def test_smaller_than_json():
+    data = {
+        "licenses": {},
+        "usage": {
+            f"device-{i}": {"count": i, "license_key": None, "last_used": None,
+                            "created_at": "2026-01-01T00:00:00"}
+            for i in range(1000)
+        },
+    }
+    assert len(snapshot.dumps(data, "none")) < len(json.dumps(data, indent=2)) / 2
+
+
+def test_rejects_bad_input():
+    with pytest.raises(ValueError):
+        snapshot.loads(b"{}")
+    with pytest.raises(ValueError):
+        snapshot.loads(snapshot.MAGIC + bytes([99, 0]))
+    with pytest.raises(ValueError):
+        snapshot.dumps(DATA, "lz4")
+
+
+def test_zstd_requires_package(monkeypatch):
+    monkeypatch.setattr(snapshot, "zstandard", None)
+    with pytest.raises(ValueError):
+        snapshot.dumps(DATA, "zstd")
+    with pytest.raises(ValueError):
+        snapshot.loads(snapshot.MAGIC + bytes([snapshot.VERSION, 2]))
+
+
+def test_gc_paused_restores_state():
+    import gc
+
+    with snapshot.gc_paused():
+        assert not gc.isenabled()
+    assert gc.isenabled()
+
+
+def test_convert_cli(tmp_path, capsys):
+    src = tmp_path / "db.json"
+    src.write_text(json.dumps(DATA, indent=2))
+    snap = tmp_path / "db.snap"
+    back = tmp_path / "back.json"
+
+    assert snapshot.main(["convert", str(src), str(snap)]) == 0
+    assert "Converted 1 licenses and 6 devices" in capsys.readouterr().out
+    assert snapshot.main(["convert", str(snap), str(back)]) == 0
+    assert json.loads(back.read_text()) == DATA
+
+
+def test_database_binary_snapshots(monkeypatch, tmp_path):
+    path = tmp_path / "data.json"
+    monkeypatch.setattr(db_module, "DB_FILE", str(path))
+    db = Database(snapshot_format="binary")
+    db.create_license("key1", "user@example.com")
+    db.increment_usage("device-1")
+
+    assert snapshot.is_snapshot(path.read_bytes())
+    # Either format loads regardless of the configured one
+    reloaded = Database(snapshot_format="json")
+    assert reloaded.get_usage("device-1")["count"] == 1
+    assert list(reloaded.find_licenses(user_id="user@example.com")) == ["key1"]
+
+
+def test_database_rejects_unknown_snapshot_format():
+    with pytest.raises(ValueError):
+        Database(snapshot_format="xml")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_iter_json_streams_records(chunk_size, indent):
+    import io
+
+    text = json.dumps(DATA, indent=indent)
+    records = list(snapshot.iter_json(io.StringIO(text), chunk_size))
+    assert records == [
+        (table, key, record)
+        for table, rows in DATA.items()
+        for key, record in rows.items()
+    ]
+    assert list(snapshot.iter_json(io.StringIO(' { "usage" : { } } '))) == []
+    assert list(snapshot.iter_json(io.StringIO("{}"))) == []
+
+
+def test_iter_json_rejects_bad_input():
+    import io
+
+    for text in ("", "[]", '{"usage": [1]}', '{"usage": {"a": 1}}', '{"usage": {"a": {'):
+        with pytest.raises(ValueError):
+            list(snapshot.iter_json(io.StringIO(text)))
@@ -0,0 +1,79 @@
+import asyncio
+
+import httpx
+import pytest
+
+from upstream import UpstreamClients
+
+pytestmark = pytest.mark.unit
+
+
+async def keep_alive_server():
+    """Local HTTP/1.1 server answering every request on a connection; counts connections"""
+    connections = []
+
+    async def handle(reader, writer):
+        connections.append(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                await reader.readexactly(length)
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\ncontent-type: application/json\r\n"
+                    b"content-length: 11\r\n\r\n{\"ok\":true}"
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, f"http://127.0.0.1:{port}", connections
+
+
+@pytest.mark.anyio
+async def test_connections_are_reused():
+    server, url, connections = await keep_alive_server()
+    clients = UpstreamClients(http2=False)
+    try:
+        for _ in range(3):
+            response = await clients.client("gemini").post(url, json={"prompt": "hi"})
+            assert response.json() == {"ok": True}
+        await clients.client("jobs").get(url)
+        assert len(connections) == 2
+        assert clients.stats() == {
+            "http2": False,
+            "clients": {
+                "gemini": {"requests": 3, "connections": 1, "tls_handshakes": 0,
+                           "reuse_rate": 0.6667},
+                "jobs": {"requests": 1, "connections": 1, "tls_handshakes": 0,
+                         "reuse_rate": 0.0},
+            },
+        }
+
+        # Closed clients are replaced on next use; counters carry on
+        await clients.aclose()
+        await clients.client("gemini").get(url)
+        assert len(connections) == 3
+        assert clients.stats()["clients"]["gemini"]["connections"] == 2
+    finally:
+        await clients.aclose()
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.anyio
+async def test_injected_transport():
+    clients = UpstreamClients(
+        transport=httpx.MockTransport(lambda request: httpx.Response(204))
+    )
+    first = clients.client("gemini")
+    assert clients.client("gemini") is first
+    assert (await first.get("https://example.invalid/")).status_code == 204
+    assert clients.stats()["clients"]["gemini"]["requests"] == 1
+    await clients.aclose()
+    assert first.is_closed
@@ -0,0 +1,291 @@
+import os
+
+import pytest
+
+import db as db_module
+from db import Database
+from usage_store import (
+    HASHED_PREFIX,
+    BloomFilter,
+    CompactUsageTable,
+    TieredUsageTable,
+    UsageRecord,
+    decode_timestamp,
+    encode_timestamp,
+    hash_fingerprint,
+)
+
+pytestmark = pytest.mark.unit
+
+RECORD = {
+    "count": 3,
+    "license_key": "HA-SUB-1-2-3",
+    "last_used": "2026-01-02T03:04:05.123456",
+    "created_at": "2026-01-01T00:00:00",
+    "email": "a@b.c",
+}
+
+
+def test_hash_fingerprint_is_fixed_width_and_idempotent():
+    digest = hash_fingerprint("x" * 500)
+    assert len(digest) == 16
+    assert hash_fingerprint(HASHED_PREFIX + digest.hex()) == digest
+    # Prefix-shaped strings that are not hex are hashed like any other key
+    assert len(hash_fingerprint(HASHED_PREFIX + "z" * 32)) == 16
+
+
+@pytest.mark.parametrize(
+    "value",
+    ["2026-01-02T03:04:05.123456", "2026-01-02T03:04:05", "1969-12-31T23:59:59"],
+)
+def test_timestamps_roundtrip_as_ints(value):
+    encoded = encode_timestamp(value)
+    assert type(encoded) is int
+    assert decode_timestamp(encoded) == value
+
+
+@pytest.mark.parametrize(
+    "value", [None, "yesterday", "2026-01-02", "2026-01-02T03:04:05+00:00"]
+)
+def test_non_canonical_timestamps_are_kept(value):
+    assert encode_timestamp(value) == value
+    assert decode_timestamp(value) == value
+
+
+def test_usage_record_roundtrip():
+    record = UsageRecord(RECORD)
+    assert record.to_dict() == RECORD
+    assert list(record.to_dict()) == list(RECORD)
+    assert UsageRecord({"email": "a@b.c"}).to_dict() == {"email": "a@b.c"}
+
+
+def test_license_keys_are_interned():
+    first = UsageRecord({"license_key": "".join(["HA-SUB-", "9"])})
+    second = UsageRecord({"license_key": "".join(["HA-SUB-", "9"])})
+    assert first.license_key is second.license_key
+
+
+def test_table_mapping_protocol():
+    table = CompactUsageTable({"device-1": RECORD})
+    table["device-2"] = {"count": 0}
+    assert table["device-1"] == RECORD
+    assert "device-1" in table and "device-3" not in table and 5 not in table
+    assert len(table) == 2
+
+    keys = list(table)
+    assert all(k.startswith(HASHED_PREFIX) for k in keys)
+    assert table[keys[0]] == RECORD  # hashed keys resolve to the same record
+    assert dict(table.items())[keys[1]] == {"count": 0}
+
+    del table["device-1"]
+    assert len(table) == 1
+    with pytest.raises(KeyError):
+        table["device-1"]
+
+
+def test_returned_records_are_copies():
+    table = CompactUsageTable({"device-1": RECORD})
+    table["device-1"]["count"] = 100
+    assert table["device-1"]["count"] == 3
+
+
+class TestCompactDatabase:
+    @pytest.fixture
+    def db_path(self, monkeypatch, tmp_path):
+        path = str(tmp_path / "data.json")
+        monkeypatch.setattr(db_module, "DB_FILE", path)
+        return path
+
+    def test_usage_api_is_unchanged(self, db_path):
+        db = Database(compact_usage=True)
+        assert db.get_usage("device-1")["count"] == 0
+        db.increment_usage("device-1")
+        db.update_usage("device-1", {"license_key": "key1", "email": "a@b.c"})
+        usage = db.get_usage("device-1")
+        assert usage["count"] == 1
+        assert usage["license_key"] == "key1"
+        assert usage["email"] == "a@b.c"
+        assert isinstance(db.data["usage"], CompactUsageTable)
+
+    @pytest.mark.parametrize("snapshot_format", ["json", "binary"])
+    def test_snapshot_roundtrip(self, db_path, snapshot_format):
+        db = Database(compact_usage=True, snapshot_format=snapshot_format)
+        db.increment_usage("device-1")
+        db.increment_usage("device-1")
+
+        reloaded = Database(compact_usage=True)
+        assert isinstance(reloaded.data["usage"], CompactUsageTable)
+        assert reloaded.get_usage("device-1")["count"] == 2
+
+    def test_scan_usage_lists_hashed_keys(self, db_path):
+        db = Database(compact_usage=True)
+        db.increment_usage("device-1")
+        assert [k for _, k, _ in db.scan_usage("count")] == [
+            CompactUsageTable.stored_key("device-1")
+        ]
+        db.increment_usage("device-1")
+        db.increment_usage("device-2")
+        page = db.scan_usage("count")
+        assert [(count, usage["count"]) for count, _, usage in page] == [(1, 1), (2, 2)]
+
+    def test_plain_snapshot_loads_into_compact_table(self, db_path):
+        Database().increment_usage("device-1")
+        assert Database(compact_usage=True).get_usage("device-1")["count"] == 1
+
+    def test_journal_replay(self, db_path):
+        db = Database(compact_usage=True, journal=True)
+        db.increment_usage("device-1")
+        assert Database(compact_usage=True, journal=True).get_usage("device-1")["count"] == 1
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000)
+    keys = [f"device-{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300  # ~1% target rate
+
+
+class TestTieredUsageTable:
+    @pytest.fixture
+    def table(self, tmp_path):
+        table = TieredUsageTable(str(tmp_path / "data.cold"), hot_capacity=2)
+        yield table
+        table.close()
+
+    def test_capacity_must_be_positive(self, tmp_path):
+        with pytest.raises(ValueError):
+            TieredUsageTable(str(tmp_path / "data.cold"), hot_capacity=0)
+
+    def test_cold_records_fault_back_in(self, table):
+        for i in range(5):
+            table[f"device-{i}"] = {"count": i}
+        stats = table.stats()
+        assert stats["hot_records"] == 2
+        assert stats["cold_records"] == 3
+        assert stats["evictions"] == 3
+        assert len(table) == 5
+
+        assert table["device-0"] == {"count": 0}  # fault from the cold tier
+        assert table["device-0"] == {"count": 0}  # now a hot hit
+        stats = table.stats()
+        assert stats["faults"] == 1
+        assert stats["hits"] == 1
+        assert stats["hot_records"] == 2
+        assert len(table) == 5
+
+    def test_misses(self, table):
+        assert "device-1" not in table
+        assert 5 not in table
+        with pytest.raises(KeyError):
+            table["device-1"]
+        assert table.stats()["misses"] == 3
+        assert table.stats()["hit_rate"] == 0.0
+
+    def test_unknown_keys_are_filtered_before_the_cold_tier(self, table):
+        for i in range(5):
+            table[f"device-{i}"] = {"count": i}
+        queries = []
+        table._cold.set_trace_callback(queries.append)
+        for i in range(1000):
+            assert f"unknown-{i}" not in table
+        stats = table.stats()
+        assert stats["misses"] == 1000
+        assert stats["filtered"] >= 990
+        assert len(queries) == 1000 - stats["filtered"]
+
+    def test_bloom_filter_grows_with_the_table(self, table):
+        records = {f"device-{i}": {"count": i} for i in range(100)}
+        table.update(records)
+        assert table._bloom.capacity >= 100
+        assert all(key in table for key in records)
+        assert table.stats()["filtered"] == 0  # no key lost by regrowing
+
+    def test_lru_order_follows_access(self, table):
+        table["a"] = {"count": 1}
+        table["b"] = {"count": 2}
+        assert "a" in table  # a is now most recently used
+        table["c"] = {"count": 3}  # evicts b
+        assert table.stats()["cold_records"] == 1
+        assert [k for k, _ in table.items()][:2] == ["a", "c"]
+
+    def test_overwrite_cold_key_without_lookup(self, table):
+        for key in ("a", "b", "c"):
+            table[key] = {"count": 0}
+        table["a"] = {"count": 9}  # "a" was cold; no stale copy may remain
+        assert len(table) == 3
+        assert dict(table.items())["a"] == {"count": 9}
+        table["a"] = {"count": 10}
+        assert table["a"] == {"count": 10}
+
+    def test_delete_from_either_tier(self, table):
+        for key in ("a", "b", "c"):
+            table[key] = {"count": 0}
+        del table["a"]  # cold
+        del table["c"]  # hot
+        with pytest.raises(KeyError):
+            del table["missing"]
+        assert list(table) == ["b"]
+
+    def test_iteration_streams_every_record_without_promoting(self, table):
+        records = {f"device-{i}": {"count": i} for i in range(2500)}
+        table.update(records)
+        faults = table.stats()["faults"]
+        assert dict(table.items()) == records
+        assert sorted(table) == sorted(records)
+        assert table.stats()["faults"] == faults
+
+    def test_initial_records(self, tmp_path):
+        table = TieredUsageTable(str(tmp_path / "x.cold"), 1, {"a": {"count": 1}, "b": {}})
+        assert len(table) == 2
+        table.close()
+
+    def test_spill_files_are_private(self, tmp_path):
+        path = str(tmp_path / "data.cold")
+        stale = tmp_path / "data.cold.dead"
+        stale.write_bytes(b"left by a crashed process")
+        first = TieredUsageTable(path, hot_capacity=1)
+        assert not stale.exists()
+
+        first.update({"a": {"count": 1}, "b": {"count": 2}})
+        second = TieredUsageTable(path, hot_capacity=1)  # e.g. a CLI tool
+        second.update({"a": {"count": 7}, "c": {"count": 3}})
+        assert first.path != second.path
+        assert first["a"] == {"count": 1} and first["b"] == {"count": 2}
+        assert first.stats()["cold_records"] == 1
+
+        first.close()
+        assert not os.path.exists(first.path)
+        assert os.path.exists(second.path)
+        second.close()
+
+
+class TestTieredDatabase:
+    @pytest.fixture
+    def db_path(self, monkeypatch, tmp_path):
+        path = str(tmp_path / "data.json")
+        monkeypatch.setattr(db_module, "DB_FILE", path)
+        return path
+
+    def test_exclusive_with_compact(self, db_path):
+        with pytest.raises(ValueError):
+            Database(compact_usage=True, hot_usage_records=10)
+
+    def test_bounded_memory_roundtrip(self, db_path):
+        db = Database(hot_usage_records=3)
+        for i in range(10):
+            db.increment_usage(f"device-{i}")
+        db.increment_usage("device-0")
+
+        stats = db.stats()
+        assert stats["usage"] == 10
+        assert stats["usage_table"]["hot_records"] == 3
+        assert stats["usage_table"]["faults"] >= 1
+        assert db.get_usage("device-0")["count"] == 2
+        db.close()
+
+        reloaded = Database(hot_usage_records=3)
+        assert reloaded.get_usage("device-5")["count"] == 1
+        assert len(reloaded.data["usage"]) == 10
@@ -0,0 +1,109 @@
+"""
+Pooled HTTP clients for upstream services
+
+proxy_ai and fetch_jobs used to build an httpx.AsyncClient per request, so
+every call paid a TCP (and TLS) handshake. UpstreamClients keeps one
+long-lived client per upstream ("gemini", "jobs") with a bounded pool and
+keep-alive, created on first use and closed by the app lifespan. HTTP/2
+(h2, installed through httpx[http2] in requirements.txt) is negotiated
+unless UPSTREAM_HTTP2=0; requests then share one multiplexed connection
+per host. Environments without h2 fall back to HTTP/1.1.
+
+Pool usage is counted through httpcore's trace extension: requests sent,
+connections opened and TLS handshakes, so the reuse rate shows up in
+/api/admin/stats.
+
+Tests and benchmarks pass their own `transport` (e.g. httpx.MockTransport)
+or point GEMINI_API_BASE / JOB_API_BASE_URL at a local stand-in server.
+"""
+
+import os
+from typing import Dict, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401 - enables http2=True in httpx
+except ImportError:  # pragma: no cover - optional dependency
+    h2 = None
+
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.environ.get("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_HTTP2 = (
+    os.environ.get("UPSTREAM_HTTP2", "1").lower() in ("1", "true", "yes") and h2 is not None
+)
+
+
+class UpstreamStats:
+    """Counters for one upstream client"""
+
+    __slots__ = ("requests", "connections", "tls_handshakes")
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+
+    async def trace(self, event: str, info: Dict):
+        if event == "connection.connect_tcp.complete":
+            self.connections += 1
+        elif event == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+
+    async def on_request(self, request: httpx.Request):
+        self.requests += 1
+        request.extensions["trace"] = self.trace
+
+    def as_dict(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "connections": self.connections,
+            "tls_handshakes": self.tls_handshakes,
+            "reuse_rate": (
+                round(1 - self.connections / self.requests, 4) if self.requests else 0.0
+            ),
+        }
+
+
+class UpstreamClients:
+    """One pooled AsyncClient per upstream name, built on first use"""
+
+    def __init__(
+        self,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        http2: Optional[bool] = None,
+    ):
+        self.transport = transport
+        self.http2 = UPSTREAM_HTTP2 if http2 is None else http2
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._stats: Dict[str, UpstreamStats] = {}
+
+    def client(self, name: str) -> httpx.AsyncClient:
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            stats = self._stats.setdefault(name, UpstreamStats())
+            client = httpx.AsyncClient(
+                transport=self.transport,
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=UPSTREAM_MAX_CONNECTIONS,
+                    max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+                    keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+                ),
+                event_hooks={"request": [stats.on_request]},
+            )
+            self._clients[name] = client
+        return client
+
+    async def aclose(self):
+        """Close every client (app shutdown); later calls open new ones"""
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    def stats(self) -> Dict:
+        return {
+            "http2": self.http2,
+            "clients": {name: stats.as_dict() for name, stats in self._stats.items()},
+        }
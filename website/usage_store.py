@@ -0,0 +1,390 @@
+"""
+Memory-efficient containers for the usage table
+
+CompactUsageTable is a drop-in MutableMapping for Database.data["usage"]
+(DB_COMPACT_USAGE=1). Records live in __slots__ objects instead of dicts,
+ISO timestamps are stored as integer microseconds since the epoch, license
+keys are interned and device fingerprints are replaced by 16-byte BLAKE2b
+digests. Reads still return the same dict shape as the plain JSON store.
+
+Hashing is one-way: iterating the table yields HASHED_PREFIX + hex digest
+keys, which is what snapshots written in compact mode contain. Those keys
+are recognised (not re-hashed) when loaded back.
+
+TieredUsageTable (DB_HOT_USAGE_RECORDS > 0) bounds memory instead: only the
+most recently used devices stay in an in-memory LRU hot set, the rest are
+spilled to an indexed SQLite file and faulted back in on access. A Bloom
+filter over every stored key answers most lookups for unknown devices
+without touching the cold file. Each table spills to a file of its own
+(the given path plus a random suffix) that it holds an exclusive flock on,
+so a second process opening the same store never touches it; files whose
+owner died without close() are unlocked and get deleted by the next table.
+"""
+
+import fcntl
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import ItemsView, MutableMapping
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Optional, Union
+
+HASHED_PREFIX = "#"
+DIGEST_SIZE = 16
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_MISSING = object()
+_TIMESTAMPS = ("last_used", "created_at")
+
+
+def hash_fingerprint(device_fingerprint: str) -> bytes:
+    """Fixed-width key for a device fingerprint (idempotent for hashed keys)"""
+    if (
+        device_fingerprint.startswith(HASHED_PREFIX)
+        and len(device_fingerprint) == len(HASHED_PREFIX) + DIGEST_SIZE * 2
+    ):
+        try:
+            return bytes.fromhex(device_fingerprint[len(HASHED_PREFIX):])
+        except ValueError:
+            pass
+    return hashlib.blake2b(
+        device_fingerprint.encode(), digest_size=DIGEST_SIZE
+    ).digest()
+
+
+def encode_timestamp(value) -> Union[int, str, None]:
+    """ISO timestamp -> int microseconds; anything unparseable is kept as-is"""
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+        if parsed.tzinfo is None and parsed.isoformat() == value:
+            return (parsed - _EPOCH) // _MICROSECOND
+    return value
+
+
+def decode_timestamp(value):
+    if type(value) is int:
+        return (_EPOCH + value * _MICROSECOND).isoformat()
+    return value
+
+
+class UsageRecord:
+    """One device's usage; absent fields hold the _MISSING sentinel"""
+
+    __slots__ = ("count", "license_key", "last_used", "created_at", "extra")
+
+    def __init__(self, record: Dict):
+        count = record.get("count", _MISSING)
+        license_key = record.get("license_key", _MISSING)
+        self.count = count
+        self.license_key = (
+            sys.intern(license_key) if type(license_key) is str else license_key
+        )
+        self.last_used = encode_timestamp(record.get("last_used", _MISSING))
+        self.created_at = encode_timestamp(record.get("created_at", _MISSING))
+        extra = {
+            k: v
+            for k, v in record.items()
+            if k not in ("count", "license_key", "last_used", "created_at")
+        }
+        self.extra: Optional[Dict] = extra or None
+
+    def to_dict(self) -> Dict:
+        record = {}
+        if self.count is not _MISSING:
+            record["count"] = self.count
+        if self.license_key is not _MISSING:
+            record["license_key"] = self.license_key
+        for field in _TIMESTAMPS:
+            value = getattr(self, field)
+            if value is not _MISSING:
+                record[field] = decode_timestamp(value)
+        if self.extra:
+            record.update(self.extra)
+        return record
+
+
+class CompactUsageTable(MutableMapping):
+    """Usage table keyed by hashed fingerprint, storing UsageRecord objects"""
+
+    def __init__(self, records: Optional[Dict] = None):
+        self._records: Dict[bytes, UsageRecord] = {}
+        if records:
+            self.update(records)
+
+    def __getitem__(self, device_fingerprint: str) -> Dict:
+        return self._records[hash_fingerprint(device_fingerprint)].to_dict()
+
+    def __setitem__(self, device_fingerprint: str, record: Dict):
+        self._records[hash_fingerprint(device_fingerprint)] = UsageRecord(record)
+
+    def __delitem__(self, device_fingerprint: str):
+        del self._records[hash_fingerprint(device_fingerprint)]
+
+    def __contains__(self, device_fingerprint) -> bool:
+        return (
+            isinstance(device_fingerprint, str)
+            and hash_fingerprint(device_fingerprint) in self._records
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        for digest in self._records:
+            yield HASHED_PREFIX + digest.hex()
+
+    @staticmethod
+    def stored_key(device_fingerprint: str) -> str:
+        """The key a fingerprint is listed under when iterating the table"""
+        return HASHED_PREFIX + hash_fingerprint(device_fingerprint).hex()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def items(self) -> ItemsView:
+        return _UsageItems(self)
+
+
+class _UsageItems(ItemsView):
+    """Iterates stored records directly instead of re-hashing every key"""
+
+    def __iter__(self):
+        for digest, record in self._mapping._records.items():
+            yield HASHED_PREFIX + digest.hex(), record.to_dict()
+
+
+class BloomFilter:
+    """Set membership with false positives but no false negatives"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(capacity, 1)
+        bits = math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.size = max(bits, 8)
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        # Double hashing: k positions from one 128-bit digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+def _create_spill_file(path: str):
+    """
+    A new `path`.<random> file and an open handle holding an exclusive
+    flock on it, after deleting siblings no live process holds
+    """
+    directory, prefix = os.path.split(os.path.abspath(path))
+    for name in os.listdir(directory):
+        if name.startswith(prefix + "."):
+            stale = os.path.join(directory, name)
+            try:
+                with open(stale, "rb") as f:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.remove(stale)
+            except OSError:
+                continue  # locked by its owner, or already gone
+    # Locked under a name the sweep above ignores, then renamed into place
+    fd, new_path = tempfile.mkstemp(prefix=prefix + "~", dir=directory)
+    owner = os.fdopen(fd, "rb")
+    fcntl.flock(owner, fcntl.LOCK_EX)
+    suffix = os.path.basename(new_path)[len(prefix) + 1:]
+    spill_path = os.path.join(directory, f"{prefix}.{suffix}")
+    os.rename(new_path, spill_path)
+    return spill_path, owner
+
+
+class TieredUsageTable(MutableMapping):
+    """
+    Usage table with a bounded LRU hot set and an on-disk cold tier.
+    A key lives in exactly one tier. The cold file is a private spill area
+    named after `path`; snapshots and the journal remain the source of truth.
+    """
+
+    def __init__(self, path: str, hot_capacity: int, records: Optional[Dict] = None):
+        if hot_capacity < 1:
+            raise ValueError("hot_capacity must be at least 1")
+        self.path = path
+        self.hot_capacity = hot_capacity
+        self.hits = 0
+        self.misses = 0
+        self.faults = 0
+        self.evictions = 0
+        self.filtered = 0
+        self._bloom = BloomFilter(hot_capacity * 4)
+        self._hot: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.path, self._owner = _create_spill_file(path)
+        # Autocommit: a spill file needs no transactions, and an open one
+        # would keep the file write-locked between statements
+        self._cold = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        self._cold.execute("PRAGMA journal_mode=OFF")
+        self._cold.execute("PRAGMA synchronous=OFF")
+        self._cold.execute(
+            "CREATE TABLE cold (key TEXT PRIMARY KEY, record TEXT NOT NULL)"
+        )
+        self._cold_count = 0
+        if records:
+            self.update(records)
+
+    def _fault_in(self, key) -> bool:
+        """Move a cold record into the hot set; False if the key is unknown"""
+        row = self._cold.execute(
+            "SELECT record FROM cold WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return False
+        self._cold.execute("DELETE FROM cold WHERE key = ?", (key,))
+        self._cold_count -= 1
+        self.faults += 1
+        self._hot[key] = json.loads(row[0])
+        self._evict()
+        return True
+
+    def _evict(self):
+        while len(self._hot) > self.hot_capacity:
+            key, record = self._hot.popitem(last=False)
+            self._cold.execute(
+                "INSERT INTO cold (key, record) VALUES (?, ?)",
+                (key, json.dumps(record)),
+            )
+            self._cold_count += 1
+            self.evictions += 1
+
+    def _lookup(self, key) -> bool:
+        if key in self._hot:
+            self._hot.move_to_end(key)
+            self.hits += 1
+            return True
+        if not isinstance(key, str) or key not in self._bloom:
+            self.filtered += 1
+        elif self._fault_in(key):
+            return True
+        self.misses += 1
+        return False
+
+    def _remember(self, key: str):
+        """Add a new key to the Bloom filter, regrowing it when it fills up"""
+        if self._bloom.count >= self._bloom.capacity:
+            bloom = BloomFilter(self._bloom.capacity * 2)
+            for existing in self._hot:
+                bloom.add(existing)
+            for (existing,) in self._cold.execute("SELECT key FROM cold"):
+                bloom.add(existing)
+            self._bloom = bloom
+        self._bloom.add(key)
+
+    def __getitem__(self, key: str) -> Dict:
+        with self._lock:
+            if not self._lookup(key):
+                raise KeyError(key)
+            return self._hot[key]
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return self._lookup(key)
+
+    def __setitem__(self, key: str, record: Dict):
+        with self._lock:
+            if key in self._hot:
+                self._hot.move_to_end(key)
+            else:
+                deleted = 0
+                if self._cold_count and key in self._bloom:
+                    deleted = self._cold.execute(
+                        "DELETE FROM cold WHERE key = ?", (key,)
+                    ).rowcount
+                    self._cold_count -= deleted
+                if not deleted:
+                    self._remember(key)
+            self._hot[key] = record
+            self._evict()
+
+    def __delitem__(self, key: str):
+        with self._lock:
+            if key in self._hot:
+                del self._hot[key]
+                return
+            deleted = self._cold.execute(
+                "DELETE FROM cold WHERE key = ?", (key,)
+            ).rowcount
+            if not deleted:
+                raise KeyError(key)
+            self._cold_count -= deleted
+
+    def __len__(self) -> int:
+        return len(self._hot) + self._cold_count
+
+    def __iter__(self) -> Iterator[str]:
+        for key, _record in self.items():
+            yield key
+
+    def items(self) -> ItemsView:
+        return _TieredItems(self)
+
+    def stats(self) -> Dict[str, int]:
+        lookups = self.hits + self.faults + self.misses
+        return {
+            "hot_records": len(self._hot),
+            "cold_records": self._cold_count,
+            "hot_capacity": self.hot_capacity,
+            "hits": self.hits,
+            "faults": self.faults,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "filtered": self.filtered,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._cold.close()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self._owner.close()
+
+
+class _TieredItems(ItemsView):
+    """
+    Hot records first, then the cold file streamed in batches. The table
+    lock is held for the whole pass so the view is consistent; iteration
+    does not count as access, so it neither promotes nor evicts.
+    """
+
+    def __iter__(self):
+        table = self._mapping
+        with table._lock:
+            yield from list(table._hot.items())
+            cursor = table._cold.execute("SELECT key, record FROM cold")
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                for key, record in rows:
+                    yield key, json.loads(record)